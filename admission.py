@@ -0,0 +1,218 @@
+"""
+URBAN 文案機器人 - Gemini 呼叫的准入控制 (admission control)
+每個模型在每個 worker 內有同時呼叫數上限與有上限的等待佇列：
+- 有空位時直接進入；沒有空位時排隊（先到先得），最多等 max_wait 秒
+  （retry 傳入 ADMISSION_MAX_WAIT 與請求剩餘時間預算的較小者）
+- 佇列已滿或等待逾時立即拋出 Overloaded，API 回傳 503 + Retry-After，而不是讓請求卡到逾時
+同一個 limiter 同時給執行緒（WSGI、背景任務、hedge）與 asyncio（ASGI）使用。
+"""
+
+import asyncio
+import contextlib
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+import config
+import routing
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """模型的同時呼叫數與等待佇列都已滿（或等待逾時）。"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """排隊中的呼叫；空位直接轉交給它（granted=True）後再喚醒。"""
+
+    def __init__(self, event: threading.Event | None = None,
+                 future: asyncio.Future | None = None, loop: asyncio.AbstractEventLoop | None = None):
+        self.event = event
+        self.future = future
+        self.loop = loop
+        self.granted = False
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ModelLimiter:
+    """單一模型的同時呼叫數上限 + 等待佇列。"""
+
+    def __init__(self, model: str, limit: int, queue_limit: int):
+        self.model = model
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self._active = 0
+        self._queue: deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._counters = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0, "max_queue_depth": 0}
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def _retry_after(self) -> int:
+        """建議的重試秒數：約為這個模型一次呼叫的時間。"""
+        latency = routing.health.latency_percentile(self.model, 0.5, 1)
+        return max(1, math.ceil(latency or config.ADMISSION_RETRY_AFTER))
+
+    def _try_enter(self, waiter_factory) -> _Waiter | None:
+        """有空位時佔用並回傳 None；否則排入佇列並回傳 waiter；佇列已滿時拋出 Overloaded。"""
+        with self._lock:
+            if self._active < self.limit and not self._queue:
+                self._active += 1
+                self._counters["admitted"] += 1
+                return None
+            if len(self._queue) >= self.queue_limit:
+                self._counters["rejected"] += 1
+                rejected = True
+            else:
+                rejected = False
+                waiter = waiter_factory()
+                self._queue.append(waiter)
+                self._counters["queued"] += 1
+                self._counters["max_queue_depth"] = max(self._counters["max_queue_depth"], len(self._queue))
+        if rejected:
+            logger.warning("模型 %s 呼叫已滿（%d 進行中，%d 排隊），拒絕請求", self.model, self.limit, self.queue_limit)
+            raise Overloaded("AI 服務忙碌中，請稍後再試", self._retry_after())
+        return waiter
+
+    def _admitted_after_wait(self, waited: float) -> None:
+        with self._lock:
+            self._counters["admitted"] += 1
+            self._waits += 1
+            self._wait_seconds += waited
+            self._max_wait_seconds = max(self._max_wait_seconds, waited)
+
+    def _give_up(self, waiter: _Waiter, waited: float) -> bool:
+        """等待逾時或被取消：移出佇列並回傳 False；若空位剛好已轉交給它則回傳 True。"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._queue.remove(waiter)
+            self._counters["timed_out"] += 1
+            self._waits += 1
+            self._wait_seconds += waited
+        return False
+
+    def release(self) -> None:
+        with self._lock:
+            if self._queue:
+                # 空位直接轉交給下一個排隊者，_active 不變
+                waiter = self._queue.popleft()
+                waiter.granted = True
+                if waiter.future is not None:
+                    waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+                else:
+                    waiter.event.set()
+            else:
+                self._active -= 1
+
+    def acquire(self, max_wait: float) -> None:
+        started = time.monotonic()
+        waiter = self._try_enter(lambda: _Waiter(event=threading.Event()))
+        if waiter is None:
+            return
+        waiter.event.wait(max_wait)
+        waited = time.monotonic() - started
+        if waiter.granted or self._give_up(waiter, waited):
+            self._admitted_after_wait(waited)
+            return
+        logger.warning("模型 %s 排隊 %.1fs 仍無空位", self.model, waited)
+        raise Overloaded("AI 服務忙碌中，請稍後再試", self._retry_after())
+
+    async def acquire_async(self, max_wait: float) -> None:
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        waiter = self._try_enter(lambda: _Waiter(future=loop.create_future(), loop=loop))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(waiter.future, max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # 請求被取消：已拿到的空位要還回去
+            if self._give_up(waiter, time.monotonic() - started):
+                self.release()
+            raise
+        waited = time.monotonic() - started
+        if waiter.granted or self._give_up(waiter, waited):
+            self._admitted_after_wait(waited)
+            return
+        logger.warning("模型 %s 排隊 %.1fs 仍無空位", self.model, waited)
+        raise Overloaded("AI 服務忙碌中，請稍後再試", self._retry_after())
+
+    def saturated(self) -> bool:
+        """沒有空閒名額（新的呼叫會排隊或被拒絕）。"""
+        with self._lock:
+            return self._active >= self.limit or bool(self._queue)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "queue_depth": len(self._queue),
+                "queue_limit": self.queue_limit,
+                **self._counters,
+                "avg_wait_seconds": round(self._wait_seconds / self._waits, 3) if self._waits else 0.0,
+                "max_wait_seconds": round(self._max_wait_seconds, 3),
+            }
+
+
+_limiters: dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(model: str) -> ModelLimiter:
+    with _limiters_lock:
+        model_limiter = _limiters.get(model)
+        if model_limiter is None:
+            model_limiter = _limiters[model] = ModelLimiter(
+                model,
+                config.ADMISSION_MODEL_LIMITS.get(model, config.ADMISSION_MAX_CONCURRENCY),
+                config.ADMISSION_QUEUE_LIMIT,
+            )
+        return model_limiter
+
+
+def saturated(model: str) -> bool:
+    return limiter(model).saturated()
+
+
+@contextlib.contextmanager
+def slot(model: str, max_wait: float):
+    """佔用 model 的一個呼叫名額（必要時最多排隊 max_wait 秒），離開時釋放。"""
+    model_limiter = limiter(model)
+    model_limiter.acquire(max_wait)
+    try:
+        yield
+    finally:
+        model_limiter.release()
+
+
+@contextlib.asynccontextmanager
+async def slot_async(model: str, max_wait: float):
+    """slot 的 async 版本，排隊期間讓出 event loop。"""
+    model_limiter = limiter(model)
+    await model_limiter.acquire_async(max_wait)
+    try:
+        yield
+    finally:
+        model_limiter.release()
+
+
+def snapshot() -> dict:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {model_limiter.model: model_limiter.snapshot() for model_limiter in limiters}
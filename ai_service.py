@@ -3,63 +3,234 @@ URBAN 文案機器人 - AI 服務層 (Gemini 版)
 封裝所有 Google Gemini API 呼叫：文案生成、Vision、圖片生成、字型推薦、演算法分析。
 """
 
+import asyncio
 import base64
+import functools
+import inspect
 import io
 import json
 import logging
-import re
-import time
 
 from google import genai
 from google.genai import types
 
+import cache
 import config
+import hedge
 import image_utils
+import json_stream
+import metrics
+import retry
+import routing
+import timing
 
 logger = logging.getLogger(__name__)
 
 client = genai.Client(api_key=config.GEMINI_API_KEY)
 
-# 圖片生成模型優先順序（第一個 503 就試下一個）
+response_cache = cache.ResponseCache(
+    config.RESPONSE_CACHE_MAX_ENTRIES,
+    disk_path=config.RESPONSE_CACHE_DISK_PATH,
+    disk_max_entries=config.RESPONSE_CACHE_DISK_MAX_ENTRIES,
+) if config.RESPONSE_CACHE_ENABLED else None
+
+image_cache = cache.ImageResultCache(
+    config.IMAGE_CACHE_DIR, config.IMAGE_CACHE_MAX_BYTES,
+) if config.IMAGE_CACHE_DIR else None
+
+# 圖片生成模型（實際順序由 routing 依健康狀態決定；尚無樣本時依此順序）
 IMAGE_MODELS = [
     config.GEMINI_IMAGE_MODEL,                # gemini-2.5-flash-image (banana)
     "gemini-2.0-flash-exp-image-generation",  # 備用
 ]
 
+IMAGE_MODELS_EXHAUSTED = "所有圖片生成模型都暫時過載，請稍後再試"
+DESIGN_MODELS_EXHAUSTED = "所有設計模型暫時不可用，請稍後再試"
+
+
+def _http_options(timeout: float | None) -> types.HttpOptions | None:
+    """這次嘗試的 HTTP 逾時（剩餘時間預算）；HttpOptions.timeout 單位為毫秒。"""
+    return types.HttpOptions(timeout=int(timeout * 1000)) if timeout is not None else None
+
+
+def _image_config(response_modalities=None, timeout: float | None = None) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        response_modalities=response_modalities or ["IMAGE", "TEXT"],
+        http_options=_http_options(timeout),
+    )
+
+
+def _extract_image(response) -> tuple[bytes | None, str]:
+    """從圖片模型回應中取出 (圖片 bytes, 描述文字)。"""
+    image_bytes = None
+    description = ""
+
+    for part in response.candidates[0].content.parts:
+        if part.inline_data is not None:
+            image_bytes = part.inline_data.data
+        elif part.text is not None:
+            description = part.text
+
+    return image_bytes, description
+
+
+def _require_image(response) -> tuple[bytes, str]:
+    """取出圖片；模型沒回傳圖片時拋出 EmptyResponse，交由重試流程再試一次。"""
+    image_bytes, description = _extract_image(response)
+    if image_bytes is None:
+        raise retry.EmptyResponse("Gemini 未回傳圖片")
+    return image_bytes, description
+
+
+def _call_image_models(operation: str, models: list[str], contents, exhausted_message: str,
+                       response_modalities=None, hedged: bool = False) -> tuple[bytes, str]:
+    """
+    帶自動重試 + 備用模型的圖片生成呼叫，回傳 (圖片 bytes, 描述文字)。
+    模型依目前健康狀態排序（最快的健康模型優先），暫時性錯誤退避後重試，
+    重試用完、模型斷路或不存在時換下一個模型。
+    hedged=True 時主模型太慢會同時送給下一個模型（需 HEDGE_ENABLED）。
+    """
+    def attempt(model_name, timeout):
+        response = client.models.generate_content(
+            model=model_name,
+            contents=contents,
+            config=_image_config(response_modalities, timeout),
+        )
+        metrics.record_usage(operation, model_name, response)
+        return _require_image(response)
+
+    # hedging 需要能取消輸掉的呼叫，改用 async client（見 hedge.call）
+    async def attempt_async(model_name, timeout):
+        response = await client.aio.models.generate_content(
+            model=model_name,
+            contents=contents,
+            config=_image_config(response_modalities, timeout),
+        )
+        metrics.record_usage(operation, model_name, response)
+        return _require_image(response)
+
+    with timing.span("models", operation):
+        ordered = routing.health.order(models)
+        if hedged:
+            return hedge.call(operation, ordered, attempt, attempt_async, exhausted_message=exhausted_message)
+        return retry.call(operation, ordered, attempt, exhausted_message=exhausted_message)
+
+
+async def _call_image_models_async(operation: str, models: list[str], contents, exhausted_message: str,
+                                   response_modalities=None, hedged: bool = False) -> tuple[bytes, str]:
+    """_call_image_models 的 async 版本，等待期間不佔用執行緒。"""
+    async def attempt(model_name, timeout):
+        response = await client.aio.models.generate_content(
+            model=model_name,
+            contents=contents,
+            config=_image_config(response_modalities, timeout),
+        )
+        metrics.record_usage(operation, model_name, response)
+        return _require_image(response)
+
+    call_async = hedge.call_async if hedged else retry.call_async
+    with timing.span("models", operation):
+        return await call_async(operation, routing.health.order(models), attempt,
+                                exhausted_message=exhausted_message)
+
+
+def _text_request(request: dict, model_name: str, timeout: float | None) -> dict:
+    """在 generate_content 參數中帶入這次嘗試的模型與 HTTP 逾時。"""
+    text_config = request["config"].model_copy(update={"http_options": _http_options(timeout)})
+    return {**request, "model": model_name, "config": text_config}
 
-def _call_image_model_with_retry(contents, response_modalities=None, max_retries=3):
+
+def _generate_text(operation: str, request: dict):
+    """文字模型呼叫（request 為 generate_content 的參數），暫時性錯誤會退避後重試。"""
+    def attempt(model_name, timeout):
+        response = client.models.generate_content(**_text_request(request, model_name, timeout))
+        metrics.record_usage(operation, model_name, response)
+        return response
+
+    return retry.call(operation, [request["model"]], attempt)
+
+
+async def _generate_text_async(operation: str, request: dict):
+    """_generate_text 的 async 版本。"""
+    async def attempt(model_name, timeout):
+        response = await client.aio.models.generate_content(**_text_request(request, model_name, timeout))
+        metrics.record_usage(operation, model_name, response)
+        return response
+
+    return await retry.call_async(operation, [request["model"]], attempt)
+
+
+def _stream_text(operation: str, request: dict):
     """
-    帶自動重試 + 備用模型的圖片生成呼叫。
-    503 overloaded 時會等待後重試，全部失敗再換模型。
+    串流呼叫文字模型，回傳文字片段的 iterator。
+    第一個 chunk 到達前的錯誤（過載、逾時）照一般流程重試；之後的錯誤在迭代時拋出。
     """
-    modalities = response_modalities or ["IMAGE", "TEXT"]
-
-    for model_name in IMAGE_MODELS:
-        for attempt in range(max_retries):
-            try:
-                logger.info("圖片模型呼叫: %s (嘗試 %d/%d)", model_name, attempt + 1, max_retries)
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=contents,
-                    config=types.GenerateContentConfig(
-                        response_modalities=modalities,
-                    ),
-                )
-                return response
-            except Exception as e:
-                error_str = str(e)
-                if "503" in error_str or "overloaded" in error_str.lower() or "unavailable" in error_str.lower():
-                    wait_time = (attempt + 1) * 3  # 3s, 6s, 9s
-                    logger.warning("模型 %s 過載 (503)，等待 %ds 後重試...", model_name, wait_time)
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    # 非 503 錯誤直接拋出
-                    raise
-
-        logger.warning("模型 %s 重試 %d 次全部失敗，嘗試備用模型...", model_name, max_retries)
-
-    raise ValueError("所有圖片生成模型都暫時過載，請稍後再試")
+    def attempt(model_name, timeout):
+        stream = client.models.generate_content_stream(**_text_request(request, model_name, timeout))
+        return next(stream, None), stream
+
+    first, stream = retry.call(operation, [request["model"]], attempt)
+
+    def pieces():
+        # usage_metadata 為累計值，串流結束時以最後一個 chunk 的數字記錄
+        last = first
+        if first is not None:
+            yield first.text or ""
+        for chunk in stream:
+            last = chunk
+            yield chunk.text or ""
+        metrics.record_usage(operation, request["model"], last)
+
+    return pieces()
+
+
+async def _stream_text_async(operation: str, request: dict):
+    """_stream_text 的 async 版本，回傳 async iterator。"""
+    async def attempt(model_name, timeout):
+        stream = await client.aio.models.generate_content_stream(**_text_request(request, model_name, timeout))
+        return await anext(stream, None), stream
+
+    first, stream = await retry.call_async(operation, [request["model"]], attempt)
+
+    async def pieces():
+        last = first
+        if first is not None:
+            yield first.text or ""
+        async for chunk in stream:
+            last = chunk
+            yield chunk.text or ""
+        metrics.record_usage(operation, request["model"], last)
+
+    return pieces()
+
+
+def _stream_result(extractor: json_stream.JsonExtractor) -> dict:
+    """串流結束時的完整結果（不重新解析，沿用串流中掃描的狀態），格式同 _parse_json_response。"""
+    return _checked_result(extractor.result(), extractor.text, OPTIONS_FIELDS)
+
+
+def _stream_options(pieces):
+    """
+    逐一 yield ("option", 完成的 option 物件)，最後 yield ("result", 完整解析結果)；
+    完整結果與非串流版本相同（JSON 解析失敗時為 raw_text）。
+    """
+    extractor = json_stream.JsonExtractor()
+    for piece in pieces:
+        for key, option in extractor.feed(piece):
+            if key == "options":
+                yield "option", option
+    yield "result", _stream_result(extractor)
+
+
+async def _stream_options_async(pieces):
+    """_stream_options 的 async 版本。"""
+    extractor = json_stream.JsonExtractor()
+    async for piece in pieces:
+        for key, option in extractor.feed(piece):
+            if key == "options":
+                yield "option", option
+    yield "result", _stream_result(extractor)
+
 
 # ============================================================
 # System Prompts — URBAN 品牌風格的靈魂
@@ -285,47 +456,153 @@ ALGORITHM_ANALYSIS_SYSTEM_PROMPT = """你是一位精通社群媒體演算法的
 # JSON 回應解析器
 # ============================================================
 
-def _parse_json_response(text: str) -> dict:
-    """
-    從 Gemini 回應中提取 JSON，容忍 markdown code block 包裹。
-    """
-    # 移除 markdown code block
-    cleaned = text.strip()
-    if cleaned.startswith("```"):
-        # 移除開頭的 ```json 或 ```
-        cleaned = re.sub(r'^```(?:json)?\s*\n?', '', cleaned)
-        cleaned = re.sub(r'\n?```\s*$', '', cleaned)
-
-    try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
-        # 嘗試找到第一個 { 和最後一個 }
-        start = cleaned.find('{')
-        end = cleaned.rfind('}')
-        if start != -1 and end != -1:
-            try:
-                return json.loads(cleaned[start:end + 1])
-            except json.JSONDecodeError:
-                pass
+OPTIONS_FIELDS = ("options",)              # 文案（Mode 1 / 4）回應的必要欄位
+ALGORITHM_FIELDS = ("score", "sections")   # 演算法評分（Mode 5）回應的必要欄位
+
 
+def _checked_result(result: dict | None, text: str, required: tuple[str, ...]) -> dict:
+    """解析結果缺少必要欄位（例如截斷時沒取回 score）時改回傳原始文字，不回傳缺欄位的結果。"""
+    if result is None:
         logger.warning("無法解析 JSON 回應，回傳原始文字")
         return {"raw_text": text}
+    missing = [field for field in required if field not in result]
+    if missing:
+        logger.warning("JSON 回應缺少欄位 %s，回傳原始文字", ", ".join(missing))
+        return {"raw_text": text}
+    if result.get("partial"):
+        logger.warning("JSON 回應不完整，取回已完成的部分")
+    return result
+
+
+def _parse_json_response(text: str, required: tuple[str, ...] = ()) -> dict:
+    """
+    從 Gemini 回應中提取 JSON，容忍 markdown code block、前後說明文字與截斷的輸出
+    （截斷時取回已完成的元素，標記 partial）；完全無法解析或缺少 required 欄位時回傳原始文字。
+    """
+    return _checked_result(json_stream.parse(text), text, required)
 
 
 # ============================================================
-# Mode 1: 圖片 → 文案 (Vision to Text)
+# 文字端點回應快取
 # ============================================================
 
-def generate_caption_from_image_base64(base64_data: str, mime_type: str = "image/jpeg") -> dict:
+class _FallbackStr(str):
+    """模型輸出無效時改用的預設值：照常回傳給呼叫端，但不寫入回應快取（下次請求重新詢問模型）。"""
+
+
+def _cached_response(namespace: str, prompt: str):
     """
-    接收 base64 編碼的圖片，使用 Gemini Vision 分析並產生四種風格文案。
-    回傳結構化 JSON dict。
+    以 (namespace, 模型, 正規化輸入, prompt 版本) 快取函式結果，sync / async 函式皆可使用。
+    TTL 取自 config.RESPONSE_CACHE_TTLS[namespace]；JSON 解析失敗或不完整的結果 (raw_text / partial)
+    與模型輸出無效時的預設值 (_FallbackStr) 不快取。
     """
-    logger.info("Gemini Vision 呼叫 - 分析圖片並生成文案")
+    version = cache.prompt_version(prompt)
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def cache_key(args, kwargs) -> str | None:
+            if response_cache is None or config.RESPONSE_CACHE_TTLS.get(namespace, 0) <= 0:
+                return None
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return cache.make_key(namespace, config.GEMINI_MODEL, version, *bound.arguments.values())
+
+        def store(key: str, result) -> None:
+            if isinstance(result, _FallbackStr):
+                return
+            if not (isinstance(result, dict) and ("raw_text" in result or result.get("partial"))):
+                response_cache.set(key, result, config.RESPONSE_CACHE_TTLS[namespace])
+
+        if inspect.iscoroutinefunction(fn):
+            async def offload(operation, *args):
+                # SQLite 共用層的讀寫是阻塞 I/O，改在執行緒中進行；只有記憶體 LRU 時直接呼叫
+                if response_cache.disk is None:
+                    return operation(*args)
+                return await asyncio.to_thread(operation, *args)
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                key = cache_key(args, kwargs)
+                if key is None:
+                    return await fn(*args, **kwargs)
+                cached = await offload(response_cache.get, key)
+                if cached is not None:
+                    logger.info("回應快取命中: %s", namespace)
+                    return cached
+                result = await fn(*args, **kwargs)
+                await offload(store, key, result)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = cache_key(args, kwargs)
+            if key is None:
+                return fn(*args, **kwargs)
+            cached = response_cache.get(key)
+            if cached is not None:
+                logger.info("回應快取命中: %s", namespace)
+                return cached
+            result = fn(*args, **kwargs)
+            store(key, result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _image_cache_key(namespace: str, prompt: str, models: list[str], image_bytes: bytes, *inputs) -> str | None:
+    """圖片轉換結果的內容定址 key；未啟用圖片快取時回傳 None。"""
+    if image_cache is None:
+        return None
+    with timing.span("image_cache_key"):
+        return image_cache.make_key(namespace, models, cache.prompt_version(prompt), image_bytes, *inputs)
+
+
+def _cached_image(cache_key: str | None) -> tuple[bytes, str] | None:
+    if cache_key is None:
+        return None
+    cached = image_cache.get(cache_key)
+    if cached is not None:
+        logger.info("圖片結果快取命中: %s", cache_key[:12])
+    return cached
+
+
+def _store_image(cache_key: str | None, image_bytes: bytes, description: str) -> None:
+    if cache_key is not None:
+        image_cache.put(cache_key, image_bytes, description)
+
+
+def _lookup_image(namespace: str, prompt: str, models: list[str], image_bytes: bytes,
+                  *inputs) -> tuple[str | None, tuple[bytes, str] | None]:
+    """回傳 (cache_key, 快取結果)。"""
+    cache_key = _image_cache_key(namespace, prompt, models, image_bytes, *inputs)
+    return cache_key, _cached_image(cache_key)
+
+
+async def _lookup_image_async(namespace: str, prompt: str, models: list[str], image_bytes: bytes,
+                              *inputs) -> tuple[str | None, tuple[bytes, str] | None]:
+    """_lookup_image 的 async 版本：整張上傳圖的 sha256 與磁碟讀取在執行緒中進行，不阻塞 event loop。"""
+    if image_cache is None:
+        return None, None
+    return await asyncio.to_thread(_lookup_image, namespace, prompt, models, image_bytes, *inputs)
+
+
+async def _store_image_async(cache_key: str | None, image_bytes: bytes, description: str) -> None:
+    """_store_image 的 async 版本：寫檔與 os.replace 在執行緒中進行。"""
+    if cache_key is not None:
+        await asyncio.to_thread(_store_image, cache_key, image_bytes, description)
 
-    image_bytes = base64.b64decode(base64_data)
 
-    response = client.models.generate_content(
+# ============================================================
+# Mode 1: 圖片 → 文案 (Vision to Text)
+# ============================================================
+
+def _caption_from_image_request(image_bytes: bytes, mime_type: str) -> dict:
+    return dict(
         model=config.GEMINI_MODEL,
         contents=[
             types.Content(
@@ -343,68 +620,71 @@ def generate_caption_from_image_base64(base64_data: str, mime_type: str = "image
         ),
     )
 
-    return _parse_json_response(response.text)
-
-
-# ============================================================
-# Mode 2: 文字 → 圖片 (Text to Image via Gemini)
-# ============================================================
 
-def generate_image(user_text: str) -> tuple[bytes, str]:
+def generate_caption_from_image_base64(base64_data: str, mime_type: str = "image/jpeg") -> dict:
     """
-    使用 Gemini 的圖片生成能力，根據使用者的中文概念生成圖片。
-
-    Returns:
-        (image_bytes, description) - 圖片二進位資料與描述
+    接收 base64 編碼的圖片，使用 Gemini Vision 分析並產生四種風格文案。
+    回傳結構化 JSON dict。
     """
-    logger.info("Gemini 圖片生成 - 概念: %s", user_text)
+    return generate_caption_from_image_bytes(base64.b64decode(base64_data), mime_type)
 
-    prompt = (
-        f"{IMAGE_GEN_SYSTEM_PROMPT}\n\n"
-        f"使用者的概念：{user_text}\n\n"
-        f"請生成一張符合上述風格的圖片。"
-    )
 
-    response = _call_image_model_with_retry(contents=prompt)
+def generate_caption_from_image_bytes(image_bytes: bytes, mime_type: str = "image/jpeg") -> dict:
+    """generate_caption_from_image_base64 的二進位版本（multipart / image/* 上傳直接使用）。"""
+    logger.info("Gemini Vision 呼叫 - 分析圖片並生成文案")
 
-    # 從回應中提取圖片
-    image_bytes = None
-    description = ""
+    response = _generate_text("caption_from_image", _caption_from_image_request(image_bytes, mime_type))
 
-    for part in response.candidates[0].content.parts:
-        if part.inline_data is not None:
-            image_bytes = part.inline_data.data
-        elif part.text is not None:
-            description = part.text
+    return _parse_json_response(response.text, OPTIONS_FIELDS)
 
-    if image_bytes is None:
-        raise ValueError("Gemini 未回傳圖片，請稍後再試")
 
-    return image_bytes, description
+def stream_caption_from_image_bytes(image_bytes: bytes, mime_type: str = "image/jpeg"):
+    """
+    generate_caption_from_image_bytes 的串流版本：連上模型後回傳 iterator，
+    每則文案一生成完就 yield ("option", option)，最後 yield ("result", 完整結果)。
+    """
+    logger.info("Gemini Vision 串流呼叫 - 分析圖片並生成文案")
+    pieces = _stream_text("caption_from_image", _caption_from_image_request(image_bytes, mime_type))
+    return _stream_options(pieces)
 
 
 # ============================================================
-# Mode 2B: 人物照 → 背景替換 (Person + New Background)
+# Mode 2: 文字 → 圖片 (Text to Image via Gemini)
 # ============================================================
 
-def replace_background(base64_data: str, scene: str, mime_type: str = "image/jpeg") -> tuple[bytes, str]:
+def _image_prompt(user_text: str) -> str:
+    return (
+        f"{IMAGE_GEN_SYSTEM_PROMPT}\n\n"
+        f"使用者的概念：{user_text}\n\n"
+        f"請生成一張符合上述風格的圖片。"
+    )
+
+
+def generate_image(user_text: str) -> tuple[bytes, str]:
     """
-    保留照片中的人物，替換背景為指定場景。
+    使用 Gemini 的圖片生成能力，根據使用者的中文概念生成圖片。
 
     Returns:
         (image_bytes, description) - 圖片二進位資料與描述
     """
-    logger.info("背景替換 - 場景: %s", scene)
+    logger.info("Gemini 圖片生成 - 概念: %s", user_text)
 
-    image_bytes = base64.b64decode(base64_data)
+    return _call_image_models("generate_image", IMAGE_MODELS, _image_prompt(user_text),
+                              IMAGE_MODELS_EXHAUSTED, hedged=True)
+
+
+# ============================================================
+# Mode 2B: 人物照 → 背景替換 (Person + New Background)
+# ============================================================
 
+def _background_contents(image_bytes: bytes, scene: str, mime_type: str) -> list:
     prompt_text = (
         f"{BACKGROUND_REPLACE_SYSTEM_PROMPT}\n\n"
         f"使用者想要的新背景場景：{scene}\n\n"
         f"請保留照片中的人物，將背景替換為上述場景，生成一張新圖片。"
     )
 
-    contents = [
+    return [
         types.Content(
             role="user",
             parts=[
@@ -414,20 +694,33 @@ def replace_background(base64_data: str, scene: str, mime_type: str = "image/jpe
         )
     ]
 
-    response = _call_image_model_with_retry(contents=contents)
 
-    result_image_bytes = None
-    description = ""
+def replace_background(base64_data: str, scene: str, mime_type: str = "image/jpeg") -> tuple[bytes, str]:
+    """
+    保留照片中的人物，替換背景為指定場景。
+
+    Returns:
+        (image_bytes, description) - 圖片二進位資料與描述
+    """
+    return replace_background_bytes(base64.b64decode(base64_data), scene, mime_type)
 
-    for part in response.candidates[0].content.parts:
-        if part.inline_data is not None:
-            result_image_bytes = part.inline_data.data
-        elif part.text is not None:
-            description = part.text
 
-    if result_image_bytes is None:
-        raise ValueError("Gemini 未回傳圖片，請稍後再試")
+def replace_background_bytes(image_bytes: bytes, scene: str, mime_type: str = "image/jpeg") -> tuple[bytes, str]:
+    """replace_background 的二進位版本。"""
+    logger.info("背景替換 - 場景: %s", scene)
+
+    cache_key = _image_cache_key("replace_background", BACKGROUND_REPLACE_SYSTEM_PROMPT, IMAGE_MODELS,
+                                 image_bytes, scene, mime_type)
+    cached = _cached_image(cache_key)
+    if cached is not None:
+        return cached
+
+    result_image_bytes, description = _call_image_models(
+        "replace_background", IMAGE_MODELS, _background_contents(image_bytes, scene, mime_type),
+        IMAGE_MODELS_EXHAUSTED, hedged=True,
+    )
 
+    _store_image(cache_key, result_image_bytes, description)
     return result_image_bytes, description
 
 
@@ -463,19 +756,15 @@ Create a stunning magazine-cover-style design with the text on the image.
 
 The text to put on the image is provided below. You MUST render it character by character, exactly as written."""
 
+# 設計模型（Gemini 3 Pro Image 文字渲染最強，尚無樣本時排第一；實際順序由 routing 決定）
+DESIGN_MODELS = [
+    "gemini-3-pro-image-preview",              # 最強文字渲染 + 設計能力
+    "gemini-2.0-flash-exp-image-generation",    # 備用
+    config.GEMINI_IMAGE_MODEL,                   # 備用
+]
 
-def design_with_ai(base64_data: str, text: str, mime_type: str = "image/jpeg") -> tuple[bytes, str]:
-    """
-    用 Gemini 圖片模型做時尚雜誌風格排版設計。
-    使用英文 prompt + 強化人臉保護 + 逐字中文渲染指令。
-
-    Returns:
-        (image_bytes, description) - 設計後的圖片和描述
-    """
-    logger.info("AI 排版設計 - 文字: %s", text[:30])
-
-    image_bytes = base64.b64decode(base64_data)
 
+def _design_contents(image_bytes: bytes, text: str, mime_type: str) -> list:
     # 把中文字逐字列出，幫助 AI 正確渲染
     char_list = " ".join(text)
 
@@ -490,7 +779,7 @@ def design_with_ai(base64_data: str, text: str, mime_type: str = "image/jpeg") -
         f"- Generate the image now."
     )
 
-    contents = [
+    return [
         types.Content(
             role="user",
             parts=[
@@ -500,67 +789,43 @@ def design_with_ai(base64_data: str, text: str, mime_type: str = "image/jpeg") -
         )
     ]
 
-    # 模型優先順序（Gemini 3 Pro Image 文字渲染最強，排第一）
-    design_models = [
-        "gemini-3-pro-image-preview",              # 最強文字渲染 + 設計能力
-        "gemini-2.0-flash-exp-image-generation",    # 備用
-        config.GEMINI_IMAGE_MODEL,                   # 備用
-    ]
 
-    for model_name in design_models:
-        for attempt in range(3):
-            try:
-                logger.info("設計模型呼叫: %s (嘗試 %d/3)", model_name, attempt + 1)
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=contents,
-                    config=types.GenerateContentConfig(
-                        response_modalities=["IMAGE", "TEXT"],
-                    ),
-                )
-
-                result_image_bytes = None
-                description = ""
-
-                for part in response.candidates[0].content.parts:
-                    if part.inline_data is not None:
-                        result_image_bytes = part.inline_data.data
-                    elif part.text is not None:
-                        description = part.text
-
-                if result_image_bytes is not None:
-                    return result_image_bytes, description
-
-            except Exception as e:
-                error_str = str(e)
-                if "503" in error_str or "overloaded" in error_str.lower():
-                    wait_time = (attempt + 1) * 3
-                    logger.warning("模型 %s 過載，等待 %ds...", model_name, wait_time)
-                    time.sleep(wait_time)
-                    continue
-                elif "404" in error_str or "not found" in error_str.lower():
-                    logger.warning("模型 %s 不存在，跳到下一個", model_name)
-                    break
-                else:
-                    raise
-
-        logger.warning("模型 %s 全部失敗，嘗試下一個...", model_name)
-
-    raise ValueError("所有設計模型暫時不可用，請稍後再試")
+def design_with_ai(base64_data: str, text: str, mime_type: str = "image/jpeg") -> tuple[bytes, str]:
+    """
+    用 Gemini 圖片模型做時尚雜誌風格排版設計。
+    使用英文 prompt + 強化人臉保護 + 逐字中文渲染指令。
+
+    Returns:
+        (image_bytes, description) - 設計後的圖片和描述
+    """
+    return design_with_ai_bytes(base64.b64decode(base64_data), text, mime_type)
+
+
+def design_with_ai_bytes(image_bytes: bytes, text: str, mime_type: str = "image/jpeg") -> tuple[bytes, str]:
+    """design_with_ai 的二進位版本。"""
+    logger.info("AI 排版設計 - 文字: %s", text[:30])
+
+    cache_key = _image_cache_key("design_with_ai", DESIGN_SYSTEM_PROMPT, DESIGN_MODELS,
+                                 image_bytes, text, mime_type)
+    cached = _cached_image(cache_key)
+    if cached is not None:
+        return cached
+
+    result_image_bytes, description = _call_image_models(
+        "design_with_ai", DESIGN_MODELS, _design_contents(image_bytes, text, mime_type),
+        DESIGN_MODELS_EXHAUSTED,
+    )
+
+    _store_image(cache_key, result_image_bytes, description)
+    return result_image_bytes, description
 
 
 # ============================================================
 # Mode 4: 熱門風格文案 (Trending Caption Generator)
 # ============================================================
 
-def generate_trending_caption(topic: str) -> dict:
-    """
-    模仿 Threads/IG 熱門貼文風格，根據主題生成爆款文案 + Story 腳本。
-    回傳結構化 JSON dict。
-    """
-    logger.info("熱門風格文案生成 - 主題: %s", topic)
-
-    response = client.models.generate_content(
+def _trending_request(topic: str) -> dict:
+    return dict(
         model=config.GEMINI_MODEL,
         contents=f"{TRENDING_CAPTION_SYSTEM_PROMPT}\n\n主題：{topic}\n\n請回傳純 JSON。",
         config=types.GenerateContentConfig(
@@ -569,13 +834,41 @@ def generate_trending_caption(topic: str) -> dict:
         ),
     )
 
-    return _parse_json_response(response.text)
+
+def generate_trending_caption(topic: str) -> dict:
+    """
+    模仿 Threads/IG 熱門貼文風格，根據主題生成爆款文案 + Story 腳本。
+    回傳結構化 JSON dict。
+    """
+    logger.info("熱門風格文案生成 - 主題: %s", topic)
+
+    response = _generate_text("trending_caption", _trending_request(topic))
+
+    return _parse_json_response(response.text, OPTIONS_FIELDS)
+
+
+def stream_trending_caption(topic: str):
+    """generate_trending_caption 的串流版本，產出格式同 stream_caption_from_image_bytes。"""
+    logger.info("熱門風格文案串流生成 - 主題: %s", topic)
+    return _stream_options(_stream_text("trending_caption", _trending_request(topic)))
 
 
 # ============================================================
 # Mode 5: 演算法分析 (Algorithm Score & Optimization)
 # ============================================================
 
+def _algorithm_request(caption_text: str) -> dict:
+    return dict(
+        model=config.GEMINI_MODEL,
+        contents=f"{ALGORITHM_ANALYSIS_SYSTEM_PROMPT}\n\n請分析以下文案：\n\n{caption_text}\n\n請回傳純 JSON。",
+        config=types.GenerateContentConfig(
+            temperature=0.5,
+            max_output_tokens=2500,
+        ),
+    )
+
+
+@_cached_response("analyze_algorithm_score", ALGORITHM_ANALYSIS_SYSTEM_PROMPT)
 def analyze_algorithm_score(caption_text: str) -> dict:
     """
     分析一段文案的「演算法友善度」，從互動率、停留時間、分享潛力、
@@ -584,26 +877,16 @@ def analyze_algorithm_score(caption_text: str) -> dict:
     """
     logger.info("演算法分析 - 文案長度: %d", len(caption_text))
 
-    response = client.models.generate_content(
-        model=config.GEMINI_MODEL,
-        contents=f"{ALGORITHM_ANALYSIS_SYSTEM_PROMPT}\n\n請分析以下文案：\n\n{caption_text}\n\n請回傳純 JSON。",
-        config=types.GenerateContentConfig(
-            temperature=0.5,
-            max_output_tokens=2500,
-        ),
-    )
+    response = _generate_text("analyze_algorithm_score", _algorithm_request(caption_text))
 
-    return _parse_json_response(response.text)
+    return _parse_json_response(response.text, ALGORITHM_FIELDS)
 
 
 # ============================================================
 # 字型推薦 (AI Font Recommendation)
 # ============================================================
 
-def recommend_font(caption_text: str, scene: str = "社群貼文") -> str:
-    """
-    根據文案內容和使用場景，AI 推薦最適合的字型。
-    """
+def _font_request(caption_text: str, scene: str) -> dict:
     font_list = "\n".join(
         f"- {key}: {info['name']}（風格：{info['style']}，適合：{info['best_for']}）"
         for key, info in config.AVAILABLE_FONTS.items()
@@ -611,7 +894,7 @@ def recommend_font(caption_text: str, scene: str = "社群貼文") -> str:
 
     system_prompt = FONT_RECOMMEND_SYSTEM_PROMPT.format(font_list=font_list)
 
-    response = client.models.generate_content(
+    return dict(
         model=config.GEMINI_MODEL,
         contents=f"{system_prompt}\n\n文案：{caption_text}\n場景：{scene}",
         config=types.GenerateContentConfig(
@@ -620,36 +903,157 @@ def recommend_font(caption_text: str, scene: str = "社群貼文") -> str:
         ),
     )
 
-    recommended_key = response.text.strip().lower()
+
+# 字型清單也是 prompt 的一部分，變更字型設定時快取一併失效
+_FONT_PROMPT = FONT_RECOMMEND_SYSTEM_PROMPT + json.dumps(config.AVAILABLE_FONTS, ensure_ascii=False)
+
+
+def _parse_font_key(text: str) -> str:
+    recommended_key = text.strip().lower()
 
     if recommended_key not in config.AVAILABLE_FONTS:
         logger.warning("AI 推薦了無效的字型 key: %s，使用預設", recommended_key)
-        return "noto_sans_bold"
+        return _FallbackStr("noto_sans_bold")
 
     logger.info("AI 推薦字型: %s (%s)", recommended_key, config.AVAILABLE_FONTS[recommended_key]["name"])
     return recommended_key
 
 
+@_cached_response("recommend_font", _FONT_PROMPT)
+def recommend_font(caption_text: str, scene: str = "社群貼文") -> str:
+    """
+    根據文案內容和使用場景，AI 推薦最適合的字型。
+    """
+    response = _generate_text("recommend_font", _font_request(caption_text, scene))
+
+    return _parse_font_key(response.text)
+
+
 # ============================================================
 # Mode 3 輔助: 為合成圖片生成短文案
 # ============================================================
 
-def generate_short_caption(user_text: str) -> str:
-    """
-    將長文案精煉為適合放在圖片上的短標語（不超過 30 字）。
-    """
-    response = client.models.generate_content(
+SHORT_CAPTION_PROMPT = (
+    "你是文案精煉大師。請將使用者的文字濃縮為一句適合放在圖片上的標語，"
+    "不超過 30 個中文字。保持 URBAN 品牌的專業、溫暖、有深度的風格。"
+    "只回傳精煉後的文字，不要加任何前言。"
+)
+
+
+def _short_caption_request(user_text: str) -> dict:
+    return dict(
         model=config.GEMINI_MODEL,
-        contents=(
-            "你是文案精煉大師。請將使用者的文字濃縮為一句適合放在圖片上的標語，"
-            "不超過 30 個中文字。保持 URBAN 品牌的專業、溫暖、有深度的風格。"
-            "只回傳精煉後的文字，不要加任何前言。\n\n"
-            f"{user_text}"
-        ),
+        contents=f"{SHORT_CAPTION_PROMPT}\n\n{user_text}",
         config=types.GenerateContentConfig(
             temperature=0.6,
             max_output_tokens=100,
         ),
     )
 
+
+@_cached_response("generate_short_caption", SHORT_CAPTION_PROMPT)
+def generate_short_caption(user_text: str) -> str:
+    """
+    將長文案精煉為適合放在圖片上的短標語（不超過 30 字）。
+    """
+    response = _generate_text("generate_short_caption", _short_caption_request(user_text))
+
+    return response.text.strip()
+
+
+# ============================================================
+# Async 版本（ASGI 模式使用，await client.aio，不佔用執行緒）
+# ============================================================
+
+async def generate_caption_from_image_bytes_async(image_bytes: bytes, mime_type: str = "image/jpeg") -> dict:
+    """generate_caption_from_image_bytes 的 async 版本。"""
+    logger.info("Gemini Vision 呼叫 (async) - 分析圖片並生成文案")
+    response = await _generate_text_async("caption_from_image", _caption_from_image_request(image_bytes, mime_type))
+    return _parse_json_response(response.text, OPTIONS_FIELDS)
+
+
+async def stream_caption_from_image_bytes_async(image_bytes: bytes, mime_type: str = "image/jpeg"):
+    """stream_caption_from_image_bytes 的 async 版本，回傳 async iterator。"""
+    logger.info("Gemini Vision 串流呼叫 (async) - 分析圖片並生成文案")
+    pieces = await _stream_text_async("caption_from_image", _caption_from_image_request(image_bytes, mime_type))
+    return _stream_options_async(pieces)
+
+
+async def generate_image_async(user_text: str) -> tuple[bytes, str]:
+    """generate_image 的 async 版本。"""
+    logger.info("Gemini 圖片生成 (async) - 概念: %s", user_text)
+    return await _call_image_models_async("generate_image", IMAGE_MODELS, _image_prompt(user_text),
+                                          IMAGE_MODELS_EXHAUSTED, hedged=True)
+
+
+async def replace_background_bytes_async(image_bytes: bytes, scene: str,
+                                         mime_type: str = "image/jpeg") -> tuple[bytes, str]:
+    """replace_background_bytes 的 async 版本。"""
+    logger.info("背景替換 (async) - 場景: %s", scene)
+
+    cache_key, cached = await _lookup_image_async("replace_background", BACKGROUND_REPLACE_SYSTEM_PROMPT, IMAGE_MODELS,
+                                                  image_bytes, scene, mime_type)
+    if cached is not None:
+        return cached
+
+    result_image_bytes, description = await _call_image_models_async(
+        "replace_background", IMAGE_MODELS, _background_contents(image_bytes, scene, mime_type),
+        IMAGE_MODELS_EXHAUSTED, hedged=True,
+    )
+
+    await _store_image_async(cache_key, result_image_bytes, description)
+    return result_image_bytes, description
+
+
+async def design_with_ai_bytes_async(image_bytes: bytes, text: str,
+                                     mime_type: str = "image/jpeg") -> tuple[bytes, str]:
+    """design_with_ai_bytes 的 async 版本。"""
+    logger.info("AI 排版設計 (async) - 文字: %s", text[:30])
+
+    cache_key, cached = await _lookup_image_async("design_with_ai", DESIGN_SYSTEM_PROMPT, DESIGN_MODELS,
+                                                  image_bytes, text, mime_type)
+    if cached is not None:
+        return cached
+
+    result_image_bytes, description = await _call_image_models_async(
+        "design_with_ai", DESIGN_MODELS, _design_contents(image_bytes, text, mime_type),
+        DESIGN_MODELS_EXHAUSTED,
+    )
+
+    await _store_image_async(cache_key, result_image_bytes, description)
+    return result_image_bytes, description
+
+
+async def generate_trending_caption_async(topic: str) -> dict:
+    """generate_trending_caption 的 async 版本。"""
+    logger.info("熱門風格文案生成 (async) - 主題: %s", topic)
+    response = await _generate_text_async("trending_caption", _trending_request(topic))
+    return _parse_json_response(response.text, OPTIONS_FIELDS)
+
+
+async def stream_trending_caption_async(topic: str):
+    """stream_trending_caption 的 async 版本，回傳 async iterator。"""
+    logger.info("熱門風格文案串流生成 (async) - 主題: %s", topic)
+    return _stream_options_async(await _stream_text_async("trending_caption", _trending_request(topic)))
+
+
+@_cached_response("analyze_algorithm_score", ALGORITHM_ANALYSIS_SYSTEM_PROMPT)
+async def analyze_algorithm_score_async(caption_text: str) -> dict:
+    """analyze_algorithm_score 的 async 版本。"""
+    logger.info("演算法分析 (async) - 文案長度: %d", len(caption_text))
+    response = await _generate_text_async("analyze_algorithm_score", _algorithm_request(caption_text))
+    return _parse_json_response(response.text, ALGORITHM_FIELDS)
+
+
+@_cached_response("recommend_font", _FONT_PROMPT)
+async def recommend_font_async(caption_text: str, scene: str = "社群貼文") -> str:
+    """recommend_font 的 async 版本。"""
+    response = await _generate_text_async("recommend_font", _font_request(caption_text, scene))
+    return _parse_font_key(response.text)
+
+
+@_cached_response("generate_short_caption", SHORT_CAPTION_PROMPT)
+async def generate_short_caption_async(user_text: str) -> str:
+    """generate_short_caption 的 async 版本。"""
+    response = await _generate_text_async("generate_short_caption", _short_caption_request(user_text))
     return response.text.strip()
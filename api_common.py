@@ -0,0 +1,426 @@
+"""
+URBAN 文案機器人 - API 共用邏輯
+欄位驗證與回應格式，WSGI (app.py) 與 ASGI (asgi_app.py) 兩種服務模式共用。
+"""
+
+import base64
+import json
+import logging
+from urllib.parse import quote
+
+import admission
+import config
+import ai_service
+import hedge
+import image_utils
+import metrics
+import retry
+import routing
+import timing
+
+logger = logging.getLogger(__name__)
+
+
+def missing_fields_error(data: dict | None, *fields: str) -> str | None:
+    """
+    檢查必要欄位；缺少時回傳錯誤訊息，例如「缺少 image_base64 或 scene 欄位」。
+    以 multipart / image/* 上傳的圖片存在 image_bytes，視同已提供 image_base64。
+    """
+    if not data:
+        return f"缺少 {' 或 '.join(fields)} 欄位"
+    for field in fields:
+        if field not in data and not (field == "image_base64" and "image_bytes" in data):
+            return f"缺少 {' 或 '.join(fields)} 欄位"
+    return None
+
+
+def image_bytes_of(data: dict) -> bytes:
+    """取得上傳圖片的 bytes：二進位上傳直接使用，舊版 JSON 則解 base64。"""
+    if "image_bytes" in data:
+        return data["image_bytes"]
+    with timing.span("b64decode"):
+        return base64.b64decode(data["image_base64"])
+
+
+def request_budget(path: str, headers) -> float | None:
+    """
+    本次請求的時間預算（秒）：X-Request-Timeout 標頭優先，否則用端點預設，
+    上限 config.REQUEST_DEADLINE_MAX；不呼叫 AI 的路徑回傳 None。
+    """
+    default = config.REQUEST_DEADLINES.get(path.rstrip("/").rsplit("/", 1)[-1])
+    if default is None:
+        return None
+    try:
+        budget = float(headers.get("X-Request-Timeout", default))
+    except ValueError:
+        budget = default
+    return max(0.0, min(budget, config.REQUEST_DEADLINE_MAX))
+
+
+def error_status(error: Exception) -> int:
+    """AI 呼叫失敗時的 HTTP 狀態碼：模型忙碌為 503，時間預算用完為 504，其餘 500。"""
+    if isinstance(error, admission.Overloaded):
+        return 503
+    return 504 if isinstance(error, retry.DeadlineExceeded) else 500
+
+
+def error_headers(error: Exception) -> dict:
+    """模型忙碌時附上 Retry-After。"""
+    if isinstance(error, admission.Overloaded):
+        return {"Retry-After": str(error.retry_after)}
+    return {}
+
+
+# ============================================================
+# 二進位回應（Accept: image/*）
+# ============================================================
+
+def wants_image_response(accept_mimetypes) -> bool:
+    """客戶端偏好直接收圖片（Accept: image/*）而非 JSON；未指定或 */* 時維持 JSON。"""
+    return accept_mimetypes.best_match(["application/json", "image/*"]) == "image/*"
+
+
+def sniff_image_mime(image_bytes: bytes) -> str:
+    if image_bytes.startswith(b"\x89PNG"):
+        return "image/png"
+    if image_bytes.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+# 每個 X-* 標頭值（percent-encode 後）的長度上限：中文 encode 後約 9 倍長，模型描述或長文案
+# 整段放進標頭會超過 nginx / 代理常見的 4~8 KB 回應標頭上限（圖片已生成卻回 502）
+IMAGE_HEADER_VALUE_MAX = 512
+_ELLIPSIS = quote("…", safe="")
+
+
+def _header_value(value) -> tuple[str, bool]:
+    """percent-encode 後的標頭值與是否被截斷；超過 IMAGE_HEADER_VALUE_MAX 時在字元邊界截斷並加上 …。"""
+    encoded = quote(str(value), safe="")
+    if len(encoded) <= IMAGE_HEADER_VALUE_MAX:
+        return encoded, False
+
+    budget = IMAGE_HEADER_VALUE_MAX - len(_ELLIPSIS)
+    pieces, used = [], 0
+    for char in str(value):
+        piece = quote(char, safe="")
+        if used + len(piece) > budget:
+            break
+        pieces.append(piece)
+        used += len(piece)
+    return "".join(pieces) + _ELLIPSIS, True
+
+
+def image_response_headers(meta: dict) -> dict:
+    """
+    把 metadata 放進回應標頭，例如 text_used → X-Text-Used（值以 UTF-8 percent-encode）。
+    過長的值（模型描述、長文案）會被截斷，被截斷的 key 列在 X-Truncated-Fields，完整內容請改用 JSON 回應。
+    """
+    headers, truncated = {}, []
+    for key, value in meta.items():
+        header = "X-" + "-".join(part.capitalize() for part in key.split("_"))
+        headers[header], cut = _header_value(value)
+        if cut:
+            truncated.append(key)
+    if truncated:
+        headers["X-Truncated-Fields"] = ",".join(truncated)
+    return headers
+
+
+# ============================================================
+# 串流回應（Accept: text/event-stream 為 SSE，application/x-ndjson 為每行一個 JSON）
+# 每則 option 一完成就送出：option 事件 → …… → done 事件；中途失敗時送出 error 事件
+# ============================================================
+
+STREAM_MIMETYPES = ["text/event-stream", "application/x-ndjson"]
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def stream_mimetype(accept_mimetypes) -> str | None:
+    """客戶端要求串流時回傳串流格式；未指定或 */* 時回傳 None（維持一般 JSON）。"""
+    best = accept_mimetypes.best_match(["application/json", *STREAM_MIMETYPES])
+    return best if best in STREAM_MIMETYPES else None
+
+
+def _stream_event(mimetype: str, event: str, data: dict) -> str:
+    if mimetype == "text/event-stream":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+
+def _option_events(kind: str, value: dict, payload, sent: int) -> list[tuple[str, dict]]:
+    """
+    ai_service 串流產出的一項轉成事件。最後的完整結果經 payload（caption_payload 等）轉換，
+    串流中沒能逐項取出的 option（例如 JSON 格式不符而包成單一選項）在這時補送。
+    """
+    if kind == "option":
+        return [("option", {"index": sent, "option": value})]
+    options = payload(value).get("options", [])
+    events = [("option", {"index": index, "option": options[index]}) for index in range(sent, len(options))]
+    return events + [("done", {"count": max(sent, len(options))})]
+
+
+def stream_body(parts, payload, mimetype: str):
+    """把 ai_service.stream_* 的產出轉成串流回應的內容。"""
+    sent = 0
+    try:
+        for kind, value in parts:
+            for event, data in _option_events(kind, value, payload, sent):
+                sent += event == "option"
+                yield _stream_event(mimetype, event, data)
+    except Exception as e:
+        logger.error("串流中斷: %s", e, exc_info=True)
+        yield _stream_event(mimetype, "error", {"error": str(e), "status": error_status(e)})
+
+
+async def stream_body_async(parts, payload, mimetype: str):
+    """stream_body 的 async 版本。"""
+    sent = 0
+    try:
+        async for kind, value in parts:
+            for event, data in _option_events(kind, value, payload, sent):
+                sent += event == "option"
+                yield _stream_event(mimetype, event, data)
+    except Exception as e:
+        logger.error("串流中斷: %s", e, exc_info=True)
+        yield _stream_event(mimetype, "error", {"error": str(e), "status": error_status(e)})
+
+
+def stats_payload() -> dict:
+    """
+    營運統計（快取命中率、Gemini 每次嘗試的結果與耗時、模型健康狀態、hedging、
+    各模型的進行中 / 排隊數與等待時間），供 /api/v1/stats 使用。
+    """
+    response_cache = ai_service.response_cache
+    image_cache = ai_service.image_cache
+    return {
+        "response_cache": response_cache.stats() if response_cache else None,
+        "image_cache": image_cache.stats() if image_cache else None,
+        "gemini_calls": retry.stats.snapshot(),
+        "model_health": routing.health.snapshot(),
+        "hedging": hedge.budget.snapshot(),
+        "admission": admission.snapshot(),
+    }
+
+
+def wants_job(data: dict, headers) -> bool:
+    """客戶端要求以背景任務執行："async": true（表單 / query 為 "1" 或 "true"），或標頭 Prefer: respond-async。"""
+    flag = data.get("async")
+    return flag is True or str(flag).lower() in ("1", "true") or "respond-async" in headers.get("Prefer", "")
+
+
+def job_accepted_payload(job: dict) -> dict:
+    """送出背景任務後的 202 回應。"""
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/api/v1/jobs/{job['job_id']}",
+    }
+
+
+def _without_partial(result: dict) -> dict:
+    """partial（截斷後取回的結果）只用來判斷是否寫入快取，不回傳給客戶端。"""
+    return {key: value for key, value in result.items() if key != "partial"}
+
+
+def caption_payload(result: dict) -> dict:
+    """Mode 1 回應：JSON 解析失敗時包成單一選項。"""
+    if "raw_text" in result:
+        return {
+            "options": [{
+                "label": "AI 生成文案",
+                "emoji": "📝",
+                "description": "完整文案",
+                "content": result["raw_text"]
+            }]
+        }
+    return _without_partial(result)
+
+
+def trending_payload(result: dict) -> dict:
+    """Mode 4 回應：JSON 解析失敗時包成單一選項。"""
+    if "raw_text" in result:
+        return {
+            "options": [{
+                "label": "熱門文案",
+                "emoji": "🔥",
+                "description": "完整文案",
+                "content": result["raw_text"]
+            }]
+        }
+    return _without_partial(result)
+
+
+def algorithm_payload(result: dict) -> dict:
+    """Mode 5 回應：JSON 解析失敗時包成單一分析區塊。"""
+    if "raw_text" in result:
+        return {
+            "score": 0,
+            "sections": [{
+                "label": "分析結果",
+                "emoji": "📊",
+                "content": result["raw_text"]
+            }]
+        }
+    return _without_partial(result)
+
+
+def image_payload(image_bytes: bytes, meta: dict) -> dict:
+    """圖片端點的 JSON 回應（舊版 App 使用）：image_base64 + metadata。"""
+    with timing.span("b64encode"):
+        encoded = base64.b64encode(image_bytes).decode("utf-8")
+    return {
+        "image_base64": encoded,
+        **meta,
+    }
+
+
+def _font_info(font_key) -> dict:
+    """AVAILABLE_FONTS 中的字型資訊；不是字串（例如 JSON body 傳來的 [] / {}）或未知的 key 回傳空 dict。"""
+    return config.AVAILABLE_FONTS.get(font_key, {}) if isinstance(font_key, str) else {}
+
+
+def font_payload(font_key: str) -> dict:
+    """字型推薦回應。"""
+    font_info = _font_info(font_key)
+    return {
+        "font_key": font_key,
+        "font_name": font_info.get("name", "未知"),
+        "font_style": font_info.get("style", ""),
+        "best_for": font_info.get("best_for", ""),
+    }
+
+
+# ============================================================
+# 慢速圖片端點的執行函式（同步請求與背景任務共用）
+# 回傳 (圖片 bytes, metadata)，再依客戶端要求轉成 JSON 或二進位回應
+# ============================================================
+
+def json_runner(run):
+    """
+    把執行函式包成背景任務版本：結果以 JSON payload 保存，
+    時間預算為 config.JOB_DEADLINE_SECONDS（客戶端不在線上等，不沿用請求的預算）。
+    """
+    def runner(data: dict) -> dict:
+        with retry.deadline(config.JOB_DEADLINE_SECONDS):
+            return image_payload(*run(data))
+    return runner
+
+
+def design_meta(caption_text: str, engine: str = "ai", reason: str = "requested",
+                font_key: str | None = None) -> dict:
+    """design 回應的 metadata；render_engine 為實際產生圖片的引擎（ai / local），render_reason 為選擇的原因。"""
+    if engine == "ai":
+        font_used, font_key = "AI 時尚排版", "ai_design"
+    else:
+        font_used = _font_info(font_key).get("name", "系統預設")
+    return {
+        "text_used": caption_text,
+        "font_used": font_used,
+        "font_key": font_key,
+        "render_engine": engine,
+        "render_reason": reason,
+    }
+
+
+def run_generate_image(data: dict) -> tuple[bytes, dict]:
+    image_bytes, description = ai_service.generate_image(data["concept"])
+    return image_bytes, {"description": description}
+
+
+def run_replace_background(data: dict) -> tuple[bytes, dict]:
+    mime_type = data.get("mime_type", "image/jpeg")
+    image_bytes, description = ai_service.replace_background_bytes(
+        image_bytes_of(data), data["scene"], mime_type
+    )
+    return image_bytes, {"description": description}
+
+
+def run_design(data: dict) -> tuple[bytes, dict]:
+    engine, reason = design_engine(data)
+    if engine == "local":
+        return render_design_local(data, reason)
+    try:
+        return _run_design_ai(data, reason)
+    except Exception as e:
+        if render_mode(data) != "auto":
+            raise
+        logger.warning("AI 排版失敗，改用本機排版: %s", e)
+        return render_design_local(data, "ai_failed")
+
+
+def _run_design_ai(data: dict, reason: str) -> tuple[bytes, dict]:
+    caption_text = data["text"]
+
+    # 太長的文案先精煉
+    if len(caption_text) > 30:
+        with timing.span("short_caption"):
+            caption_text = ai_service.generate_short_caption(caption_text)
+
+    # 用 Gemini 圖片模型直接做時尚雜誌風排版
+    mime_type = data.get("mime_type", "image/jpeg")
+    image_bytes = image_bytes_of(data)
+    with timing.span("design_ai"):
+        result_bytes, description = ai_service.design_with_ai_bytes(image_bytes, caption_text, mime_type)
+    metrics.record_design("ai", reason)
+    return result_bytes, design_meta(caption_text, "ai", reason)
+
+
+# ============================================================
+# /api/v1/design 排版引擎：ai（Gemini 圖片模型，20~60 秒）/ local（image_utils 本機排版，1 秒內）/ auto
+# ============================================================
+
+RENDER_MODES = ("ai", "local", "auto")
+
+
+def render_mode(data: dict) -> str:
+    return data.get("render") or config.DESIGN_RENDER_MODE
+
+
+def render_mode_error(data: dict) -> str | None:
+    if render_mode(data) not in RENDER_MODES:
+        return f"render 必須是 {' / '.join(RENDER_MODES)}"
+    return None
+
+
+def _ai_design_seconds() -> float:
+    """AI 排版預期需要的秒數：設計模型中最快的 p90 延遲；樣本不足時為 DESIGN_AUTO_MIN_BUDGET。"""
+    observed = [
+        latency for model in ai_service.DESIGN_MODELS
+        if (latency := routing.health.latency_percentile(
+            model, config.DESIGN_AUTO_PERCENTILE, config.DESIGN_AUTO_MIN_SAMPLES)) is not None
+    ]
+    return min(observed) if observed else config.DESIGN_AUTO_MIN_BUDGET
+
+
+def design_engine(data: dict) -> tuple[str, str]:
+    """
+    這次 design 使用的排版引擎與原因：
+    - render=ai / local：依客戶端指定（requested）
+    - render=auto：所有設計模型都斷路或沒有空閒名額（overloaded），
+      或剩餘時間預算不足以等到 AI 排版完成（short_deadline）時用本機排版，否則用 AI（auto）；
+      AI 排版失敗時也改用本機排版（ai_failed，見 run_design）
+    """
+    mode = render_mode(data)
+    if mode != "auto":
+        return mode, "requested"
+    if all(routing.health.is_open(model) or admission.saturated(model) for model in ai_service.DESIGN_MODELS):
+        return "local", "overloaded"
+    left = retry.remaining()
+    if left is not None and left < _ai_design_seconds():
+        return "local", "short_deadline"
+    return "ai", "auto"
+
+
+def render_design_local(data: dict, reason: str) -> tuple[bytes, dict]:
+    """以 image_utils 在本機排版：不呼叫 AI，文案原樣排入（過長時自動換行）。"""
+    font_key = data.get("font_key")
+    if not _font_info(font_key):
+        font_key = config.DESIGN_LOCAL_FONT
+    image_bytes = image_bytes_of(data)
+    with timing.span("design_local"):
+        result_bytes = image_utils.overlay_text_on_image(image_bytes, data["text"], font_key=font_key)
+    metrics.record_design("local", reason)
+    return result_bytes, design_meta(data["text"], "local", reason, font_key)
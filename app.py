@@ -8,15 +8,20 @@ URBAN 文案機器人 - REST API 後端
     python app.py
 """
 
-import base64
 import logging
 import os
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 
 import config
 import ai_service
+import api_common
+import batch
 import image_utils
+import jobs
+import metrics
+import retry
+import timing
 
 # ============================================================
 # 初始化
@@ -30,6 +35,83 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# 慢速圖片端點的背景任務（"async": true 或 Prefer: respond-async）
+job_manager = jobs.JobManager(jobs.create_store())
+
+# gunicorn 每個 worker 載入 app 時預載字型
+if config.FONT_PRELOAD:
+    image_utils.preload_fonts()
+
+
+# ============================================================
+# 請求時間預算：X-Request-Timeout 標頭或端點預設，傳遞到每次 Gemini 呼叫
+# ============================================================
+
+@app.before_request
+def _start_deadline():
+    g.deadline_token = retry.set_deadline(api_common.request_budget(request.path, request.headers))
+
+
+@app.teardown_request
+def _clear_deadline(exc):
+    token = g.pop("deadline_token", None)
+    if token is not None:
+        retry.reset_deadline(token)
+
+
+# ============================================================
+# 請求階段計時：Server-Timing 標頭（與 SERVER_TIMING_LOG 時的 JSON log）
+# ============================================================
+
+@app.before_request
+def _start_timing():
+    g.timing_token = timing.start()
+
+
+@app.after_request
+def _add_server_timing(response):
+    trace = timing.current()
+    if trace is not None:
+        timing.finish(trace, response.headers, request.method, request.path, response.status_code)
+    return response
+
+
+@app.teardown_request
+def _clear_timing(exc):
+    token = g.pop("timing_token", None)
+    if token is not None:
+        timing.reset(token)
+
+
+# ============================================================
+# Prometheus 指標：各路由的處理時間、處理中請求數、請求 / 回應大小
+# ============================================================
+
+@app.before_request
+def _start_metrics():
+    g.metrics_route = metrics.route_of(request.url_rule)
+    g.metrics_started = metrics.request_started(g.metrics_route, request.content_length)
+
+
+@app.after_request
+def _record_metrics(response):
+    if "metrics_started" in g:
+        metrics.request_finished(g.metrics_route, request.method, response.status_code,
+                                 g.metrics_started, response.content_length)
+    return response
+
+
+@app.teardown_request
+def _close_metrics(exc):
+    route = g.pop("metrics_route", None)
+    if route is not None:
+        metrics.request_closed(route)
+
+
+def _error_response(error: Exception):
+    """AI 呼叫失敗的回應：模型忙碌 503 + Retry-After、時間預算用完 504、其餘 500。"""
+    return jsonify({"error": str(error)}), api_common.error_status(error), api_common.error_headers(error)
+
 
 # ============================================================
 # Health Check
@@ -40,36 +122,97 @@ def health():
     return jsonify({"status": "ok", "service": "URBAN 文案機器人"})
 
 
+@app.route("/api/v1/stats", methods=["GET"])
+def stats():
+    return jsonify(api_common.stats_payload())
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# ============================================================
+# 圖片請求 / 回應：支援 multipart、image/* 原始 body 與舊版 base64 JSON
+# ============================================================
+
+def _image_request_data() -> dict | None:
+    """
+    讀取含圖片的請求：
+    - multipart/form-data：圖片放在 image 檔案欄位，其餘參數為表單欄位
+    - image/*：body 即為圖片，其餘參數放在 query string
+    - 其他：舊版 JSON（image_base64）
+    """
+    with timing.span("parse"):
+        if request.mimetype == "multipart/form-data":
+            data = request.form.to_dict()
+            upload = request.files.get("image")
+            if upload is not None:
+                data["image_bytes"] = upload.read()
+                data.setdefault("mime_type", upload.mimetype or "image/jpeg")
+            return data
+
+        if request.mimetype.startswith("image/"):
+            data = request.args.to_dict()
+            data["image_bytes"] = request.get_data()
+            data["mime_type"] = request.mimetype
+            return data
+
+        return request.get_json()
+
+
+def _image_response(image_bytes: bytes, meta: dict):
+    """Accept: image/* 時直接回傳圖片（metadata 放在 X-* 標頭），否則回傳舊版 JSON。"""
+    if api_common.wants_image_response(request.accept_mimetypes):
+        return Response(
+            image_bytes,
+            mimetype=api_common.sniff_image_mime(image_bytes),
+            headers=api_common.image_response_headers(meta),
+        )
+    payload = api_common.image_payload(image_bytes, meta)
+    with timing.span("serialize"):
+        return jsonify(payload)
+
+
+# ============================================================
+# 串流回應：Accept: text/event-stream (SSE) 或 application/x-ndjson
+# ============================================================
+
+def _stream_mimetype() -> str | None:
+    return api_common.stream_mimetype(request.accept_mimetypes)
+
+
+def _stream_response(parts, payload):
+    """每則 option 生成完就送出；stream_with_context 讓請求的時間預算延續到串流結束。"""
+    mimetype = _stream_mimetype()
+    body = stream_with_context(api_common.stream_body(parts, payload, mimetype))
+    return Response(body, mimetype=mimetype, headers=api_common.STREAM_HEADERS)
+
+
 # ============================================================
 # Mode 1: 圖片 → 文案 (結構化 JSON)
 # ============================================================
 
 @app.route("/api/v1/caption-from-image", methods=["POST"])
 def api_caption_from_image():
-    data = request.get_json()
-    if not data or "image_base64" not in data:
-        return jsonify({"error": "缺少 image_base64 欄位"}), 400
+    data = _image_request_data()
+    error = api_common.missing_fields_error(data, "image_base64")
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
         mime_type = data.get("mime_type", "image/jpeg")
-        result = ai_service.generate_caption_from_image_base64(
-            data["image_base64"], mime_type
-        )
+        if _stream_mimetype():
+            parts = ai_service.stream_caption_from_image_bytes(api_common.image_bytes_of(data), mime_type)
+            return _stream_response(parts, api_common.caption_payload)
 
-        if "raw_text" in result:
-            return jsonify({
-                "options": [{
-                    "label": "AI 生成文案",
-                    "emoji": "📝",
-                    "description": "完整文案",
-                    "content": result["raw_text"]
-                }]
-            })
-
-        return jsonify(result)
+        result = ai_service.generate_caption_from_image_bytes(
+            api_common.image_bytes_of(data), mime_type
+        )
+        return jsonify(api_common.caption_payload(result))
     except Exception as e:
         logger.error("caption-from-image 錯誤: %s", e, exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 # ============================================================
@@ -79,19 +222,18 @@ def api_caption_from_image():
 @app.route("/api/v1/generate-image", methods=["POST"])
 def api_generate_image():
     data = request.get_json()
-    if not data or "concept" not in data:
-        return jsonify({"error": "缺少 concept 欄位"}), 400
+    error = api_common.missing_fields_error(data, "concept")
+    if error:
+        return jsonify({"error": error}), 400
+
+    if api_common.wants_job(data, request.headers):
+        return _submit_job("generate-image", api_common.json_runner(api_common.run_generate_image), data)
 
     try:
-        image_bytes, description = ai_service.generate_image(data["concept"])
-        image_base64 = base64.b64encode(image_bytes).decode("utf-8")
-        return jsonify({
-            "image_base64": image_base64,
-            "description": description,
-        })
+        return _image_response(*api_common.run_generate_image(data))
     except Exception as e:
         logger.error("generate-image 錯誤: %s", e, exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 # ============================================================
@@ -100,23 +242,20 @@ def api_generate_image():
 
 @app.route("/api/v1/replace-background", methods=["POST"])
 def api_replace_background():
-    data = request.get_json()
-    if not data or "image_base64" not in data or "scene" not in data:
-        return jsonify({"error": "缺少 image_base64 或 scene 欄位"}), 400
+    data = _image_request_data()
+    error = api_common.missing_fields_error(data, "image_base64", "scene")
+    if error:
+        return jsonify({"error": error}), 400
+
+    if api_common.wants_job(data, request.headers):
+        return _submit_job("replace-background",
+                           api_common.json_runner(api_common.run_replace_background), data)
 
     try:
-        mime_type = data.get("mime_type", "image/jpeg")
-        image_bytes, description = ai_service.replace_background(
-            data["image_base64"], data["scene"], mime_type
-        )
-        image_base64 = base64.b64encode(image_bytes).decode("utf-8")
-        return jsonify({
-            "image_base64": image_base64,
-            "description": description,
-        })
+        return _image_response(*api_common.run_replace_background(data))
     except Exception as e:
         logger.error("replace-background 錯誤: %s", e, exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 # ============================================================
@@ -125,33 +264,44 @@ def api_replace_background():
 
 @app.route("/api/v1/design", methods=["POST"])
 def api_design():
-    data = request.get_json()
-    if not data or "image_base64" not in data or "text" not in data:
-        return jsonify({"error": "缺少 image_base64 或 text 欄位"}), 400
+    data = _image_request_data()
+    error = api_common.missing_fields_error(data, "image_base64", "text") or api_common.render_mode_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    if api_common.wants_job(data, request.headers):
+        return _submit_job("design", api_common.json_runner(api_common.run_design), data)
 
     try:
-        caption_text = data["text"]
+        return _image_response(*api_common.run_design(data))
+    except Exception as e:
+        logger.error("design 錯誤: %s", e, exc_info=True)
+        return _error_response(e)
 
-        # 太長的文案先精煉
-        if len(caption_text) > 30:
-            caption_text = ai_service.generate_short_caption(caption_text)
 
-        # 用 Gemini 圖片模型直接做時尚雜誌風排版
-        mime_type = data.get("mime_type", "image/jpeg")
-        result_bytes, description = ai_service.design_with_ai(
-            data["image_base64"], caption_text, mime_type
-        )
+# ============================================================
+# 背景任務 (Job) — 送出後立即回傳 job id，再輪詢結果
+# ============================================================
 
-        result_base64 = base64.b64encode(result_bytes).decode("utf-8")
-        return jsonify({
-            "image_base64": result_base64,
-            "text_used": caption_text,
-            "font_used": "AI 時尚排版",
-            "font_key": "ai_design",
-        })
-    except Exception as e:
-        logger.error("design 錯誤: %s", e, exc_info=True)
-        return jsonify({"error": str(e)}), 500
+def _submit_job(kind: str, fn, data: dict):
+    try:
+        job = job_manager.submit(kind, fn, data)
+    except jobs.JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+
+    payload = api_common.job_accepted_payload(job)
+    return jsonify(payload), 202, {"Location": payload["status_url"]}
+
+
+@app.route("/api/v1/jobs/<job_id>", methods=["GET"])
+def api_job_status(job_id):
+    # ?wait=N：long-poll 最多 N 秒（上限 JOB_MAX_WAIT_SECONDS），任務完成就立即回傳
+    wait = request.args.get("wait", 0, type=float)
+    job = job_manager.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({"error": "找不到任務或結果已過期"}), 404
+
+    return jsonify(jobs.public_view(job))
 
 
 # ============================================================
@@ -161,26 +311,19 @@ def api_design():
 @app.route("/api/v1/trending", methods=["POST"])
 def api_trending():
     data = request.get_json()
-    if not data or "topic" not in data:
-        return jsonify({"error": "缺少 topic 欄位"}), 400
+    error = api_common.missing_fields_error(data, "topic")
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
-        result = ai_service.generate_trending_caption(data["topic"])
+        if _stream_mimetype():
+            return _stream_response(ai_service.stream_trending_caption(data["topic"]), api_common.trending_payload)
 
-        if "raw_text" in result:
-            return jsonify({
-                "options": [{
-                    "label": "熱門文案",
-                    "emoji": "🔥",
-                    "description": "完整文案",
-                    "content": result["raw_text"]
-                }]
-            })
-
-        return jsonify(result)
+        result = ai_service.generate_trending_caption(data["topic"])
+        return jsonify(api_common.trending_payload(result))
     except Exception as e:
         logger.error("trending 錯誤: %s", e, exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 # ============================================================
@@ -190,26 +333,16 @@ def api_trending():
 @app.route("/api/v1/algorithm", methods=["POST"])
 def api_algorithm():
     data = request.get_json()
-    if not data or "caption" not in data:
-        return jsonify({"error": "缺少 caption 欄位"}), 400
+    error = api_common.missing_fields_error(data, "caption")
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
         result = ai_service.analyze_algorithm_score(data["caption"])
-
-        if "raw_text" in result:
-            return jsonify({
-                "score": 0,
-                "sections": [{
-                    "label": "分析結果",
-                    "emoji": "📊",
-                    "content": result["raw_text"]
-                }]
-            })
-
-        return jsonify(result)
+        return jsonify(api_common.algorithm_payload(result))
     except Exception as e:
         logger.error("algorithm 錯誤: %s", e, exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 # ============================================================
@@ -219,22 +352,31 @@ def api_algorithm():
 @app.route("/api/v1/recommend-font", methods=["POST"])
 def api_recommend_font():
     data = request.get_json()
-    if not data or "text" not in data:
-        return jsonify({"error": "缺少 text 欄位"}), 400
+    error = api_common.missing_fields_error(data, "text")
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
         scene = data.get("scene", "社群貼文")
         font_key = ai_service.recommend_font(data["text"], scene)
-        font_info = config.AVAILABLE_FONTS.get(font_key, {})
-        return jsonify({
-            "font_key": font_key,
-            "font_name": font_info.get("name", "未知"),
-            "font_style": font_info.get("style", ""),
-            "best_for": font_info.get("best_for", ""),
-        })
+        return jsonify(api_common.font_payload(font_key))
     except Exception as e:
         logger.error("recommend-font 錯誤: %s", e, exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
+
+
+# ============================================================
+# 批次：一次送出多個文字分析 / 文案生成項目
+# ============================================================
+
+@app.route("/api/v1/batch", methods=["POST"])
+def api_batch():
+    data = request.get_json()
+    error = batch.request_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    return jsonify({"results": batch.run(data["items"])})
 
 
 # ============================================================
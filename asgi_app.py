@@ -0,0 +1,451 @@
+"""
+URBAN 文案機器人 - ASGI 非同步服務模式
+與 app.py 提供相同的 /api/v1/* 路由，但 handler 皆為 async，
+Gemini 呼叫改用 client.aio，等待模型回應時不佔用執行緒，
+單一 worker 即可同時處理數百個進行中的請求。
+
+啟動方式:
+    gunicorn asgi_app:app -k uvicorn.workers.UvicornWorker --workers 2 --timeout 120
+    （Docker：設定 APP_MODULE=asgi_app:app WORKER_CLASS=uvicorn.workers.UvicornWorker）
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from quart import Quart, Response, g, request, jsonify
+
+import config
+import ai_service
+import api_common
+import batch
+import image_utils
+import jobs
+import metrics
+import retry
+import timing
+
+# ============================================================
+# 初始化
+# ============================================================
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+
+# 慢速圖片端點的背景任務（沿用同步 ai_service 函式，在執行緒池中執行）
+job_manager = jobs.JobManager(jobs.create_store())
+
+# 每個 worker 載入 app 時預載字型
+if config.FONT_PRELOAD:
+    image_utils.preload_fonts()
+
+
+# ============================================================
+# 請求時間預算：X-Request-Timeout 標頭或端點預設，傳遞到每次 Gemini 呼叫
+# ============================================================
+
+@app.before_request
+async def _start_deadline():
+    g.deadline_token = retry.set_deadline(api_common.request_budget(request.path, request.headers))
+
+
+@app.teardown_request
+async def _clear_deadline(exc):
+    token = g.pop("deadline_token", None)
+    if token is not None:
+        retry.reset_deadline(token)
+
+
+# ============================================================
+# 請求階段計時：Server-Timing 標頭（與 SERVER_TIMING_LOG 時的 JSON log）
+# ============================================================
+
+@app.before_request
+async def _start_timing():
+    g.timing_token = timing.start()
+
+
+@app.after_request
+async def _add_server_timing(response):
+    trace = timing.current()
+    if trace is not None:
+        timing.finish(trace, response.headers, request.method, request.path, response.status_code)
+    return response
+
+
+@app.teardown_request
+async def _clear_timing(exc):
+    token = g.pop("timing_token", None)
+    if token is not None:
+        timing.reset(token)
+
+
+# ============================================================
+# Prometheus 指標：各路由的處理時間、處理中請求數、請求 / 回應大小
+# ============================================================
+
+@app.before_request
+async def _start_metrics():
+    g.metrics_route = metrics.route_of(request.url_rule)
+    g.metrics_started = metrics.request_started(g.metrics_route, request.content_length)
+
+
+@app.after_request
+async def _record_metrics(response):
+    if "metrics_started" in g:
+        metrics.request_finished(g.metrics_route, request.method, response.status_code,
+                                 g.metrics_started, response.content_length)
+    return response
+
+
+@app.teardown_request
+async def _close_metrics(exc):
+    route = g.pop("metrics_route", None)
+    if route is not None and not g.pop("metrics_closed_by_stream", False):
+        metrics.request_closed(route)
+
+
+def _error_response(error: Exception):
+    """AI 呼叫失敗的回應：模型忙碌 503 + Retry-After、時間預算用完 504、其餘 500。"""
+    return jsonify({"error": str(error)}), api_common.error_status(error), api_common.error_headers(error)
+
+
+# ============================================================
+# Health Check
+# ============================================================
+
+@app.route("/", methods=["GET"])
+async def health():
+    return jsonify({"status": "ok", "service": "URBAN 文案機器人", "mode": "asgi"})
+
+
+@app.route("/api/v1/stats", methods=["GET"])
+async def stats():
+    return jsonify(api_common.stats_payload())
+
+
+@app.route("/metrics", methods=["GET"])
+async def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# ============================================================
+# 圖片請求 / 回應：支援 multipart、image/* 原始 body 與舊版 base64 JSON
+# ============================================================
+
+async def _image_request_data() -> dict | None:
+    """讀取含圖片的請求（格式同 app.py 的 _image_request_data）。"""
+    with timing.span("parse"):
+        if request.mimetype == "multipart/form-data":
+            data = (await request.form).to_dict()
+            upload = (await request.files).get("image")
+            if upload is not None:
+                data["image_bytes"] = upload.read()
+                data.setdefault("mime_type", upload.mimetype or "image/jpeg")
+            return data
+
+        if request.mimetype.startswith("image/"):
+            data = request.args.to_dict()
+            data["image_bytes"] = await request.get_data()
+            data["mime_type"] = request.mimetype
+            return data
+
+        return await request.get_json()
+
+
+def _image_response(image_bytes: bytes, meta: dict):
+    """Accept: image/* 時直接回傳圖片（metadata 放在 X-* 標頭），否則回傳舊版 JSON。"""
+    if api_common.wants_image_response(request.accept_mimetypes):
+        return Response(
+            image_bytes,
+            mimetype=api_common.sniff_image_mime(image_bytes),
+            headers=api_common.image_response_headers(meta),
+        )
+    payload = api_common.image_payload(image_bytes, meta)
+    with timing.span("serialize"):
+        return jsonify(payload)
+
+
+# ============================================================
+# 串流回應：Accept: text/event-stream (SSE) 或 application/x-ndjson
+# ============================================================
+
+def _stream_mimetype() -> str | None:
+    return api_common.stream_mimetype(request.accept_mimetypes)
+
+
+def _stream_with_request_state(body):
+    """
+    Quart 在送出串流內容之前就執行 teardown_request，因此串流期間的時間預算與計時改由串流本身帶入，
+    處理中請求數也延到串流結束（或客戶端斷線）才扣回，作用同 Flask 的 stream_with_context。
+    """
+    deadline_at = retry.current_deadline()
+    trace = timing.current()
+    route = g.get("metrics_route")
+    g.metrics_closed_by_stream = True  # _close_metrics 不提早扣回
+
+    async def stream():
+        deadline_token = retry.restore_deadline(deadline_at)
+        timing_token = timing.attach(trace)
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            if timing_token is not None:
+                timing.reset(timing_token)
+            retry.reset_deadline(deadline_token)
+            if route is not None:
+                metrics.request_closed(route)
+
+    return stream()
+
+
+def _stream_response(parts, payload):
+    """每則 option 生成完就送出（連上模型前的錯誤已在 handler 內以一般錯誤回應處理）。"""
+    mimetype = _stream_mimetype()
+    body = _stream_with_request_state(api_common.stream_body_async(parts, payload, mimetype))
+    return Response(body, mimetype=mimetype, headers=api_common.STREAM_HEADERS)
+
+
+# ============================================================
+# Mode 1: 圖片 → 文案 (結構化 JSON)
+# ============================================================
+
+@app.route("/api/v1/caption-from-image", methods=["POST"])
+async def api_caption_from_image():
+    data = await _image_request_data()
+    error = api_common.missing_fields_error(data, "image_base64")
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        mime_type = data.get("mime_type", "image/jpeg")
+        if _stream_mimetype():
+            parts = await ai_service.stream_caption_from_image_bytes_async(api_common.image_bytes_of(data), mime_type)
+            return _stream_response(parts, api_common.caption_payload)
+
+        result = await ai_service.generate_caption_from_image_bytes_async(
+            api_common.image_bytes_of(data), mime_type
+        )
+        return jsonify(api_common.caption_payload(result))
+    except Exception as e:
+        logger.error("caption-from-image 錯誤: %s", e, exc_info=True)
+        return _error_response(e)
+
+
+# ============================================================
+# Mode 2: 文字 → 圖片
+# ============================================================
+
+@app.route("/api/v1/generate-image", methods=["POST"])
+async def api_generate_image():
+    data = await request.get_json()
+    error = api_common.missing_fields_error(data, "concept")
+    if error:
+        return jsonify({"error": error}), 400
+
+    if api_common.wants_job(data, request.headers):
+        return await _submit_job("generate-image", api_common.json_runner(api_common.run_generate_image), data)
+
+    try:
+        image_bytes, description = await ai_service.generate_image_async(data["concept"])
+        return _image_response(image_bytes, {"description": description})
+    except Exception as e:
+        logger.error("generate-image 錯誤: %s", e, exc_info=True)
+        return _error_response(e)
+
+
+# ============================================================
+# Mode 2B: 人物照 + 背景替換
+# ============================================================
+
+@app.route("/api/v1/replace-background", methods=["POST"])
+async def api_replace_background():
+    data = await _image_request_data()
+    error = api_common.missing_fields_error(data, "image_base64", "scene")
+    if error:
+        return jsonify({"error": error}), 400
+
+    if api_common.wants_job(data, request.headers):
+        return await _submit_job("replace-background",
+                                 api_common.json_runner(api_common.run_replace_background), data)
+
+    try:
+        mime_type = data.get("mime_type", "image/jpeg")
+        image_bytes, description = await ai_service.replace_background_bytes_async(
+            api_common.image_bytes_of(data), data["scene"], mime_type
+        )
+        return _image_response(image_bytes, {"description": description})
+    except Exception as e:
+        logger.error("replace-background 錯誤: %s", e, exc_info=True)
+        return _error_response(e)
+
+
+# ============================================================
+# Mode 3: 圖片 + 文字 → 排版合成
+# ============================================================
+
+@app.route("/api/v1/design", methods=["POST"])
+async def api_design():
+    data = await _image_request_data()
+    error = api_common.missing_fields_error(data, "image_base64", "text") or api_common.render_mode_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    if api_common.wants_job(data, request.headers):
+        return await _submit_job("design", api_common.json_runner(api_common.run_design), data)
+
+    try:
+        engine, reason = api_common.design_engine(data)
+        if engine == "local":
+            # 本機排版是 CPU 工作，放到執行緒，不卡住 event loop
+            return _image_response(*await asyncio.to_thread(api_common.render_design_local, data, reason))
+        try:
+            return _image_response(*await _design_ai(data, reason))
+        except Exception as e:
+            if api_common.render_mode(data) != "auto":
+                raise
+            logger.warning("AI 排版失敗，改用本機排版: %s", e)
+            return _image_response(*await asyncio.to_thread(api_common.render_design_local, data, "ai_failed"))
+    except Exception as e:
+        logger.error("design 錯誤: %s", e, exc_info=True)
+        return _error_response(e)
+
+
+async def _design_ai(data: dict, reason: str) -> tuple[bytes, dict]:
+    caption_text = data["text"]
+
+    # 太長的文案先精煉
+    if len(caption_text) > 30:
+        with timing.span("short_caption"):
+            caption_text = await ai_service.generate_short_caption_async(caption_text)
+
+    mime_type = data.get("mime_type", "image/jpeg")
+    image_bytes = api_common.image_bytes_of(data)
+    with timing.span("design_ai"):
+        result_bytes, description = await ai_service.design_with_ai_bytes_async(
+            image_bytes, caption_text, mime_type
+        )
+    metrics.record_design("ai", reason)
+    return result_bytes, api_common.design_meta(caption_text, "ai", reason)
+
+
+# ============================================================
+# 背景任務 (Job) — 送出後立即回傳 job id，再輪詢結果
+# ============================================================
+
+async def _submit_job(kind: str, fn, data: dict):
+    # 任務存放區（file / sqlite）的讀寫是阻塞 I/O，與圖片 / 回應快取相同改在執行緒中進行
+    try:
+        job = await asyncio.to_thread(job_manager.submit, kind, fn, data)
+    except jobs.JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+
+    payload = api_common.job_accepted_payload(job)
+    return jsonify(payload), 202, {"Location": payload["status_url"]}
+
+
+@app.route("/api/v1/jobs/<job_id>", methods=["GET"])
+async def api_job_status(job_id):
+    # ?wait=N：long-poll 最多 N 秒，等待期間讓出 event loop
+    wait = min(request.args.get("wait", 0, type=float), config.JOB_MAX_WAIT_SECONDS)
+    deadline = time.monotonic() + wait
+    while True:
+        job = await asyncio.to_thread(job_manager.get, job_id)
+        if job is None:
+            return jsonify({"error": "找不到任務或結果已過期"}), 404
+        if job["status"] in jobs.FINISHED_STATES or time.monotonic() >= deadline:
+            return jsonify(jobs.public_view(job))
+        await asyncio.sleep(config.JOB_POLL_INTERVAL)
+
+
+# ============================================================
+# Mode 4: 熱門風格文案 (結構化 JSON)
+# ============================================================
+
+@app.route("/api/v1/trending", methods=["POST"])
+async def api_trending():
+    data = await request.get_json()
+    error = api_common.missing_fields_error(data, "topic")
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        if _stream_mimetype():
+            parts = await ai_service.stream_trending_caption_async(data["topic"])
+            return _stream_response(parts, api_common.trending_payload)
+
+        result = await ai_service.generate_trending_caption_async(data["topic"])
+        return jsonify(api_common.trending_payload(result))
+    except Exception as e:
+        logger.error("trending 錯誤: %s", e, exc_info=True)
+        return _error_response(e)
+
+
+# ============================================================
+# Mode 5: 演算法分析 (結構化 JSON)
+# ============================================================
+
+@app.route("/api/v1/algorithm", methods=["POST"])
+async def api_algorithm():
+    data = await request.get_json()
+    error = api_common.missing_fields_error(data, "caption")
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        result = await ai_service.analyze_algorithm_score_async(data["caption"])
+        return jsonify(api_common.algorithm_payload(result))
+    except Exception as e:
+        logger.error("algorithm 錯誤: %s", e, exc_info=True)
+        return _error_response(e)
+
+
+# ============================================================
+# 字型推薦
+# ============================================================
+
+@app.route("/api/v1/recommend-font", methods=["POST"])
+async def api_recommend_font():
+    data = await request.get_json()
+    error = api_common.missing_fields_error(data, "text")
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        scene = data.get("scene", "社群貼文")
+        font_key = await ai_service.recommend_font_async(data["text"], scene)
+        return jsonify(api_common.font_payload(font_key))
+    except Exception as e:
+        logger.error("recommend-font 錯誤: %s", e, exc_info=True)
+        return _error_response(e)
+
+
+# ============================================================
+# 批次：一次送出多個文字分析 / 文案生成項目
+# ============================================================
+
+@app.route("/api/v1/batch", methods=["POST"])
+async def api_batch():
+    data = await request.get_json()
+    error = batch.request_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    return jsonify({"results": await batch.run_async(data["items"])})
+
+
+# ============================================================
+# 啟動
+# ============================================================
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", 8080))
+    logger.info("URBAN 文案機器人 ASGI API 啟動 - port %d", port)
+    app.run(host="0.0.0.0", port=port)
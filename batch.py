@@ -0,0 +1,166 @@
+"""
+URBAN 文案機器人 - 批次端點 (/api/v1/batch)
+一次送出多個文字分析 / 文案生成項目（可混合不同操作），以有上限的執行緒池（WSGI）
+或 asyncio（ASGI）並行執行，結果依輸入順序回傳；單一項目失敗不影響其他項目。
+
+請求:
+    {"items": [{"op": "algorithm", "caption": "..."}, {"op": "trending", "topic": "..."}]}
+回應（HTTP 200，每個項目各自的 status）:
+    {"results": [{"op": "algorithm", "status": 200, "result": {...}},
+                 {"op": "trending", "status": 503, "error": "...", "retry_after": 5}]}
+
+每個項目沿用單一端點的時間預算（config.REQUEST_DEADLINES），且不超過整個批次的預算。
+圖片生成類的慢速端點不支援批次，請改用背景任務。
+"""
+
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import ai_service
+import api_common
+import config
+import retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCENE = "社群貼文"
+
+
+# ============================================================
+# 各操作的執行函式（回應格式與單一端點相同）
+# ============================================================
+
+def _caption(item: dict) -> dict:
+    result = ai_service.generate_caption_from_image_bytes(
+        api_common.image_bytes_of(item), item.get("mime_type", "image/jpeg")
+    )
+    return api_common.caption_payload(result)
+
+
+async def _caption_async(item: dict) -> dict:
+    result = await ai_service.generate_caption_from_image_bytes_async(
+        api_common.image_bytes_of(item), item.get("mime_type", "image/jpeg")
+    )
+    return api_common.caption_payload(result)
+
+
+def _trending(item: dict) -> dict:
+    return api_common.trending_payload(ai_service.generate_trending_caption(item["topic"]))
+
+
+async def _trending_async(item: dict) -> dict:
+    return api_common.trending_payload(await ai_service.generate_trending_caption_async(item["topic"]))
+
+
+def _algorithm(item: dict) -> dict:
+    return api_common.algorithm_payload(ai_service.analyze_algorithm_score(item["caption"]))
+
+
+async def _algorithm_async(item: dict) -> dict:
+    return api_common.algorithm_payload(await ai_service.analyze_algorithm_score_async(item["caption"]))
+
+
+def _font(item: dict) -> dict:
+    return api_common.font_payload(ai_service.recommend_font(item["text"], item.get("scene", DEFAULT_SCENE)))
+
+
+async def _font_async(item: dict) -> dict:
+    return api_common.font_payload(
+        await ai_service.recommend_font_async(item["text"], item.get("scene", DEFAULT_SCENE))
+    )
+
+
+# op（同單一端點的路徑名稱）-> (必要欄位, 同步版本, async 版本)
+OPERATIONS = {
+    "caption-from-image": (("image_base64",), _caption, _caption_async),
+    "trending": (("topic",), _trending, _trending_async),
+    "algorithm": (("caption",), _algorithm, _algorithm_async),
+    "recommend-font": (("text",), _font, _font_async),
+}
+
+
+# ============================================================
+# 驗證與單一項目的結果
+# ============================================================
+
+def request_error(data: dict | None) -> str | None:
+    """檢查批次請求本身；個別項目的錯誤在該項目的結果中回報。"""
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return "缺少 items 欄位"
+    if len(items) > config.BATCH_MAX_ITEMS:
+        return f"items 最多 {config.BATCH_MAX_ITEMS} 項"
+    return None
+
+
+def _item_error(item) -> dict | None:
+    """項目格式錯誤（不支援的 op 或缺少欄位）時回傳 400 結果。"""
+    op = item.get("op") if isinstance(item, dict) else None
+    if op not in OPERATIONS:
+        return {"op": op, "status": 400, "error": f"不支援的 op，可用: {', '.join(OPERATIONS)}"}
+    error = api_common.missing_fields_error(item, *OPERATIONS[op][0])
+    if error:
+        return {"op": op, "status": 400, "error": error}
+    return None
+
+
+def _failure(index: int, op: str, error: Exception) -> dict:
+    logger.error("batch 第 %d 項 (%s) 錯誤: %s", index, op, error, exc_info=error)
+    result = {"op": op, "status": api_common.error_status(error), "error": str(error)}
+    retry_after = api_common.error_headers(error).get("Retry-After")
+    if retry_after is not None:
+        result["retry_after"] = int(retry_after)
+    return result
+
+
+# ============================================================
+# WSGI（執行緒）版本
+# ============================================================
+
+def _run_item(index: int, item) -> dict:
+    error = _item_error(item)
+    if error:
+        return error
+    op = item["op"]
+    try:
+        with retry.deadline(config.REQUEST_DEADLINES[op]):
+            return {"op": op, "status": 200, "result": OPERATIONS[op][1](item)}
+    except Exception as e:
+        return _failure(index, op, e)
+
+
+def run(items: list) -> list[dict]:
+    """以最多 BATCH_CONCURRENCY 個執行緒並行執行，結果依輸入順序回傳。"""
+    workers = min(config.BATCH_CONCURRENCY, len(items))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+        # 每個項目各自複製 context，帶著整個批次的時間預算進入執行緒
+        futures = [
+            pool.submit(contextvars.copy_context().run, _run_item, index, item)
+            for index, item in enumerate(items)
+        ]
+        return [future.result() for future in futures]
+
+
+# ============================================================
+# ASGI（asyncio）版本
+# ============================================================
+
+async def run_async(items: list) -> list[dict]:
+    """run 的 async 版本：最多 BATCH_CONCURRENCY 個項目同時呼叫 Gemini。"""
+    semaphore = asyncio.Semaphore(config.BATCH_CONCURRENCY)
+
+    async def run_item(index: int, item) -> dict:
+        error = _item_error(item)
+        if error:
+            return error
+        op = item["op"]
+        async with semaphore:
+            try:
+                with retry.deadline(config.REQUEST_DEADLINES[op]):
+                    return {"op": op, "status": 200, "result": await OPERATIONS[op][2](item)}
+            except Exception as e:
+                return _failure(index, op, e)
+
+    return await asyncio.gather(*(run_item(index, item) for index, item in enumerate(items)))
@@ -0,0 +1,114 @@
+"""
+URBAN 文案機器人 - 底部模糊（步驟 1）效能與一致性測試
+比較舊版整張 GaussianBlur + Image.composite 與只模糊下半部（含 kernel 邊界）的 _blur_bottom：
+- 各尺寸 / 模糊半徑下兩者的像素完全相同（雜訊圖，邊界誤差最明顯），未經遮罩的模糊下半部也相同
+- overlay_text_on_image 的整體輸出（JPEG bytes）與舊版步驟 1 相同
+- 耗時比較
+
+執行方式:
+    python benchmarks/bench_blur.py
+"""
+
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image, ImageFilter  # noqa: E402
+
+import image_utils  # noqa: E402
+
+# 常見尺寸與奇數尺寸（blur_start 取整、padding 超出上緣的情況）
+SIZES = [(1080, 1350), (810, 1080), (1620, 2160), (3024, 4032), (4032, 3024), (1001, 777), (640, 40)]
+EXTRA_RADII = [3, 5.5, 8, 20]
+ROUNDS = 5
+
+
+def _legacy_blur(img: Image.Image, radius: float) -> Image.Image:
+    """舊版步驟 1：整張模糊，再以整張遮罩（上半部為 0）合成。"""
+    img_width, img_height = img.size
+    blur_start = int(img_height * 0.50)
+    span = img_height - blur_start
+    column = bytes(blur_start) + bytes(int((i / span) * 80) for i in range(span))
+    mask = image_utils._stretch_column(column, img_width)
+    blurred = img.filter(ImageFilter.GaussianBlur(radius=radius))
+    return Image.composite(blurred, img, mask)
+
+
+def _current_blur(img: Image.Image, radius: float) -> Image.Image:
+    img = img.copy()
+    image_utils._blur_bottom(img, radius)
+    return img
+
+
+def _roi_rows_match(img: Image.Image, radius: float) -> bool:
+    """
+    遮罩開頭幾列的 alpha 為 0，會掩蓋邊界誤差；因此另外確認未經遮罩的模糊結果：
+    以 _blur_padding 裁切後模糊的下半部，與整張模糊的下半部逐像素相同。
+    """
+    width, height = img.size
+    blur_start = int(height * 0.50)
+    top = max(0, blur_start - image_utils._blur_padding(radius))
+    full = img.filter(ImageFilter.GaussianBlur(radius=radius)).crop((0, blur_start, width, height))
+    roi = img.crop((0, top, width, height)).filter(ImageFilter.GaussianBlur(radius=radius))
+    return roi.crop((0, blur_start - top, width, height - top)).tobytes() == full.tobytes()
+
+
+def _noise_image(width: int, height: int) -> Image.Image:
+    return Image.merge("RGBA", [Image.effect_noise((width, height), 64) for _ in range(3)]
+                       + [Image.new("L", (width, height), 255)])
+
+
+def _best_of(fn, *args) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check_overlay_parity():
+    """整個 overlay_text_on_image 的輸出與舊版步驟 1 相同。"""
+    original = image_utils._blur_bottom
+
+    def legacy_in_place(img, radius):
+        img.paste(_legacy_blur(img, radius))
+
+    buffer = io.BytesIO()
+    _noise_image(1620, 2160).convert("RGB").save(buffer, format="JPEG", quality=90)
+    for text in ("自律", "長期主義是一種選擇，自律讓你擁有更多選擇權。" * 4):
+        current = image_utils.overlay_text_on_image(buffer.getvalue(), text)
+        image_utils._blur_bottom = legacy_in_place
+        try:
+            legacy = image_utils.overlay_text_on_image(buffer.getvalue(), text)
+        finally:
+            image_utils._blur_bottom = original
+        assert current == legacy, "overlay_text_on_image 輸出不一致"
+    print("overlay_text_on_image 輸出與舊版相同")
+
+
+def main():
+    logging.getLogger("image_utils").setLevel(logging.ERROR)
+    print(f"{'size':>11} | {'radius':>6} | {'legacy':>9} | {'roi':>9} | {'speedup':>7}")
+    print("-" * 56)
+    for width, height in SIZES:
+        img = _noise_image(width, height)
+        for radius in [max(3, width // 500)] + EXTRA_RADII:
+            assert _current_blur(img, radius).tobytes() == _legacy_blur(img, radius).tobytes(), \
+                f"{width}x{height} radius={radius} 模糊結果不一致"
+            assert _roi_rows_match(img, radius), f"{width}x{height} radius={radius} 模糊範圍的 padding 不足"
+        radius = max(3, width // 500)
+        legacy = _best_of(_legacy_blur, img, radius)
+        current = _best_of(_current_blur, img, radius)
+        print(f"{width:>5}x{height:<5} | {radius:>6} | {legacy * 1000:>7.1f}ms | {current * 1000:>7.1f}ms | "
+              f"{legacy / current:>6.1f}x")
+    print(f"\n所有尺寸與半徑 {EXTRA_RADII} 的模糊結果與舊版逐像素相同")
+    check_overlay_parity()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+URBAN 文案機器人 - 模型輸出 JSON 解析基準測試
+以 benchmarks/json_corpus/ 中的模型輸出樣本（code block、前後說明文字、字串內換行、
+截斷、多餘逗號、非 JSON 等）比較舊版 regex + find/rfind 解析與 json_stream：
+每個樣本取回的 options / sections 元素數，以及完整解析與逐塊串流餵入的耗時。
+把實際記錄到的失敗輸出存成 .txt 放進 json_corpus/ 即可加入比較。
+
+執行方式:
+    python benchmarks/bench_json_parse.py
+"""
+
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import json_stream  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "json_corpus")
+CHUNK_SIZE = 32  # 串流時每塊的字元數（約等於 Gemini 一個 chunk）
+REPEAT = 1000
+
+
+def legacy_parse(text: str) -> dict:
+    """舊版 ai_service._parse_json_response（比較基準）。"""
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        cleaned = re.sub(r'^```(?:json)?\s*\n?', '', cleaned)
+        cleaned = re.sub(r'\n?```\s*$', '', cleaned)
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        start = cleaned.find('{')
+        end = cleaned.rfind('}')
+        if start != -1 and end != -1:
+            try:
+                return json.loads(cleaned[start:end + 1])
+            except json.JSONDecodeError:
+                pass
+        return {"raw_text": text}
+
+
+def stream_parse(text: str) -> dict | None:
+    extractor = json_stream.JsonExtractor()
+    for start in range(0, len(text), CHUNK_SIZE):
+        extractor.feed(text[start:start + CHUNK_SIZE])
+    return extractor.result()
+
+
+def _elements(result: dict | None) -> str:
+    if result is None or "raw_text" in result:
+        return "raw"
+    count = len(result.get("options") or result.get("sections") or [])
+    return f"{count}{'*' if result.get('partial') else ''}"
+
+
+def _micros(fn, text: str) -> float:
+    return timeit.timeit(lambda: fn(text), number=REPEAT) / REPEAT * 1e6
+
+
+def main():
+    names = sorted(name for name in os.listdir(CORPUS_DIR) if name.endswith(".txt"))
+    print(f"{'樣本':<32}{'舊版':>6}{'新版':>6}{'串流':>6}   {'舊版 µs':>8}{'新版 µs':>8}{'串流 µs':>8}")
+    totals = {"legacy": 0, "parse": 0, "stream": 0}
+    for name in names:
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+            text = f.read()
+        legacy, parsed, streamed = legacy_parse(text), json_stream.parse(text), stream_parse(text)
+        for key, result in (("legacy", legacy), ("parse", parsed), ("stream", streamed)):
+            if result is not None and "raw_text" not in result:
+                totals[key] += len(result.get("options") or result.get("sections") or [])
+        print(f"{name[:-4]:<32}{_elements(legacy):>6}{_elements(parsed):>6}{_elements(streamed):>6}   "
+              f"{_micros(legacy_parse, text):8.1f}{_micros(json_stream.parse, text):8.1f}"
+              f"{_micros(stream_parse, text):8.1f}")
+    print(f"\n取回的元素總數：舊版 {totals['legacy']}，新版 {totals['parse']}，串流 {totals['stream']}"
+          f"（raw = 整份退回原始文字，* = 不完整的部分結果）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+URBAN 文案機器人 - 遮罩建構效能測試
+比較逐列 draw.line 的舊做法與向量化 + LRU 快取的 _blur_mask / _gradient_mask。
+
+執行方式:
+    python benchmarks/bench_masks.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+import image_utils  # noqa: E402
+
+# iPhone 直式 / 橫式與 IG 常見尺寸
+SIZES = [(1080, 1350), (3024, 4032), (4032, 3024)]
+ROUNDS = 5
+
+
+def _legacy_masks(img_width: int, img_height: int) -> tuple[Image.Image, Image.Image]:
+    """舊版步驟 1、2：每一列呼叫一次 draw.line。"""
+    blur_mask = Image.new("L", (img_width, img_height), 0)
+    blur_draw = ImageDraw.Draw(blur_mask)
+    blur_start = int(img_height * 0.50)
+    for y in range(blur_start, img_height):
+        alpha = int(((y - blur_start) / (img_height - blur_start)) * 80)
+        blur_draw.line([(0, y), (img_width, y)], fill=alpha)
+
+    overlay = Image.new("RGBA", (img_width, img_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    gradient_start = int(img_height * 0.30)
+    for y in range(gradient_start, img_height):
+        progress = (y - gradient_start) / (img_height - gradient_start)
+        eased = progress * progress * progress
+        alpha = int(eased * 220)
+        draw.line([(0, y), (img_width, y)], fill=(8, 10, 25, alpha))
+    return blur_mask, overlay
+
+
+def _current_masks(img_width: int, img_height: int) -> tuple[Image.Image, Image.Image]:
+    """新版步驟 1、2：快取遮罩 + putalpha（模糊遮罩只涵蓋 50%、漸層只涵蓋 30% 高度以下）。"""
+    blur_mask = image_utils._blur_mask(img_width, img_height)
+    gradient_start = int(img_height * 0.30)
+    overlay = Image.new("RGBA", (img_width, img_height - gradient_start), (8, 10, 25, 0))
+    overlay.putalpha(image_utils._gradient_mask(img_width, img_height))
+    return blur_mask, overlay
+
+
+def _best_of(fn, *args) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'size':>11} | {'legacy':>9} | {'cold':>9} | {'warm':>9} | {'speedup':>7}")
+    print("-" * 58)
+    for width, height in SIZES:
+        legacy_blur, legacy_overlay = _legacy_masks(width, height)
+        blur, overlay = _current_masks(width, height)
+        legacy_blur = legacy_blur.crop((0, height - blur.height, width, height))
+        assert blur.tobytes() == legacy_blur.tobytes(), "blur mask 不一致"
+        legacy_alpha = legacy_overlay.getchannel("A").crop((0, height - overlay.height, width, height))
+        assert overlay.getchannel("A").tobytes() == legacy_alpha.tobytes(), \
+            "gradient alpha 不一致"
+
+        legacy = _best_of(_legacy_masks, width, height)
+
+        def cold():
+            image_utils._blur_mask.cache_clear()
+            image_utils._gradient_mask.cache_clear()
+            _current_masks(width, height)
+
+        cold_time = _best_of(cold)
+        _current_masks(width, height)
+        warm = _best_of(_current_masks, width, height)
+
+        print(f"{width:>5}x{height:<5} | {legacy * 1000:>7.1f}ms | {cold_time * 1000:>7.1f}ms | "
+              f"{warm * 1000:>7.1f}ms | {legacy / warm:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
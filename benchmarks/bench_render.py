@@ -0,0 +1,274 @@
+"""
+URBAN 文案機器人 - overlay_text_on_image 效能與記憶體測試
+以 1080px ~ 4032px 的合成照片、4 ~ 200 字的文案與 AVAILABLE_FONTS 中的每個字型，
+記錄每個組合的：
+- 總耗時（第一次：清空字型 / 遮罩快取；之後取中位數）
+- 各階段耗時（decode / blur / gradient / layout / composite / encode，來自 image_utils 的 timing.span）
+- 尖峰 RSS（執行期間以背景執行緒取樣 /proc/self/statm，另記相對於開始前的增量）
+- tracemalloc 尖峰（另外跑一次，避免 tracemalloc 的額外負擔影響耗時）
+結果寫成 JSON（含 git commit、Python / Pillow 版本），可用 --compare 與另一次的結果比較。
+
+執行方式:
+    python benchmarks/bench_render.py                                 # 寫入 benchmarks/results/render-<commit>.json
+    python benchmarks/bench_render.py --quick                         # 只跑 1080 / 4032 與 4 / 200 字
+    python benchmarks/bench_render.py --compare benchmarks/results/render-abc1234.json
+    python benchmarks/bench_render.py --max-dimension 0               # 不縮圖，以原始尺寸排版
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import PIL  # noqa: E402
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+import config  # noqa: E402
+import image_utils  # noqa: E402
+import timing  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+STAGES = ["decode", "blur", "gradient", "layout", "composite", "encode"]
+
+# 最長邊；短邊為 3:4（iPhone 直式）
+SIZES = [1080, 2160, 3024, 4032]
+LENGTHS = [4, 12, 30, 80, 200]
+ROUNDS = 5
+REGRESSION_THRESHOLD = 0.10  # 比較時超過 10% 視為退步
+
+_TEXT = ("自律不是限制，而是讓你在人生的每個路口都有得選。資產累積靠的不是運氣，是每天一點點的堅持。"
+         "Compound interest 是世界第八大奇蹟，你今天存下的每一塊錢都在替未來的自己工作。")
+
+
+def caption(length: int) -> str:
+    return (_TEXT * (length // len(_TEXT) + 1))[:length]
+
+
+def synthetic_photo(longest: int) -> bytes:
+    """類似照片的 JPEG：漸層背景 + 色塊 + 雜訊（純色圖的壓縮與模糊成本偏低）。"""
+    size = (longest * 3 // 4, longest)
+    rng = random.Random(longest)
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        radius = rng.randrange(longest // 20, longest // 5)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    noise = Image.effect_noise(size, 40).convert("RGB")
+    img = Image.blend(img.filter(ImageFilter.GaussianBlur(3)), noise, 0.15)
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+# ============================================================
+# 記憶體取樣
+# ============================================================
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return None
+
+
+class RssSampler:
+    """執行期間每 1ms 讀一次 RSS，記錄尖峰；沒有 /proc 時改用 ru_maxrss（整個 process 的尖峰）。"""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.baseline = _rss_bytes()
+        self.peak = self.baseline or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes() or 0)
+
+    def __enter__(self):
+        if self.baseline is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.baseline is None:
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            self.baseline = 0
+            return False
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes() or 0)
+        return False
+
+
+# ============================================================
+# 單一組合
+# ============================================================
+
+def _clear_caches():
+    image_utils._load_font.cache_clear()
+    image_utils._blur_mask.cache_clear()
+    image_utils._gradient_mask.cache_clear()
+    image_utils._glyph_advance.cache_clear()
+    image_utils._brand_layer.cache_clear()
+
+
+def _render(image_bytes: bytes, text: str, font_key: str, max_dimension: int) -> tuple[float, dict, bytes]:
+    """執行一次，回傳 (總秒數, {階段: 秒數}, 輸出)；同名的階段（例如多個 composite）加總。"""
+    token = timing.start()
+    try:
+        started = time.perf_counter()
+        output = image_utils.overlay_text_on_image(image_bytes, text, font_key=font_key,
+                                                   max_dimension=max_dimension)
+        elapsed = time.perf_counter() - started
+        stages = dict.fromkeys(STAGES, 0.0)
+        for name, seconds, _ in timing.current().spans:
+            stages[name] = stages.get(name, 0.0) + seconds
+    finally:
+        timing.reset(token)
+    return elapsed, stages, output
+
+
+def measure(image_bytes: bytes, text: str, font_key: str, max_dimension: int, rounds: int) -> dict:
+    _clear_caches()
+    with RssSampler() as rss:
+        cold, _, output = _render(image_bytes, text, font_key, max_dimension)
+        runs = [_render(image_bytes, text, font_key, max_dimension) for _ in range(rounds)]
+
+    tracemalloc.start()
+    _render(image_bytes, text, font_key, max_dimension)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    walls = [elapsed for elapsed, _, _ in runs]
+    stages = {name: statistics.median(run[1][name] for run in runs) for name in runs[0][1]}
+    stages["other"] = max(0.0, statistics.median(walls) - sum(stages.values()))
+    font_path = getattr(image_utils._load_font(font_key, 100), "path", None)
+    return {
+        "wall_ms": round(statistics.median(walls) * 1000, 2),
+        "wall_min_ms": round(min(walls) * 1000, 2),
+        "cold_ms": round(cold * 1000, 2),
+        "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in stages.items()},
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "rss_delta_mb": round((rss.peak - rss.baseline) / 2**20, 1),
+        "tracemalloc_peak_mb": round(traced_peak / 2**20, 2),
+        "output_size": list(Image.open(io.BytesIO(output)).size),
+        "output_kb": round(len(output) / 1024, 1),
+        "font_file": font_path if isinstance(font_path, str) else "default",
+    }
+
+
+# ============================================================
+# 結果檔與比較
+# ============================================================
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def case_key(case: dict) -> str:
+    return f"{case['size']}px/{case['length']}字/{case['font']}"
+
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {case_key(case): case for case in baseline["cases"]}
+    print(f"\n與 {baseline['commit']} 比較（{baseline_path}），超過 {REGRESSION_THRESHOLD:.0%} 標記 ▲ / ▼")
+    print(f"{'組合':<28}{'耗時 ms':>16}{'尖峰 RSS MB':>18}{'tracemalloc MB':>20}")
+    regressions = 0
+    for case in current["cases"]:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        cells = []
+        for metric in ("wall_ms", "peak_rss_mb", "tracemalloc_peak_mb"):
+            before, after = old[metric], case[metric]
+            change = (after - before) / before if before else 0.0
+            mark = "▲" if change > REGRESSION_THRESHOLD else "▼" if change < -REGRESSION_THRESHOLD else " "
+            regressions += mark == "▲"
+            cells.append(f"{before:>7} → {after:<7}{mark}")
+        print(f"{case_key(case):<28}" + "".join(f"{cell:>18}" for cell in cells))
+    print(f"\n退步項目數: {regressions}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="overlay_text_on_image 效能與記憶體測試")
+    parser.add_argument("--quick", action="store_true", help="只跑最小 / 最大尺寸與最短 / 最長文案")
+    parser.add_argument("--rounds", type=int, default=ROUNDS, help="每個組合暖機後的執行次數")
+    parser.add_argument("--max-dimension", type=int, default=config.MAX_OUTPUT_DIMENSION,
+                        help="輸出最長邊（預設同 MAX_OUTPUT_DIMENSION，0 = 不縮圖）")
+    parser.add_argument("--output", default="", help="結果 JSON 路徑（預設 benchmarks/results/render-<commit>.json）")
+    parser.add_argument("--compare", default="", help="與先前的結果 JSON 比較")
+    args = parser.parse_args()
+
+    # 階段耗時由 timing.span 記錄；字型缺檔的警告每個組合都會出現，不顯示
+    config.SERVER_TIMING_ENABLED = True
+    logging.getLogger("image_utils").setLevel(logging.ERROR)
+
+    sizes = [SIZES[0], SIZES[-1]] if args.quick else SIZES
+    lengths = [LENGTHS[0], LENGTHS[-1]] if args.quick else LENGTHS
+    fonts = list(config.AVAILABLE_FONTS)
+
+    commit = _git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "max_dimension": args.max_dimension,
+        "rounds": args.rounds,
+        "cases": [],
+    }
+
+    print(f"{'組合':<28}{'輸出':>11}{'耗時':>8}{'首次':>8}  "
+          + "".join(f"{name:>10}" for name in STAGES + ["other"]) + f"{'RSS':>8}{'ΔRSS':>7}{'tmalloc':>9}")
+    for size in sizes:
+        image_bytes = synthetic_photo(size)
+        for length in lengths:
+            for font_key in fonts:
+                case = {"size": size, "length": length, "font": font_key,
+                        **measure(image_bytes, caption(length), font_key, args.max_dimension, args.rounds)}
+                result["cases"].append(case)
+                stages = case["stages_ms"]
+                print(f"{case_key(case):<28}{'x'.join(map(str, case['output_size'])):>11}"
+                      f"{case['wall_ms']:>8.1f}{case['cold_ms']:>8.1f}  "
+                      + "".join(f"{stages[name]:>10.1f}" for name in STAGES + ["other"])
+                      + f"{case['peak_rss_mb']:>8.0f}{case['rss_delta_mb']:>7.0f}{case['tracemalloc_peak_mb']:>9.2f}")
+
+    output_path = args.output or os.path.join(RESULTS_DIR, f"render-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {output_path}（耗時 ms、記憶體 MB）")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+URBAN 文案機器人 - 換行效能測試
+比較舊版逐字 getbbox 的 _wrap_text 與新版（字元寬度估計 + 二分搜尋），並確認斷行結果相同。
+
+執行方式:
+    python benchmarks/bench_wrap.py
+    BENCH_FONT=/path/to/NotoSansTC-Variable.ttf python benchmarks/bench_wrap.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import ImageFont  # noqa: E402
+
+import image_utils  # noqa: E402
+
+ROUNDS = 5
+SAMPLES = {
+    "short": "選擇權比努力更重要",
+    "design": "長期主義是一種選擇，自律讓你擁有更多選擇權。",
+    "mixed": "Compound interest 是世界第八大奇蹟 — 你今天存下的每一塊錢，都在替未來的自己工作。" * 3,
+    "long": ("自律不是限制，而是讓你在人生的每個路口都有得選。\n"
+             "資產累積靠的不是運氣，是每天一點點的堅持。" * 10),
+}
+
+
+def _legacy_wrap(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> list[str]:
+    """舊版：每加一個字就重新量測整行。"""
+    lines = []
+    for paragraph in text.split("\n"):
+        if not paragraph.strip():
+            lines.append("")
+            continue
+
+        current_line = ""
+        for char in paragraph:
+            test_line = current_line + char
+            bbox = font.getbbox(test_line)
+            line_width = bbox[2] - bbox[0]
+            if line_width <= max_width:
+                current_line = test_line
+            else:
+                if current_line:
+                    lines.append(current_line)
+                current_line = char
+        if current_line:
+            lines.append(current_line)
+
+    return lines
+
+
+def _best_of(fn, *args) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    font_path = os.getenv("BENCH_FONT")
+    print(f"{'sample':>7} | {'width':>5} | {'chars':>5} | {'lines':>5} | "
+          f"{'legacy':>9} | {'new':>9} | {'speedup':>7}")
+    print("-" * 68)
+    for img_width in (1080, 3024, 4032):
+        for name, text in SAMPLES.items():
+            font_size = image_utils._calc_dynamic_font_size(img_width, img_width, len(text))
+            if font_path:
+                font = ImageFont.truetype(font_path, font_size)
+            else:
+                font = image_utils._load_font(None, font_size)
+            max_width = img_width - 2 * int(img_width * 0.08)
+
+            expected = _legacy_wrap(text, font, max_width)
+            actual = image_utils._wrap_text(text, font, max_width)
+            assert actual == expected, f"{name}@{img_width} 斷行結果不同"
+
+            legacy = _best_of(_legacy_wrap, text, font, max_width)
+            current = _best_of(image_utils._wrap_text, text, font, max_width)
+            print(f"{name:>7} | {img_width:>5} | {len(text):>5} | {len(expected):>5} | "
+                  f"{legacy * 1000:>7.2f}ms | {current * 1000:>7.2f}ms | {legacy / current:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+URBAN 文案機器人 - overlay_text_on_image 輸出一致性檢查（不計時）
+以原始版本的排版流程（整張圖層 + 逐列 draw.line 遮罩 + 整張 GaussianBlur + 逐字 getbbox 斷行 +
+每行兩次 draw.text）作為參考實作，確認目前的 overlay_text_on_image 輸出（JPEG bytes）完全相同。
+涵蓋逐區塊合成、向量化遮罩、斷行、底部模糊範圍與文字繪製的改寫；解碼沿用 _open_at_target_size
+（大圖縮小解碼本身就會改變像素，不在比較範圍內）。
+
+任何一個組合不一致時以非 0 結束，可直接放進 CI。
+
+執行方式:
+    python benchmarks/check_render_parity.py
+    BENCH_FONT=/path/to/NotoSansTC-Variable.ttf python benchmarks/check_render_parity.py
+"""
+
+import io
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont  # noqa: E402
+
+import config  # noqa: E402
+import image_utils  # noqa: E402
+
+# (寬, 高)：直式 / 橫式 / 奇數尺寸 / 超過 MAX_OUTPUT_DIMENSION 需縮小解碼
+SIZES = [(1080, 1350), (1350, 1080), (1001, 777), (640, 480), (300, 200), (3024, 4032)]
+TEXTS = [
+    "短句",
+    "選擇權比努力更重要",
+    "選擇權比努力更重要 Choose wisely every day",
+    "長期主義是一種選擇，自律讓你擁有更多選擇權。" * 6,
+    "自律不是限制，而是讓你在人生的每個路口都有得選。\n\n資產累積靠的不是運氣，是每天一點點的堅持。",
+    "Compound interest is the eighth wonder of the world. " * 5,
+    "超長文字測試" * 60,
+]
+
+
+def _photo(width: int, height: int) -> bytes:
+    """色塊 + 雜訊的 JPEG（雜訊讓模糊範圍的邊界誤差容易被看出來）。"""
+    rng = random.Random(width * height)
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(30):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.ellipse((x, y, x + width // 6, y + height // 8),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    img = Image.blend(img, Image.effect_noise((width, height), 50).convert("RGB"), 0.2)
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+# ============================================================
+# 參考實作（原始版本的排版流程）
+# ============================================================
+
+def _reference_wrap(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> list[str]:
+    lines = []
+    for paragraph in text.split("\n"):
+        if not paragraph.strip():
+            lines.append("")
+            continue
+
+        current_line = ""
+        for char in paragraph:
+            test_line = current_line + char
+            bbox = font.getbbox(test_line)
+            if bbox[2] - bbox[0] <= max_width:
+                current_line = test_line
+            else:
+                if current_line:
+                    lines.append(current_line)
+                current_line = char
+        if current_line:
+            lines.append(current_line)
+    return lines
+
+
+def reference_render(img: Image.Image, text: str, font: ImageFont.FreeTypeFont,
+                     brand_font: ImageFont.FreeTypeFont, font_size: int) -> bytes:
+    img_width, img_height = img.size
+
+    # 步驟 1: 底部輕微模糊
+    blur_mask = Image.new("L", img.size, 0)
+    blur_draw = ImageDraw.Draw(blur_mask)
+    blur_start = int(img_height * 0.50)
+    for y in range(blur_start, img_height):
+        alpha = int(((y - blur_start) / (img_height - blur_start)) * 80)
+        blur_draw.line([(0, y), (img_width, y)], fill=alpha)
+    blurred = img.filter(ImageFilter.GaussianBlur(radius=max(3, img_width // 500)))
+    img = Image.composite(blurred, img, blur_mask)
+
+    # 步驟 2: 漸層遮罩
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    gradient_start = int(img_height * 0.30)
+    for y in range(gradient_start, img_height):
+        progress = (y - gradient_start) / (img_height - gradient_start)
+        draw.line([(0, y), (img_width, y)], fill=(8, 10, 25, int(progress * progress * progress * 220)))
+    img = Image.alpha_composite(img, overlay)
+
+    # 步驟 3: 排版
+    margin = int(img_width * 0.08)
+    wrapped_lines = _reference_wrap(text, font, img_width - 2 * margin)
+    line_height = int(font_size * 1.5)
+    total_text_height = line_height * len(wrapped_lines)
+    y_start = img_height - int(img_height * 0.07) - total_text_height
+
+    # 步驟 4: 左側金色裝飾線
+    accent_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    accent_draw = ImageDraw.Draw(accent_layer)
+    bar_width = max(5, img_width // 200)
+    line_x = margin - int(img_width * 0.035)
+    block_size = bar_width * 3
+    accent_draw.rectangle([(line_x, y_start), (line_x + bar_width, y_start + total_text_height)],
+                          fill=(215, 175, 85, 220))
+    accent_draw.rectangle([(line_x - bar_width, y_start - block_size - bar_width),
+                           (line_x + block_size, y_start - bar_width)], fill=(215, 175, 85, 220))
+    img = Image.alpha_composite(img, accent_layer)
+
+    # 步驟 5: 文字（陰影 + 描邊 + 主文字）
+    text_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    text_draw = ImageDraw.Draw(text_layer)
+    shadow_offset = max(3, font_size // 20)
+    stroke_width = max(2, font_size // 30)
+    y_cursor = y_start
+    for line in wrapped_lines:
+        if y_cursor + line_height > img_height - 20:
+            break
+        text_draw.text((margin + shadow_offset, y_cursor + shadow_offset), line, font=font, fill=(0, 0, 0, 100))
+        text_draw.text((margin, y_cursor), line, font=font, fill=(255, 255, 255, 255),
+                       stroke_width=stroke_width, stroke_fill=(0, 0, 0, 160))
+        y_cursor += line_height
+    img = Image.alpha_composite(img, text_layer)
+
+    # 步驟 6: 品牌標記
+    brand_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    brand_bbox = brand_font.getbbox("URBAN")
+    ImageDraw.Draw(brand_layer).text(
+        (img_width - margin - (brand_bbox[2] - brand_bbox[0]), img_height - int(img_height * 0.035)),
+        "URBAN", font=brand_font, fill=(215, 175, 85, 150),
+    )
+    img = Image.alpha_composite(img, brand_layer)
+
+    # 步驟 7: 右上角幾何裝飾線
+    deco_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    deco_draw = ImageDraw.Draw(deco_layer)
+    corner_margin = int(img_width * 0.05)
+    line_len = int(img_width * 0.12)
+    deco_line_width = max(2, img_width // 500)
+    corner_x = img_width - corner_margin
+    deco_draw.line([(corner_x, corner_margin), (corner_x, corner_margin + line_len)],
+                   fill=(215, 175, 85, 100), width=deco_line_width)
+    deco_draw.line([(corner_x, corner_margin), (corner_x - line_len, corner_margin)],
+                   fill=(215, 175, 85, 100), width=deco_line_width)
+    img = Image.alpha_composite(img, deco_layer)
+
+    output = io.BytesIO()
+    img.convert("RGB").save(output, format="JPEG", quality=95)
+    return output.getvalue()
+
+
+# ============================================================
+# 比較
+# ============================================================
+
+def _fonts(font_size: int) -> tuple[ImageFont.FreeTypeFont, ImageFont.FreeTypeFont]:
+    """(主文字字型, 品牌標記字型)；BENCH_FONT 未設定時與 overlay_text_on_image 相同由 _load_font 取得。"""
+    brand_size = max(font_size // 2, 28)
+    path = os.getenv("BENCH_FONT")
+    if path:
+        return ImageFont.truetype(path, font_size), ImageFont.truetype(path, brand_size)
+    return image_utils._load_font(None, font_size), image_utils._load_font(None, brand_size)
+
+
+def check(image_bytes: bytes, text: str, max_dimension: int) -> str | None:
+    """一致時回傳 None，否則回傳差異說明。"""
+    img = image_utils._open_at_target_size(image_bytes, max_dimension)
+    font_size = image_utils._calc_dynamic_font_size(img.width, img.height, len(text))
+    font, brand_font = _fonts(font_size)
+
+    original_load_font = image_utils._load_font
+    image_utils._load_font = lambda font_key, size: font if size == font_size else brand_font
+    try:
+        current = image_utils.overlay_text_on_image(image_bytes, text, max_dimension=max_dimension)
+    finally:
+        image_utils._load_font = original_load_font
+    expected = reference_render(img, text, font, brand_font, font_size)
+    if current == expected:
+        return None
+
+    current_img, expected_img = Image.open(io.BytesIO(current)), Image.open(io.BytesIO(expected))
+    if current_img.size != expected_img.size:
+        return f"尺寸不同 {current_img.size} != {expected_img.size}"
+    return f"像素差異範圍 {ImageChops.difference(current_img, expected_img).getextrema()}"
+
+
+def main():
+    logging.getLogger("image_utils").setLevel(logging.ERROR)
+    failures = 0
+    total = 0
+    for width, height in SIZES:
+        image_bytes = _photo(width, height)
+        for max_dimension in (config.MAX_OUTPUT_DIMENSION, 0):
+            if max_dimension == 0 and max(width, height) > config.MAX_OUTPUT_DIMENSION:
+                continue  # 不縮圖的 12MP 參考實作太慢，縮小解碼的組合已涵蓋大圖
+            for text in TEXTS:
+                total += 1
+                problem = check(image_bytes, text, max_dimension)
+                if problem:
+                    failures += 1
+                    print(f"不一致: {width}x{height} max_dimension={max_dimension} {len(text)}字 — {problem}")
+
+    if failures:
+        print(f"\n{failures} / {total} 個組合與參考實作不一致")
+        sys.exit(1)
+    print(f"{total} 個組合的輸出與參考實作完全相同")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+URBAN 文案機器人 - 本機 Gemini 替身（壓力測試用，不呼叫真正的 API、不花配額）
+FakeClient 提供與 genai.Client 相同的 models / aio.models 介面
+（generate_content、generate_content_stream），以環境變數模擬：
+- 延遲分布：文字與圖片模型分開設定，例如 lognormal:0.8:0.5（中位數 0.8s）、uniform:5:9、fixed:2
+- 503 過載：隨機比例，以及週期性的過載尖峰（以系統時間計算，多個 worker 同步進入尖峰）
+- 圖片大小：回傳指定 KB 數的 JPEG bytes
+- 格式錯誤的 JSON：截斷、多餘逗號、前後說明文字、非 JSON 等模型常見輸出
+請求帶的 HTTP 逾時比模擬延遲短時，等到逾時後拋出 httpx.ReadTimeout，與真正的 client 相同。
+
+使用方式:
+    import fake_gemini
+    fake_gemini.install()            # ai_service.client = FakeClient.from_env()
+
+環境變數（皆可省略）:
+    FAKE_GEMINI_TEXT_LATENCY=lognormal:0.8:0.5     文字模型延遲（秒）
+    FAKE_GEMINI_IMAGE_LATENCY=lognormal:6:0.4      圖片模型延遲（秒）
+    FAKE_GEMINI_ERROR_RATE=0                       任何時候回 503 的比例
+    FAKE_GEMINI_OVERLOAD=30:5:0.8                  每 30 秒有 5 秒尖峰，期間 80% 回 503
+    FAKE_GEMINI_IMAGE_KB=512                       回傳圖片大小
+    FAKE_GEMINI_MALFORMED_RATE=0.1                 JSON 輸出格式錯誤的比例
+    FAKE_GEMINI_STREAM_CHUNK=32                    串流時每個 chunk 的字元數
+    FAKE_GEMINI_SEED=                              固定亂數種子（重現同一組結果）
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+from google.genai import errors
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import ai_service  # noqa: E402
+
+
+# ============================================================
+# 延遲分布
+# ============================================================
+
+def parse_latency(spec: str):
+    """
+    "fixed:2" / "uniform:5:9" / "lognormal:0.8:0.5"（中位數, sigma）/
+    "bimodal:0.8:0.05:20"（一般延遲中位數, 長尾比例, 長尾秒數）→ 回傳 (rng) -> 秒數。
+    """
+    kind, *args = spec.split(":")
+    values = [float(arg) for arg in args]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    if kind == "bimodal":
+        median, tail_ratio, tail = values
+        return lambda rng: tail * rng.uniform(0.8, 1.2) if rng.random() < tail_ratio \
+            else median * rng.lognormvariate(0, 0.4)
+    raise ValueError(f"未知的延遲分布: {spec}")
+
+
+class Behaviour:
+    """替身的模擬參數；from_env() 讀取 FAKE_GEMINI_* 環境變數。"""
+
+    def __init__(self, text_latency: str = "lognormal:0.8:0.5", image_latency: str = "lognormal:6:0.4",
+                 error_rate: float = 0.0, overload: str = "", image_kb: int = 512,
+                 malformed_rate: float = 0.0, stream_chunk: int = 32, seed: int | None = None):
+        self.text_latency = parse_latency(text_latency)
+        self.image_latency = parse_latency(image_latency)
+        self.error_rate = error_rate
+        self.overload = tuple(float(value) for value in overload.split(":")) if overload else None
+        self.malformed_rate = malformed_rate
+        self.stream_chunk = stream_chunk
+        self.image_bytes = b"\xff\xd8\xff\xe0" + random.Random(seed).randbytes(max(image_kb * 1024 - 6, 0)) \
+            + b"\xff\xd9"
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Behaviour":
+        seed = os.getenv("FAKE_GEMINI_SEED")
+        return cls(
+            text_latency=os.getenv("FAKE_GEMINI_TEXT_LATENCY", "lognormal:0.8:0.5"),
+            image_latency=os.getenv("FAKE_GEMINI_IMAGE_LATENCY", "lognormal:6:0.4"),
+            error_rate=float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0")),
+            overload=os.getenv("FAKE_GEMINI_OVERLOAD", ""),
+            image_kb=int(os.getenv("FAKE_GEMINI_IMAGE_KB", "512")),
+            malformed_rate=float(os.getenv("FAKE_GEMINI_MALFORMED_RATE", "0")),
+            stream_chunk=int(os.getenv("FAKE_GEMINI_STREAM_CHUNK", "32")),
+            seed=int(seed) if seed else None,
+        )
+
+    def random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def latency(self, image: bool) -> float:
+        with self._lock:
+            return (self.image_latency if image else self.text_latency)(self._rng)
+
+    def overloaded(self) -> bool:
+        """隨機 503，或目前落在週期性過載尖峰內。"""
+        rate = self.error_rate
+        if self.overload is not None:
+            period, burst, burst_rate = self.overload
+            if time.time() % period < burst:
+                rate = max(rate, burst_rate)
+        return rate > 0 and self.random() < rate
+
+    def choose(self, options: list):
+        with self._lock:
+            return self._rng.choice(options)
+
+
+# ============================================================
+# 回應內容
+# ============================================================
+
+def _option(index: int) -> dict:
+    return {
+        "label": f"風格 {index + 1}",
+        "emoji": "✨",
+        "description": "壓力測試用文案",
+        "content": "今天的選擇，決定十年後的自由。\n你最近為自己做了什麼長期投資？" * 3,
+    }
+
+
+_JSON_OUTPUTS = {
+    "caption": {"options": [_option(index) for index in range(4)]},
+    "trending": {"options": [_option(index) for index in range(4)], "story_script": "開場 → 轉折 → 互動問句"},
+    "algorithm": {
+        "score": 72,
+        "sections": [{"label": label, "emoji": "📊", "content": "分析內容" * 20}
+                     for label in ("互動率", "停留時間", "分享潛力", "Hashtag 觸及")],
+        "optimized": "優化後的文案" * 10,
+    },
+}
+
+
+def _malformed(text: str, kind: str) -> str:
+    """模型常見的錯誤輸出（json_stream 能取回多少就取回多少）。"""
+    if kind == "truncated":
+        return text[: int(len(text) * 0.7)]
+    if kind == "trailing_comma":
+        return text.replace("}]", "},]", 1)
+    if kind == "prose":
+        return f"以下是為你準備的內容：\n```json\n{text}\n```\n希望對你有幫助！"
+    return "抱歉，我目前無法產生符合格式的內容。"
+
+
+_MALFORMED_KINDS = ["truncated", "trailing_comma", "prose", "not_json"]
+
+
+def _prompt_of(contents) -> str:
+    """取出 prompt 文字（字串，或 Content 的第一個文字 part）。"""
+    if isinstance(contents, str):
+        return contents
+    for content in contents:
+        for part in content.parts:
+            if part.text:
+                return part.text
+    return ""
+
+
+def _text_for(prompt: str, behaviour: Behaviour) -> str:
+    """依 prompt 判斷是哪個功能，回傳對應格式的模型輸出。"""
+    if prompt.startswith(ai_service.FONT_RECOMMEND_SYSTEM_PROMPT[:20]):
+        return behaviour.choose(list(ai_service.config.AVAILABLE_FONTS))
+    if prompt.startswith(ai_service.SHORT_CAPTION_PROMPT[:20]):
+        return "選擇權，來自每天的自律"
+    if prompt.startswith(ai_service.ALGORITHM_ANALYSIS_SYSTEM_PROMPT[:20]):
+        kind = "algorithm"
+    elif prompt.startswith(ai_service.TRENDING_CAPTION_SYSTEM_PROMPT[:20]):
+        kind = "trending"
+    else:
+        kind = "caption"
+    text = json.dumps(_JSON_OUTPUTS[kind], ensure_ascii=False, indent=2)
+    if behaviour.malformed_rate and behaviour.random() < behaviour.malformed_rate:
+        return _malformed(text, behaviour.choose(_MALFORMED_KINDS))
+    return f"```json\n{text}\n```"
+
+
+def _usage(prompt: str, output: str) -> SimpleNamespace:
+    return SimpleNamespace(prompt_token_count=len(prompt) // 2, candidates_token_count=len(output) // 2,
+                           cached_content_token_count=0, total_token_count=(len(prompt) + len(output)) // 2)
+
+
+def _text_response(text: str, usage=None) -> SimpleNamespace:
+    part = SimpleNamespace(text=text, inline_data=None)
+    return SimpleNamespace(text=text, usage_metadata=usage,
+                           candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+def _image_response(image_bytes: bytes, usage) -> SimpleNamespace:
+    parts = [SimpleNamespace(text=None, inline_data=SimpleNamespace(data=image_bytes, mime_type="image/jpeg")),
+             SimpleNamespace(text="壓力測試用圖片", inline_data=None)]
+    return SimpleNamespace(text="壓力測試用圖片", usage_metadata=usage,
+                           candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))])
+
+
+def _overload_error() -> errors.ServerError:
+    response = httpx.Response(503, json={"error": {
+        "code": 503, "message": "The model is overloaded. Please try again later.", "status": "UNAVAILABLE",
+    }})
+    return errors.ServerError(503, response)
+
+
+def _timeout_of(config) -> float | None:
+    http_options = getattr(config, "http_options", None)
+    if http_options is None or http_options.timeout is None:
+        return None
+    return http_options.timeout / 1000
+
+
+# ============================================================
+# 單次呼叫的模擬：決定延遲、錯誤與輸出
+# ============================================================
+
+class _Call:
+    def __init__(self, behaviour: Behaviour, contents, config):
+        self.image = bool(getattr(config, "response_modalities", None))
+        self.prompt = _prompt_of(contents)
+        self.latency = behaviour.latency(self.image)
+        self.timeout = _timeout_of(config)
+        self.overloaded = behaviour.overloaded()
+        self.behaviour = behaviour
+
+    def wait(self) -> float:
+        """送出到回應（或逾時）要等待的秒數；過載時很快回 503。"""
+        if self.overloaded:
+            return min(self.latency, 0.05)
+        return self.latency if self.timeout is None else min(self.latency, self.timeout)
+
+    def outcome(self):
+        if self.overloaded:
+            raise _overload_error()
+        if self.timeout is not None and self.latency > self.timeout:
+            raise httpx.ReadTimeout("fake gemini timeout")
+        if self.image:
+            return _image_response(self.behaviour.image_bytes, _usage(self.prompt, ""))
+        text = _text_for(self.prompt, self.behaviour)
+        return _text_response(text, _usage(self.prompt, text))
+
+    def chunks(self, text: str, usage) -> list:
+        size = self.behaviour.stream_chunk
+        pieces = [text[start:start + size] for start in range(0, len(text), size)] or [""]
+        responses = [_text_response(piece) for piece in pieces]
+        responses[-1].usage_metadata = usage
+        return responses
+
+
+class FakeModels:
+    def __init__(self, behaviour: Behaviour):
+        self.behaviour = behaviour
+
+    def generate_content(self, model, contents, config=None):
+        call = _Call(self.behaviour, contents, config)
+        time.sleep(call.wait())
+        return call.outcome()
+
+    def generate_content_stream(self, model, contents, config=None):
+        """第一個 chunk 約在總延遲的 30% 到達，其餘平均分散。"""
+        call = _Call(self.behaviour, contents, config)
+        first_wait = call.wait() * (1 if call.overloaded else 0.3)
+        time.sleep(first_wait)
+        response = call.outcome()
+        chunks = call.chunks(response.text, response.usage_metadata)
+        interval = (call.latency - first_wait) / len(chunks)
+
+        def stream():
+            for index, chunk in enumerate(chunks):
+                if index:
+                    time.sleep(interval)
+                yield chunk
+        return stream()
+
+
+class FakeAsyncModels:
+    def __init__(self, behaviour: Behaviour):
+        self.behaviour = behaviour
+
+    async def generate_content(self, model, contents, config=None):
+        call = _Call(self.behaviour, contents, config)
+        await asyncio.sleep(call.wait())
+        return call.outcome()
+
+    async def generate_content_stream(self, model, contents, config=None):
+        call = _Call(self.behaviour, contents, config)
+        first_wait = call.wait() * (1 if call.overloaded else 0.3)
+        await asyncio.sleep(first_wait)
+        response = call.outcome()
+        chunks = call.chunks(response.text, response.usage_metadata)
+        interval = (call.latency - first_wait) / len(chunks)
+
+        async def stream():
+            for index, chunk in enumerate(chunks):
+                if index:
+                    await asyncio.sleep(interval)
+                yield chunk
+        return stream()
+
+
+class FakeClient:
+    """genai.Client 的替身：client.models 與 client.aio.models。"""
+
+    def __init__(self, behaviour: Behaviour | None = None):
+        self.behaviour = behaviour or Behaviour()
+        self.models = FakeModels(self.behaviour)
+        self.aio = SimpleNamespace(models=FakeAsyncModels(self.behaviour))
+
+    @classmethod
+    def from_env(cls) -> "FakeClient":
+        return cls(Behaviour.from_env())
+
+
+def install(client: FakeClient | None = None) -> FakeClient:
+    """把 ai_service.client 換成替身（預設依環境變數設定）。"""
+    ai_service.client = client or FakeClient.from_env()
+    return ai_service.client
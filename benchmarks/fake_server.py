@@ -0,0 +1,23 @@
+"""
+URBAN 文案機器人 - 接上 Gemini 替身的服務入口（壓力測試用）
+每個 gunicorn worker 載入時把 ai_service.client 換成 fake_gemini.FakeClient（依 FAKE_GEMINI_* 環境變數）。
+
+執行方式（在專案根目錄）:
+    gunicorn --pythonpath benchmarks --workers 2 --threads 4 fake_server:app
+    gunicorn --pythonpath benchmarks --workers 2 --worker-class uvicorn.workers.UvicornWorker fake_server:asgi_app
+"""
+
+import importlib
+
+import fake_gemini
+
+fake_gemini.install()
+
+
+def __getattr__(name: str):
+    # 只載入實際要跑的那個 app（Flask 或 Quart）
+    if name == "app":
+        return importlib.import_module("app").app
+    if name == "asgi_app":
+        return importlib.import_module("asgi_app").app
+    raise AttributeError(name)
@@ -0,0 +1,312 @@
+"""
+URBAN 文案機器人 - 壓力測試（接上本機 Gemini 替身，不花配額）
+依序以不同的 gunicorn 設定（worker 類型 / worker 數 / thread 數）啟動 benchmarks/fake_server.py，
+以固定數量的客戶端執行緒（closed loop）輪流打所有 /api/v1/* 路由
+（含 multipart 圖片上傳、SSE / NDJSON 串流、背景任務 + long-poll、批次），
+每個設定輸出 requests/s、p50 / p95 / p99 延遲與錯誤率（503 另外列出，屬於 admission 的快速拒絕）。
+替身的延遲、503 尖峰、圖片大小、JSON 格式錯誤比例由 FAKE_GEMINI_* 環境變數設定（見 fake_gemini.py）。
+回應快取與圖片快取預設關閉，每個請求的文字都不同，量到的是完整的模型路徑。
+
+執行方式（在專案根目錄）:
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --configs gthread:2:4,gthread:4:8,uvicorn:2:1 --duration 60 --clients 64
+    FAKE_GEMINI_OVERLOAD=20:5:0.8 python benchmarks/load_test.py --configs gthread:2:4
+    python benchmarks/load_test.py --url http://localhost:8080   # 對已啟動的服務（不另外啟動 gunicorn）
+"""
+
+import argparse
+import itertools
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+WORKER_CLASSES = {
+    "gthread": ("gthread", "fake_server:app"),
+    "sync": ("sync", "fake_server:app"),
+    "uvicorn": ("uvicorn.workers.UvicornWorker", "fake_server:asgi_app"),
+}
+CLIENT_TIMEOUT = 120
+JOB_WAIT = 25
+
+# 上傳用的圖片（內容不會被解碼，只看大小）
+UPLOAD_IMAGE = b"\xff\xd8\xff\xe0" + random.Random(0).randbytes(200 * 1024) + b"\xff\xd9"
+LONG_TEXT = "每天存下一點點，十年後的自己會感謝你今天的選擇。自律不是限制，而是給未來更多選擇權。"
+
+_counter = itertools.count()
+
+
+class JobFailed(Exception):
+    """背景任務執行失敗（輪詢回 200，但 status 為 failed）。"""
+
+
+def _unique(text: str) -> str:
+    """每個請求的文字都不同，避免打到回應快取。"""
+    return f"{text} #{next(_counter)}"
+
+
+# ============================================================
+# 各路由的請求
+# ============================================================
+
+def _read_stream(response: requests.Response) -> requests.Response:
+    for _ in response.iter_lines():
+        pass
+    return response
+
+
+def caption_from_image(session, base):
+    return session.post(f"{base}/api/v1/caption-from-image", files={"image": ("photo.jpg", UPLOAD_IMAGE, "image/jpeg")},
+                        timeout=CLIENT_TIMEOUT)
+
+
+def caption_from_image_sse(session, base):
+    response = session.post(f"{base}/api/v1/caption-from-image", stream=True, timeout=CLIENT_TIMEOUT,
+                            files={"image": ("photo.jpg", UPLOAD_IMAGE, "image/jpeg")},
+                            headers={"Accept": "text/event-stream"})
+    return _read_stream(response)
+
+
+def generate_image(session, base):
+    return session.post(f"{base}/api/v1/generate-image", json={"concept": _unique("城市夜景")},
+                        timeout=CLIENT_TIMEOUT)
+
+
+def replace_background(session, base):
+    return session.post(f"{base}/api/v1/replace-background", data={"scene": _unique("海邊日落")},
+                        files={"image": ("photo.jpg", UPLOAD_IMAGE, "image/jpeg")}, timeout=CLIENT_TIMEOUT)
+
+
+def design(session, base):
+    return session.post(f"{base}/api/v1/design", data={"text": _unique(LONG_TEXT)},
+                        files={"image": ("photo.jpg", UPLOAD_IMAGE, "image/jpeg")},
+                        headers={"Accept": "image/*"}, timeout=CLIENT_TIMEOUT)
+
+
+def design_job(session, base):
+    """送出背景任務，再以 long-poll 等到完成；延遲為送出到拿到結果的總時間。"""
+    response = session.post(f"{base}/api/v1/design", data={"text": _unique(LONG_TEXT), "async": "true"},
+                            files={"image": ("photo.jpg", UPLOAD_IMAGE, "image/jpeg")}, timeout=CLIENT_TIMEOUT)
+    if response.status_code != 202:
+        return response
+    status_url = response.json()["status_url"]
+    while True:
+        response = session.get(f"{base}{status_url}", params={"wait": JOB_WAIT}, timeout=CLIENT_TIMEOUT)
+        if response.status_code != 200:
+            return response
+        status = response.json().get("status")
+        if status == "failed":
+            raise JobFailed(response.json().get("error"))
+        if status not in ("queued", "running"):
+            return response
+
+
+def trending(session, base):
+    return session.post(f"{base}/api/v1/trending", json={"topic": _unique("理財")}, timeout=CLIENT_TIMEOUT)
+
+
+def trending_ndjson(session, base):
+    response = session.post(f"{base}/api/v1/trending", json={"topic": _unique("理財")}, stream=True,
+                            headers={"Accept": "application/x-ndjson"}, timeout=CLIENT_TIMEOUT)
+    return _read_stream(response)
+
+
+def algorithm(session, base):
+    return session.post(f"{base}/api/v1/algorithm", json={"caption": _unique(LONG_TEXT)}, timeout=CLIENT_TIMEOUT)
+
+
+def recommend_font(session, base):
+    return session.post(f"{base}/api/v1/recommend-font", json={"text": _unique(LONG_TEXT)}, timeout=CLIENT_TIMEOUT)
+
+
+def batch(session, base):
+    items = [{"op": "algorithm", "caption": _unique(LONG_TEXT)} for _ in range(3)]
+    items.append({"op": "recommend-font", "text": _unique(LONG_TEXT)})
+    items.append({"op": "trending", "topic": _unique("理財")})
+    return session.post(f"{base}/api/v1/batch", json={"items": items}, timeout=CLIENT_TIMEOUT)
+
+
+def stats(session, base):
+    return session.get(f"{base}/api/v1/stats", timeout=CLIENT_TIMEOUT)
+
+
+# (名稱, 函式, 權重)：文字端點較常被呼叫，圖片端點較慢
+ROUTES = [
+    ("caption-from-image", caption_from_image, 3),
+    ("caption-from-image (sse)", caption_from_image_sse, 2),
+    ("generate-image", generate_image, 1),
+    ("replace-background", replace_background, 1),
+    ("design", design, 1),
+    ("design (job)", design_job, 1),
+    ("trending", trending, 3),
+    ("trending (ndjson)", trending_ndjson, 2),
+    ("algorithm", algorithm, 3),
+    ("recommend-font", recommend_font, 3),
+    ("batch", batch, 1),
+    ("stats", stats, 1),
+]
+
+
+# ============================================================
+# 負載產生與統計
+# ============================================================
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.shed: dict[str, int] = defaultdict(int)
+
+    def add(self, route: str, seconds: float, status: int | None):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if status == 503:
+                self.shed[route] += 1
+            elif status is None or status >= 400:
+                self.errors[route] += 1
+
+
+def percentile(values: list[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))] if ordered else 0.0
+
+
+def _client(base: str, routes: list, stop_at: float, results: Results, seed: int):
+    rng = random.Random(seed)
+    names, fns, weights = zip(*routes)
+    session = requests.Session()
+    while time.monotonic() < stop_at:
+        index = rng.choices(range(len(fns)), weights)[0]
+        started = time.perf_counter()
+        try:
+            status = fns[index](session, base).status_code
+        except (requests.RequestException, JobFailed):
+            status = None
+        results.add(names[index], time.perf_counter() - started, status)
+
+
+def run_load(base: str, routes: list, clients: int, duration: float) -> tuple[Results, float]:
+    results = Results()
+    started = time.monotonic()
+    threads = [threading.Thread(target=_client, args=(base, routes, started + duration, results, seed))
+               for seed in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def report(title: str, results: Results, elapsed: float):
+    print(f"\n=== {title} ===")
+    print(f"{'路由':<26}{'請求數':>7}{'req/s':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'錯誤率':>8}{'503':>7}")
+    rows = sorted(results.latencies.items())
+    everything = [seconds for _, latencies in rows for seconds in latencies]
+    for route, latencies in rows + [("全部", everything)]:
+        count = len(latencies)
+        errors = sum(results.errors.values()) if route == "全部" else results.errors[route]
+        shed = sum(results.shed.values()) if route == "全部" else results.shed[route]
+        print(f"{route:<26}{count:>7}{count / elapsed:>8.1f}"
+              f"{percentile(latencies, 0.5):>8.2f}{percentile(latencies, 0.95):>8.2f}{percentile(latencies, 0.99):>8.2f}"
+              f"{errors / max(count, 1):>8.1%}{shed / max(count, 1):>7.1%}")
+
+
+# ============================================================
+# gunicorn 啟動 / 關閉
+# ============================================================
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(worker_class: str, workers: int, threads: int, work_dir: str,
+                 show_logs: bool = False) -> tuple[subprocess.Popen, str]:
+    gunicorn_class, app_module = WORKER_CLASSES[worker_class]
+    port = _free_port()
+    env = {
+        **os.environ,
+        "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "load-test"),
+        "RESPONSE_CACHE_ENABLED": os.getenv("RESPONSE_CACHE_ENABLED", "false"),
+        "IMAGE_CACHE_DIR": os.getenv("IMAGE_CACHE_DIR", ""),
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(work_dir, "metrics"),
+        # 背景任務需在 worker 之間共用，否則 long-poll 打到其他 worker 會 404
+        "JOB_STORE": os.getenv("JOB_STORE", "sqlite"),
+        "JOB_STORE_PATH": os.getenv("JOB_STORE_PATH", os.path.join(work_dir, "jobs.sqlite3")),
+    }
+    command = [sys.executable, "-m", "gunicorn", "--pythonpath", "benchmarks", "--bind", f"127.0.0.1:{port}",
+               "--workers", str(workers), "--threads", str(threads), "--timeout", "120",
+               "--worker-class", gunicorn_class, "--log-level", "warning", app_module]
+    output = None if show_logs else subprocess.DEVNULL
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=output, stderr=output)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base, timeout=1).status_code == 200:
+                return server, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn 啟動逾時: {' '.join(command)}")
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def parse_configs(spec: str) -> list[tuple[str, int, int]]:
+    """"gthread:2:4,uvicorn:2:1" → [("gthread", 2, 4), ("uvicorn", 2, 1)]"""
+    configs = []
+    for item in spec.split(","):
+        worker_class, workers, threads = item.split(":")
+        if worker_class not in WORKER_CLASSES:
+            raise SystemExit(f"未知的 worker 類型: {worker_class}（可用：{', '.join(WORKER_CLASSES)}）")
+        configs.append((worker_class, int(workers), int(threads)))
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="URBAN 文案機器人壓力測試（Gemini 替身）")
+    parser.add_argument("--configs", default="gthread:2:4,gthread:4:8,uvicorn:2:1",
+                        help="worker類型:worker數:thread數，以逗號分隔（預設含 Dockerfile 的 gthread:2:4）")
+    parser.add_argument("--duration", type=float, default=30, help="每個設定的測試秒數")
+    parser.add_argument("--clients", type=int, default=32, help="同時發送請求的客戶端數")
+    parser.add_argument("--routes", default="", help="只測這些路由（以逗號分隔的名稱片段，例如 trending,algorithm）")
+    parser.add_argument("--url", default="", help="對已啟動的服務測試（不啟動 gunicorn）")
+    parser.add_argument("--server-logs", action="store_true", help="顯示 gunicorn 與服務的 log")
+    args = parser.parse_args()
+
+    routes = [route for route in ROUTES
+              if not args.routes or any(part in route[0] for part in args.routes.split(","))]
+    if args.url:
+        results, elapsed = run_load(args.url.rstrip("/"), routes, args.clients, args.duration)
+        report(args.url, results, elapsed)
+        return
+
+    for worker_class, workers, threads in parse_configs(args.configs):
+        with tempfile.TemporaryDirectory() as work_dir:
+            server, base = start_server(worker_class, workers, threads, work_dir, args.server_logs)
+            try:
+                results, elapsed = run_load(base, routes, args.clients, args.duration)
+            finally:
+                stop_server(server)
+        report(f"{worker_class} workers={workers} threads={threads} clients={args.clients}", results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+URBAN 文案機器人 - 圖片生成 hedging 模擬
+以假的 Gemini client 模擬主要圖片模型的長尾延遲，比較關閉 / 開啟 hedging 時
+generate_image 的 p50 / p95 / p99 延遲、hedge 比例與 hedge 勝出率（sync 與 async 兩種模式）。
+模型順序固定（只看 hedging 的效果，不讓 routing 依平均延遲換主模型）。不會呼叫真正的 API。
+
+執行方式:
+    python benchmarks/sim_hedging.py
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GEMINI_API_KEY", "simulation")
+os.environ["IMAGE_CACHE_DIR"] = ""
+
+import ai_service  # noqa: E402
+import config  # noqa: E402
+import hedge  # noqa: E402
+import retry  # noqa: E402
+import routing  # noqa: E402
+
+REQUESTS = 400
+CONCURRENCY = 8
+TIME_SCALE = 0.001  # 模擬的 1 秒 = 實際 1 ms
+
+
+def _latency(model: str) -> float:
+    """主模型 8% 的請求落在 40~60s 的長尾；備用模型穩定但較慢。"""
+    if model == ai_service.IMAGE_MODELS[0]:
+        return random.uniform(40, 60) if random.random() < 0.08 else random.uniform(8, 12)
+    return random.uniform(14, 18)
+
+
+def _response(model: str):
+    part = SimpleNamespace(inline_data=SimpleNamespace(data=model.encode()), text=None)
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+class FixedOrder(routing.HealthTracker):
+    """維持設定順序，仍記錄延遲樣本供 hedge_delay 使用。"""
+
+    def order(self, models):
+        return list(models)
+
+
+class FakeModels:
+    def generate_content(self, model, contents, config):
+        time.sleep(_latency(model) * TIME_SCALE)
+        return _response(model)
+
+
+class FakeAsyncModels:
+    async def generate_content(self, model, contents, config):
+        await asyncio.sleep(_latency(model) * TIME_SCALE)
+        return _response(model)
+
+
+def _percentiles(samples: list[float]) -> str:
+    samples = sorted(s / TIME_SCALE for s in samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]  # noqa: E731
+    return f"p50 {pick(0.5):5.1f}s  p95 {pick(0.95):5.1f}s  p99 {pick(0.99):5.1f}s"
+
+
+def _timed_sync(_) -> float:
+    start = time.perf_counter()
+    ai_service.generate_image("城市夜景")
+    return time.perf_counter() - start
+
+
+async def _timed_async() -> float:
+    start = time.perf_counter()
+    await ai_service.generate_image_async("城市夜景")
+    return time.perf_counter() - start
+
+
+async def _run_async() -> list[float]:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with semaphore:
+            return await _timed_async()
+
+    return await asyncio.gather(*(one() for _ in range(REQUESTS)))
+
+
+def _report(label: str, samples: list[float]) -> None:
+    stats = hedge.budget.snapshot()
+    print(f"  {label:<14} {_percentiles(samples)}  hedge {stats['hedged']}/{stats['requests']}"
+          f"  勝出率 {stats['hedge_win_rate']}")
+
+
+def main():
+    random.seed(11)
+    config.HEDGE_DEFAULT_DELAY *= TIME_SCALE
+    config.HEDGE_MIN_SAMPLES = 10
+    for module in (ai_service, retry, routing, hedge):
+        module.logger.disabled = True
+    ai_service.client = SimpleNamespace(models=FakeModels(), aio=SimpleNamespace(models=FakeAsyncModels()))
+
+    for enabled in (False, True):
+        config.HEDGE_ENABLED = enabled
+        print(f"\n[hedging {'開啟' if enabled else '關閉'}]")
+
+        routing.health = FixedOrder()
+        hedge.budget = hedge.HedgeBudget(config.HEDGE_MAX_RATE, config.HEDGE_BURST)
+        with ThreadPoolExecutor(CONCURRENCY) as pool:
+            samples = list(pool.map(_timed_sync, range(REQUESTS)))
+        _report("sync (WSGI)", samples)
+
+        routing.health = FixedOrder()
+        hedge.budget = hedge.HedgeBudget(config.HEDGE_MAX_RATE, config.HEDGE_BURST)
+        _report("async (ASGI)", asyncio.run(_run_async()))
+
+
+if __name__ == "__main__":
+    main()
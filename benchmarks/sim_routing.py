@@ -0,0 +1,109 @@
+"""
+URBAN 文案機器人 - 模型路由模擬
+以假的 Gemini client 模擬主要圖片模型過載（503）再恢復，比較固定順序與自適應路由：
+每個請求的平均耗時、嘗試次數，以及各模型實際服務的比例。不會呼叫真正的 API。
+
+執行方式:
+    python benchmarks/sim_routing.py
+"""
+
+import os
+import random
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GEMINI_API_KEY", "simulation")
+os.environ["IMAGE_CACHE_DIR"] = ""
+
+import httpx  # noqa: E402
+from google.genai import errors  # noqa: E402
+
+import ai_service  # noqa: E402
+import config  # noqa: E402
+import retry  # noqa: E402
+import routing  # noqa: E402
+
+REQUESTS_PER_PHASE = 150
+TIME_SCALE = 0.001  # 模擬的 1 秒 = 實際 1 ms
+
+# 各階段的模型狀況：模型 -> (延遲秒數, 503 機率)
+PHASES = {
+    "主要模型過載": {
+        ai_service.IMAGE_MODELS[0]: (12.0, 0.9),
+        ai_service.IMAGE_MODELS[1]: (18.0, 0.05),
+    },
+    "主要模型恢復": {
+        ai_service.IMAGE_MODELS[0]: (12.0, 0.0),
+        ai_service.IMAGE_MODELS[1]: (18.0, 0.05),
+    },
+}
+
+
+class FakeModels:
+    """依 profile 模擬延遲與 503 的 client.models。"""
+
+    def __init__(self):
+        self.profile = {}
+        self.calls = 0
+
+    def generate_content(self, model, contents, config):
+        self.calls += 1
+        latency, overload_rate = self.profile[model]
+        time.sleep(latency * TIME_SCALE)
+        if random.random() < overload_rate:
+            raise errors.APIError(503, httpx.Response(503, json={"error": {"status": "UNAVAILABLE"}}))
+        part = SimpleNamespace(inline_data=SimpleNamespace(data=model.encode()), text=None)
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+class FixedOrder(routing.HealthTracker):
+    """舊版行為：固定順序、不斷路。"""
+
+    def order(self, models):
+        return list(models)
+
+    def is_open(self, model):
+        return False
+
+
+def _run(label: str, tracker: routing.HealthTracker) -> None:
+    routing.health = tracker
+    fake = FakeModels()
+    ai_service.client = SimpleNamespace(models=fake)
+    print(f"\n[{label}]")
+    for phase, profile in PHASES.items():
+        fake.profile = profile
+        fake.calls = 0
+        served = Counter()
+        failures = 0
+        start = time.perf_counter()
+        for _ in range(REQUESTS_PER_PHASE):
+            try:
+                image_bytes, _ = ai_service.generate_image("城市夜景")
+                served[image_bytes.decode()] += 1
+            except ValueError:
+                failures += 1
+        elapsed = (time.perf_counter() - start) / TIME_SCALE / REQUESTS_PER_PHASE
+        shares = ", ".join(f"{model} {count / REQUESTS_PER_PHASE:.0%}" for model, count in served.most_common())
+        print(f"  {phase}: 平均 {elapsed:5.1f}s/請求, 嘗試 {fake.calls / REQUESTS_PER_PHASE:.2f} 次/請求, "
+              f"失敗 {failures}, 服務比例: {shares}")
+
+
+def main():
+    random.seed(7)
+    # 退避與冷卻時間依 TIME_SCALE 縮小
+    config.RETRY_BASE_DELAY *= TIME_SCALE
+    config.RETRY_MAX_DELAY *= TIME_SCALE
+    retry.logger.disabled = True
+    routing.logger.disabled = True
+    ai_service.logger.disabled = True
+
+    _run("固定順序", FixedOrder())
+    _run("自適應路由", routing.HealthTracker(cooldown=config.CIRCUIT_COOLDOWN_SECONDS * TIME_SCALE))
+
+
+if __name__ == "__main__":
+    main()
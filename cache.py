@@ -0,0 +1,284 @@
+"""
+URBAN 文案機器人 - 快取層
+- 文字端點的回應快取：以 (函式, 模型, 正規化輸入, prompt 版本) 為 key，
+  每個端點各自的 TTL，記憶體 LRU + 選用的 SQLite 共用層（讓多個 gunicorn worker 共用結果）。
+- 圖片轉換的內容定址快取：以原圖 SHA-256 為 key，結果存在本機磁碟，依總大小淘汰。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_version(prompt: str) -> str:
+    """prompt 內容的短雜湊；修改 prompt 後舊的快取自然失效。"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def normalize_text(text: str) -> str:
+    """正規化使用者輸入：NFC、統一換行、去除每行尾端與前後空白。"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+
+def make_key(namespace: str, model: str, version: str, *inputs) -> str:
+    """組合快取 key（字串輸入會先正規化）。"""
+    normalized = [normalize_text(value) if isinstance(value, str) else value for value in inputs]
+    raw = json.dumps([namespace, model, version, normalized], ensure_ascii=False)
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+class MemoryLRU:
+    """有筆數上限、每筆各自到期時間的 LRU。值一律存成 JSON 字串，避免呼叫端改到快取內容。"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteTier:
+    """多個 worker 共用的 SQLite 快取層；每個執行緒各自一條連線。"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, stored_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> tuple[str, float] | None:
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self._writes += 1
+            # 每 100 次寫入清一次過期資料並裁到上限
+            if self._writes % 100 == 0:
+                conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                conn.execute(
+                    "DELETE FROM responses WHERE key NOT IN ("
+                    " SELECT key FROM responses ORDER BY stored_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+
+
+class ResponseCache:
+    """記憶體 LRU（+ 選用 SQLite 共用層）的回應快取，附命中統計。"""
+
+    def __init__(self, max_entries: int, disk_path: str | None = None, disk_max_entries: int = 20000):
+        self.memory = MemoryLRU(max_entries)
+        self.disk = SQLiteTier(disk_path, disk_max_entries) if disk_path else None
+        self._stats: dict[str, dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, namespace: str, field: str) -> None:
+        with self._stats_lock:
+            counters = self._stats.setdefault(
+                namespace, {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0}
+            )
+            counters[field] += 1
+            if field.endswith("_hits"):
+                counters["hits"] += 1
+
+    def get(self, key: str):
+        """命中時回傳解碼後的值，否則回傳 None。"""
+        namespace = key.split(":", 1)[0]
+        value = self.memory.get(key)
+        if value is not None:
+            self._count(namespace, "memory_hits")
+            return json.loads(value)
+
+        if self.disk is not None:
+            try:
+                entry = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning("快取共用層讀取失敗: %s", e)
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                self.memory.set(key, value, expires_at)
+                self._count(namespace, "disk_hits")
+                return json.loads(value)
+
+        self._count(namespace, "misses")
+        return None
+
+    def set(self, key: str, value, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        encoded = json.dumps(value, ensure_ascii=False)
+        expires_at = time.time() + ttl
+        self.memory.set(key, encoded, expires_at)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, encoded, expires_at)
+            except sqlite3.Error as e:
+                logger.warning("快取共用層寫入失敗: %s", e)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            per_namespace = {name: dict(counters) for name, counters in self._stats.items()}
+        return {
+            "memory_entries": len(self.memory),
+            "disk_enabled": self.disk is not None,
+            "namespaces": per_namespace,
+        }
+
+
+class ImageResultCache:
+    """
+    圖片轉換結果的內容定址快取（本機磁碟）。
+    key 由呼叫端以原圖 bytes 的 SHA-256 + 場景/文字 + 模型 + prompt 版本組成；
+    每筆存成 <key>.bin（結果圖片）與 <key>.json（描述），超過 max_bytes 時刪除最久未使用的項目。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total_bytes = self._scan_total()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(namespace: str, models: list[str], version: str, image_bytes: bytes, *inputs) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        raw = json.dumps([namespace, models, version, digest, *inputs], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, key)
+        return f"{base}.bin", f"{base}.json"
+
+    def _scan_total(self) -> int:
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                total += entry.stat().st_size
+        return total
+
+    def get(self, key: str) -> tuple[bytes, str] | None:
+        bin_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                description = json.load(f)["description"]
+            with open(bin_path, "rb") as f:
+                image_bytes = f.read()
+            os.utime(bin_path)  # 以 mtime 記錄最近使用時間，供 LRU 淘汰
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return image_bytes, description
+
+    def put(self, key: str, image_bytes: bytes, description: str) -> None:
+        bin_path, meta_path = self._paths(key)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # 先寫圖片再寫描述：讀取端以描述檔存在與否判斷項目完整
+            with open(bin_path + suffix, "wb") as f:
+                f.write(image_bytes)
+            with self._lock:
+                # 同一個 key 可能已由其他請求寫入（同時 miss）：覆蓋時扣掉舊檔大小，總量不重複計算
+                try:
+                    replaced_bytes = os.stat(bin_path).st_size
+                except OSError:
+                    replaced_bytes = 0
+                os.replace(bin_path + suffix, bin_path)
+                self._total_bytes += len(image_bytes) - replaced_bytes
+            with open(meta_path + suffix, "w", encoding="utf-8") as f:
+                json.dump({"description": description, "stored_at": time.time()}, f, ensure_ascii=False)
+            os.replace(meta_path + suffix, meta_path)
+        except OSError as e:
+            logger.warning("圖片結果快取寫入失敗: %s", e)
+            return
+
+        with self._lock:
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """刪除最久未使用的項目，直到總量降到上限的 90%（其他 worker 也會寫入，先重新掃描）。"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.name[:-len(".bin")]))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, key in entries:
+            if total <= target:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+
+        self._total_bytes = total
+        logger.info("圖片結果快取淘汰 %d 筆，目前 %.1f MB", removed, total / 1024 / 1024)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes}
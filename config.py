@@ -12,12 +12,103 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 GEMINI_IMAGE_MODEL = os.getenv("GEMINI_IMAGE_MODEL", "gemini-2.5-flash-image")
 
+# --- Gemini 呼叫重試（指數退避 + jitter）---
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))     # 每個模型最多嘗試次數
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))     # 第一次重試的等待上限 (秒)
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8.0"))       # 單次等待上限 (秒)
+RETRY_MIN_ATTEMPT_SECONDS = 2.0                                     # 剩餘時間不足此值就不再嘗試
+
+# --- 准入控制：每個 worker 對每個模型的同時呼叫數上限與等待佇列 ---
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "8"))   # 每個模型的同時呼叫數
+ADMISSION_QUEUE_LIMIT = int(os.getenv("ADMISSION_QUEUE_LIMIT", "16"))          # 每個模型的等待佇列上限
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))              # 最多排隊秒數
+ADMISSION_RETRY_AFTER = 5                                                      # 沒有延遲樣本時的 Retry-After 秒數
+ADMISSION_MODEL_LIMITS = {                                                     # 個別模型的上限，例如 "gemini-2.5-flash-image=4"
+    name.strip(): int(limit)
+    for name, limit in (
+        item.split("=", 1) for item in os.getenv("ADMISSION_MODEL_LIMITS", "").split(",") if item.strip()
+    )
+}
+
+# --- 模型自適應路由與斷路器 ---
+ROUTING_EWMA_ALPHA = float(os.getenv("ROUTING_EWMA_ALPHA", "0.3"))                # 延遲 / 錯誤率 EWMA 權重
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))       # 連續失敗幾次就斷路
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))                 # 錯誤率 EWMA 超過就斷路
+CIRCUIT_MIN_SAMPLES = int(os.getenv("CIRCUIT_MIN_SAMPLES", "10"))                 # 錯誤率需累積的最少樣本數
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", "30"))      # 斷路後多久開始試探
+CIRCUIT_PROBE_SHARE = float(os.getenv("CIRCUIT_PROBE_SHARE", "0.1"))               # 試探流量比例
+ROUTING_EXPLORE_SHARE = float(os.getenv("ROUTING_EXPLORE_SHARE", "0.05"))         # 隨機探索其他健康模型的流量比例
+ROUTING_LATENCY_SAMPLES = 200                                                      # 每個模型保留的延遲樣本數
+
+# --- 圖片生成 hedging（主模型太慢時同時送給下一個模型，取先回來的結果）---
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))          # 超過主模型延遲的此百分位數才 hedge
+HEDGE_MIN_SAMPLES = 20                                                  # 延遲樣本不足時改用 HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "20"))     # 秒
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))              # hedge 請求佔比上限
+HEDGE_BURST = 3                                                         # 預算最多累積幾次 hedge
+
+# --- 請求時間預算 (deadline)：客戶端可用 X-Request-Timeout 標頭（秒）指定 ---
+REQUEST_DEADLINE_MAX = float(os.getenv("REQUEST_DEADLINE_MAX", "110"))  # 上限（低於 gunicorn 120s 逾時）
+REQUEST_DEADLINES = {                                                   # 各端點預設（低於 iOS 90s 逾時）
+    "caption-from-image": 45,
+    "generate-image": 85,
+    "replace-background": 85,
+    "design": 85,
+    "trending": 45,
+    "algorithm": 45,
+    "recommend-font": 20,
+    "batch": 85,                                                        # 整個批次（各項目另受上面的預算限制）
+}
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "300"))  # 背景任務沒有客戶端在等，預算較寬
+
+# --- 請求階段計時：Server-Timing 標頭與每個請求一行的 JSON log ---
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"  # 回應加上 Server-Timing 標頭（含模型名稱與重試結果，只在除錯時開啟）
+SERVER_TIMING_LOG = os.getenv("SERVER_TIMING_LOG", "false").lower() == "true"          # 每個請求輸出一行 JSON log
+
+# --- 批次端點 (/api/v1/batch) ---
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))       # 每個批次最多項目數
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))    # 每個批次同時執行的項目數
+
+# --- 非同步任務 (Job) ---
+JOB_STORE = os.getenv("JOB_STORE", "memory")                  # memory / file / sqlite
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH")                  # file: 目錄；sqlite: 資料庫檔
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))              # 背景執行緒數
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "32"))     # 排隊 + 執行中上限
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "600"))    # 結果保留時間
+JOB_MAX_WAIT_SECONDS = 25                                     # long-poll 最長等待（低於 iOS 90s 逾時）
+JOB_POLL_INTERVAL = 0.5                                       # long-poll 檢查間隔
+
+# --- 文字端點回應快取 ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))   # 記憶體 LRU 筆數上限
+RESPONSE_CACHE_DISK_PATH = os.getenv("RESPONSE_CACHE_DISK_PATH")                    # 設定後啟用 SQLite 共用層
+RESPONSE_CACHE_DISK_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_DISK_MAX_ENTRIES", "20000"))
+RESPONSE_CACHE_TTLS = {                                                             # 各端點 TTL (秒)，0 = 不快取
+    "recommend_font": int(os.getenv("CACHE_TTL_RECOMMEND_FONT", "86400")),
+    "analyze_algorithm_score": int(os.getenv("CACHE_TTL_ALGORITHM", "3600")),
+    "generate_short_caption": int(os.getenv("CACHE_TTL_SHORT_CAPTION", "3600")),
+}
+
+# --- 圖片轉換結果快取（背景替換、AI 排版；以原圖內容為 key）---
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "/tmp/urban_image_cache")           # 設為空字串停用
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
 # --- 圖片處理預設 ---
 OVERLAY_OPACITY = 180          # 半透明遮罩 (0-255)
 OVERLAY_HEIGHT_RATIO = 0.35    # 遮罩佔圖片高度比例
 TEXT_PADDING = 40              # 文字邊距 (px)
 FONT_SIZE = 42                 # 預設字體大小
 OUTPUT_QUALITY = 92            # JPEG 壓縮品質
+MAX_OUTPUT_DIMENSION = int(os.getenv("MAX_OUTPUT_DIMENSION", "2160"))  # 輸出最長邊 (px)，0 = 不縮圖
+MASK_CACHE_SIZE = int(os.getenv("MASK_CACHE_SIZE", "4"))  # 模糊/漸層遮罩快取的解析度數量
+
+# --- /api/v1/design 排版引擎：ai（Gemini 圖片模型）/ local（image_utils 本機排版）/ auto ---
+DESIGN_RENDER_MODE = os.getenv("DESIGN_RENDER_MODE", "ai")                    # 請求未指定 render 時的預設
+DESIGN_AUTO_MIN_BUDGET = float(os.getenv("DESIGN_AUTO_MIN_BUDGET", "25"))     # auto：沒有延遲樣本時，剩餘預算低於此秒數改用本機排版
+DESIGN_AUTO_PERCENTILE = 0.9                                                  # auto：以設計模型的 p90 延遲判斷預算是否足夠
+DESIGN_AUTO_MIN_SAMPLES = 5                                                   # 延遲樣本不足時改用 DESIGN_AUTO_MIN_BUDGET
+DESIGN_LOCAL_FONT = os.getenv("DESIGN_LOCAL_FONT", "noto_sans")               # 本機排版未指定 font_key 時的字型
 
 # --- 中文字型設定 ---
 FONTS_DIR = os.path.join(os.path.dirname(__file__), "fonts")
@@ -37,6 +128,15 @@ AVAILABLE_FONTS = {
     },
 }
 
+FONT_CACHE_SIZE = int(os.getenv("FONT_CACHE_SIZE", "128"))         # (字型, 大小) 快取上限
+FONT_PRELOAD = os.getenv("FONT_PRELOAD", "false").lower() == "true"  # worker 啟動時預載常用大小
+FONT_PRELOAD_SOURCE_SIZES = [(1080, 1350), (1080, 1080), (3024, 4032), (4032, 3024)]  # 常見原圖（IG / iPhone 直式、橫式）
+FONT_PRELOAD_WIDTHS = sorted({                                     # 預載時參考的圖片寬度：原圖縮到 MAX_OUTPUT_DIMENSION 後的實際排版寬度
+    round(width * MAX_OUTPUT_DIMENSION / max(width, height))
+    if MAX_OUTPUT_DIMENSION and max(width, height) > MAX_OUTPUT_DIMENSION else width
+    for width, height in FONT_PRELOAD_SOURCE_SIZES
+})
+
 # 系統備用字型
 SYSTEM_FONT_FALLBACKS = [
     "/System/Library/Fonts/PingFang.ttc",                        # macOS
@@ -0,0 +1,34 @@
+"""
+URBAN 文案機器人 - gunicorn 設定（gunicorn 會自動載入工作目錄下的 gunicorn.conf.py）
+設定 PROMETHEUS_MULTIPROC_DIR 時，各 worker 的指標寫入該目錄，由 /metrics 彙總。
+多 worker 搭配 memory 任務儲存時於啟動時警告。
+"""
+
+import os
+import shutil
+
+
+def on_starting(server):
+    """
+    啟動時清空指標目錄，避免沿用上次執行留下的數值。
+    多個 worker 卻使用 memory 任務儲存時發出警告：任務只存在接受它的 worker，其他 worker 查詢會 404。
+    """
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+    import config
+    if server.cfg.workers > 1 and config.JOB_STORE.lower() == "memory":
+        server.log.warning(
+            "JOB_STORE=memory 但有 %d 個 worker：背景任務不會在 worker 之間共享，"
+            "約 %d%% 的 /api/v1/jobs 查詢會找不到任務；請設定 JOB_STORE=sqlite 或 file",
+            server.cfg.workers, 100 - 100 // server.cfg.workers,
+        )
+
+
+def child_exit(server, worker):
+    """worker 結束時移除它的 gauge（處理中請求數），counter / histogram 保留累計值。"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,144 @@
+"""
+URBAN 文案機器人 - 圖片生成 hedging
+圖片模型延遲的長尾很長：主模型超過「自己最近延遲的 HEDGE_PERCENTILE 百分位數」仍未回應時，
+把同一個請求送給下一個模型，取先成功的結果（預設關閉，HEDGE_ENABLED=true 開啟）。
+hedge 佔請求的比例以 token bucket 限制在 HEDGE_MAX_RATE 以內，並統計 hedge 勝出的次數。
+
+兩種模式都以 asyncio 進行 hedging，輸掉的 task 直接取消（連帶釋放准入名額）。WSGI 模式下
+同步 client 的 HTTP 呼叫無法中斷，因此需要 hedge 的請求改在請求執行緒自己的 event loop 上
+跑 async client，主模型仍在請求執行緒上執行，不另佔執行緒池。
+"""
+
+import asyncio
+import logging
+import threading
+
+import admission
+import config
+import retry
+import routing
+
+logger = logging.getLogger(__name__)
+
+
+class HedgeBudget:
+    """
+    token bucket：每個可 hedge 的請求累積 max_rate 個 token（最多 burst 個），
+    送出一次 hedge 消耗 1 個，長期下來 hedge 比例不超過 max_rate。
+    """
+
+    def __init__(self, max_rate: float, burst: float):
+        self.max_rate = max_rate
+        self.burst = burst
+        self._tokens = 1.0
+        self._counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0, "budget_denied": 0}
+        self._lock = threading.Lock()
+
+    def on_request(self) -> None:
+        with self._lock:
+            self._counters["requests"] += 1
+            self._tokens = min(self.burst, self._tokens + self.max_rate)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                self._counters["budget_denied"] += 1
+                return False
+            self._tokens -= 1
+            self._counters["hedged"] += 1
+            return True
+
+    def count(self, field: str) -> None:
+        with self._lock:
+            self._counters[field] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        counters["enabled"] = config.HEDGE_ENABLED
+        counters["hedge_win_rate"] = round(counters["hedge_wins"] / counters["hedged"], 3) if counters["hedged"] else None
+        return counters
+
+
+budget = HedgeBudget(config.HEDGE_MAX_RATE, config.HEDGE_BURST)
+
+
+def hedge_delay(model: str) -> float:
+    """主模型等多久沒回應就 hedge：最近成功延遲的百分位數，樣本不足時用預設值。"""
+    observed = routing.health.latency_percentile(model, config.HEDGE_PERCENTILE, config.HEDGE_MIN_SAMPLES)
+    return observed if observed is not None else config.HEDGE_DEFAULT_DELAY
+
+
+def _should_stop(error: Exception) -> bool:
+    """失敗原因換模型也無濟於事（參數錯誤、時間預算用完），直接拋出；模型忙碌則可以換模型。"""
+    if isinstance(error, admission.Overloaded):
+        return False
+    return isinstance(error, retry.DeadlineExceeded) or retry.classify(error) == retry.FATAL
+
+
+def _raise_failure(errors: list[Exception], exhausted_message: str):
+    for error in errors:
+        if _should_stop(error):
+            raise error
+    if all(isinstance(error, admission.Overloaded) for error in errors):
+        raise errors[-1]
+    logger.error("hedging: 所有模型都失敗")
+    raise ValueError(exhausted_message) from errors[-1]
+
+
+# ============================================================
+# WSGI（執行緒）版本
+# ============================================================
+
+def call(operation: str, models: list[str], attempt_fn, attempt_fn_async, *, exhausted_message: str):
+    """
+    與 retry.call 相同的介面（另需 attempt_fn 的 async 版本）：models[0] 為主模型，其餘為 hedge / 備用模型。
+    未啟用 hedging 或只有一個模型時等同 retry.call；否則在請求執行緒上以 asyncio.run 執行 call_async
+    （contextvars 隨之帶入，沿用請求的時間預算）。
+    """
+    if not config.HEDGE_ENABLED or len(models) < 2:
+        return retry.call(operation, models, attempt_fn, exhausted_message=exhausted_message)
+    return asyncio.run(call_async(operation, models, attempt_fn_async, exhausted_message=exhausted_message))
+
+
+# ============================================================
+# ASGI（asyncio）版本
+# ============================================================
+
+async def call_async(operation: str, models: list[str], attempt_fn, *, exhausted_message: str):
+    """call 的 async 版本；輸掉（或請求被取消時仍在跑）的 task 會被取消。"""
+    if not config.HEDGE_ENABLED or len(models) < 2:
+        return await retry.call_async(operation, models, attempt_fn, exhausted_message=exhausted_message)
+
+    budget.on_request()
+    primary_model, fallbacks = models[0], models[1:]
+    delay = hedge_delay(primary_model)
+    primary = asyncio.ensure_future(retry.call_async(operation, [primary_model], attempt_fn))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and budget.try_spend():
+            logger.info("%s: 模型 %s 超過 %.1fs 未回應，同時送給 %s", operation, primary_model, delay, fallbacks[0])
+            backup = asyncio.ensure_future(retry.call_async(operation, fallbacks, attempt_fn))
+            tasks.append(backup)
+            roles = {primary: "primary_wins", backup: "hedge_wins"}
+            pending, errors = set(tasks), []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        budget.count(roles[task])
+                        return task.result()
+                    errors.append(task.exception())
+            _raise_failure(errors, exhausted_message)
+
+        try:
+            return await primary
+        except Exception as e:
+            if _should_stop(e):
+                raise
+            return await retry.call_async(operation, fallbacks, attempt_fn, exhausted_message=exhausted_message)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -4,41 +4,88 @@ URBAN 文案機器人 - 圖片處理工具 (Premium Edition v2)
 動態字體大小 — 根據圖片尺寸自動調整，確保大圖小圖都清晰。
 """
 
+import bisect
 import io
 import logging
+import math
 import os
+from functools import lru_cache
 
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
 
 import config
+import metrics
+import timing
 
 logger = logging.getLogger(__name__)
 
 
+# 已確認不存在的字型路徑（負向快取，避免每次都重新 open() 失敗）
+_missing_font_paths: set[str] = set()
+
+
+def _try_truetype(path: str, size: int) -> ImageFont.FreeTypeFont | None:
+    """載入字型檔；曾經失敗過的路徑直接略過。"""
+    if path in _missing_font_paths:
+        return None
+    try:
+        return ImageFont.truetype(path, size)
+    except (OSError, IOError):
+        _missing_font_paths.add(path)
+        return None
+
+
+@lru_cache(maxsize=config.FONT_CACHE_SIZE)
 def _load_font(font_key: str | None, size: int) -> ImageFont.FreeTypeFont:
-    """根據字型 key 載入對應字型檔。"""
+    """
+    根據字型 key 載入對應字型檔。
+    依 (font_key, size) 在整個 process 內快取 — 回傳的字型為共用物件。
+    """
     if font_key and font_key in config.AVAILABLE_FONTS:
         font_info = config.AVAILABLE_FONTS[font_key]
         font_path = os.path.join(config.FONTS_DIR, font_info["file"])
-        try:
-            font = ImageFont.truetype(font_path, size)
+        font = _try_truetype(font_path, size)
+        if font is not None:
             logger.info("載入 AI 推薦字型: %s (size=%d)", font_info["name"], size)
             return font
-        except (OSError, IOError):
-            logger.warning("找不到字型檔: %s，嘗試備用字型", font_path)
+        logger.warning("找不到字型檔: %s，嘗試備用字型", font_path)
 
     for path in config.SYSTEM_FONT_FALLBACKS:
-        try:
-            font = ImageFont.truetype(path, size)
+        font = _try_truetype(path, size)
+        if font is not None:
             logger.info("使用系統備用字型: %s (size=%d)", path, size)
             return font
-        except (OSError, IOError):
-            continue
 
     logger.warning("找不到任何中文字型，使用預設字型")
     return ImageFont.load_default()
 
 
+def preload_fonts(widths: list[int] | None = None) -> int:
+    """
+    預先載入常用的 (字型, 大小) 組合，避免第一個請求付出字型解析成本。
+    大小依 _calc_dynamic_font_size 對常見圖片寬度的結果計算（含品牌標記）。
+
+    Returns:
+        預載的組合數量
+    """
+    sizes = set()
+    for width in widths or config.FONT_PRELOAD_WIDTHS:
+        # 三種文字長度區間：<= 6、<= 12、更長
+        for text_len in (6, 12, 13):
+            size = _calc_dynamic_font_size(width, width, text_len)
+            sizes.add(size)
+            sizes.add(max(size // 2, 28))
+
+    font_keys = [*config.AVAILABLE_FONTS, None]
+    for font_key in font_keys:
+        for size in sizes:
+            _load_font(font_key, size)
+
+    count = len(font_keys) * len(sizes)
+    logger.info("字型預載完成 - %d 種組合", count)
+    return count
+
+
 def _calc_dynamic_font_size(img_width: int, img_height: int, text_len: int) -> int:
     """
     根據圖片尺寸和文字長度，動態計算最適合的字體大小。
@@ -61,37 +108,204 @@ def _calc_dynamic_font_size(img_width: int, img_height: int, text_len: int) -> i
     return max(48, min(base_size, 250))
 
 
+def _stretch_column(column: bytes, img_width: int) -> Image.Image:
+    """把 1px 寬的灰階欄位橫向拉伸成整張遮罩（NEAREST，逐列數值不變）。"""
+    return Image.frombytes("L", (1, len(column)), column).resize(
+        (img_width, len(column)), Image.Resampling.NEAREST
+    )
+
+
+@lru_cache(maxsize=config.MASK_CACHE_SIZE)
+def _blur_mask(img_width: int, img_height: int) -> Image.Image:
+    """
+    底部模糊遮罩：從 50% 高度開始由 0 線性增加到 80。
+    只包含 50% 高度以下的部分（上半部全為 0，不需模糊與合成）。
+    依 (寬, 高) 快取 — 回傳的 Image 為共用物件，呼叫端不可修改。
+    """
+    blur_start = int(img_height * 0.50)
+    span = img_height - blur_start
+    column = bytes(int((i / span) * 80) for i in range(span))
+    return _stretch_column(column, img_width)
+
+
+def _blur_padding(radius: float) -> int:
+    """
+    GaussianBlur 影響範圍的列數：Pillow 以 3 次 box blur 近似高斯，
+    每次的 box 半徑約為 radius，3 * (ceil(radius) + 1) 列外的像素不影響結果。
+    """
+    return 3 * (math.ceil(radius) + 1)
+
+
+def _blur_bottom(img: Image.Image, radius: float) -> None:
+    """
+    步驟 1 的底部模糊，就地修改 img：只模糊遮罩涵蓋的下半部（往上多取 _blur_padding 列
+    讓邊界的模糊結果與整張模糊相同），再透過遮罩貼回，成本只與下半部面積成正比。
+    """
+    img_width, img_height = img.size
+    blur_start = int(img_height * 0.50)
+    top = max(0, blur_start - _blur_padding(radius))
+    blurred = img.crop((0, top, img_width, img_height)).filter(ImageFilter.GaussianBlur(radius=radius))
+    if top != blur_start:
+        blurred = blurred.crop((0, blur_start - top, img_width, img_height - top))
+    # 與 Image.composite(blurred, img, mask) 相同（composite 即是以遮罩 paste）
+    img.paste(blurred, (0, blur_start), _blur_mask(img_width, img_height))
+
+
+@lru_cache(maxsize=config.MASK_CACHE_SIZE)
+def _gradient_mask(img_width: int, img_height: int) -> Image.Image:
+    """
+    漸層遮罩的 alpha：從 30% 高度開始以三次方曲線增加到 220。
+    只包含 30% 高度以下的部分（上方全為 0 不需合成）。
+    依 (寬, 高) 快取 — 回傳的 Image 為共用物件，呼叫端不可修改。
+    """
+    gradient_start = int(img_height * 0.30)
+    span = img_height - gradient_start
+    column = bytes(int((i / span) * (i / span) * (i / span) * 220) for i in range(span))
+    return _stretch_column(column, img_width)
+
+
+def _open_at_target_size(image_bytes: bytes, max_dimension: int) -> Image.Image:
+    """
+    解碼上傳圖片並縮到最長邊不超過 max_dimension（0 = 不限制）。
+    JPEG 會先用 draft 模式在解碼時以 1/2、1/4、1/8 縮小，
+    再用 reducing_gap 的整數倍 reduce + LANCZOS 縮到目標尺寸，避免完整解碼 12MP 原圖。
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    longest = max(img.size)
+    if not max_dimension or longest <= max_dimension:
+        return img.convert("RGBA")
+
+    original_size = img.size
+    scale = max_dimension / longest
+    target = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    img.draft(None, target)  # 非 JPEG 格式會直接忽略
+    if img.size != target:
+        img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    logger.info("大圖縮小解碼: %dx%d → %dx%d", *original_size, *target)
+    return img.convert("RGBA")
+
+
+def _composite_region(img: Image.Image, box: tuple[int, int, int, int], paint) -> None:
+    """
+    只在 box 範圍內建立透明圖層，交給 paint(draw, dx, dy) 繪製後就地合成回 img。
+    paint 需以 (x - dx, y - dy) 繪製；box 會裁切到圖片範圍內，範圍外的像素不受影響。
+    """
+    left, top, right, bottom = box
+    left, top = max(0, left), max(0, top)
+    right, bottom = min(img.width, right), min(img.height, bottom)
+    if right <= left or bottom <= top:
+        return
+
+    with timing.span("composite"):
+        layer = Image.new("RGBA", (right - left, bottom - top), (0, 0, 0, 0))
+        paint(ImageDraw.Draw(layer), left, top)
+        img.alpha_composite(layer, (left, top))
+
+
+@lru_cache(maxsize=8192)
+def _glyph_advance(font: ImageFont.FreeTypeFont, char: str) -> float:
+    """單一字元的前進寬度（依字型物件快取，字型本身已由 _load_font 共用）。"""
+    return font.getlength(char)
+
+
+def _line_width(font: ImageFont.FreeTypeFont, text: str) -> int:
+    """實際渲染寬度（與舊版逐字量測相同的 getbbox 定義）。"""
+    bbox = font.getbbox(text)
+    return bbox[2] - bbox[0]
+
+
+def _fit_line_end(paragraph: str, start: int, estimate: int,
+                  font: ImageFont.FreeTypeFont, max_width: int) -> int:
+    """
+    從 start 開始，找出可放進 max_width 的最長前綴結尾 end（start < end）。
+    先用字元前進寬度估計的位置實測，再依結果往後逐字延伸或二分搜尋往回收。
+    至少保留一個字元（單字超寬時自成一行，與舊版行為一致）。
+    """
+    n = len(paragraph)
+    end = max(start + 1, min(estimate, n))
+
+    if _line_width(font, paragraph[start:end]) <= max_width:
+        # 估計偏保守（例如字距調整讓實際更窄），逐字往後延伸
+        while end < n and _line_width(font, paragraph[start:end + 1]) <= max_width:
+            end += 1
+        return end
+
+    # 估計過頭：在 (start, end) 之間二分搜尋最後一個放得下的位置
+    low, high = start + 1, end - 1
+    best = start + 1
+    while low <= high:
+        mid = (low + high) // 2
+        if _line_width(font, paragraph[start:mid]) <= max_width:
+            best = mid
+            low = mid + 1
+        else:
+            high = mid - 1
+    return best
+
+
 def _wrap_text(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> list[str]:
-    """將文字依照字型實際渲染寬度自動換行。"""
+    """
+    將文字依照字型實際渲染寬度自動換行。
+    每行只做少量 getbbox 實測（以快取的字元寬度估計斷點），
+    不再對逐漸變長的整行重複量測。
+    """
     lines = []
     for paragraph in text.split("\n"):
         if not paragraph.strip():
             lines.append("")
             continue
 
-        current_line = ""
+        # 前綴累積寬度，用來估計每行的斷點
+        offsets = [0.0]
         for char in paragraph:
-            test_line = current_line + char
-            bbox = font.getbbox(test_line)
-            line_width = bbox[2] - bbox[0]
-            if line_width <= max_width:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = char
-        if current_line:
-            lines.append(current_line)
+            offsets.append(offsets[-1] + _glyph_advance(font, char))
+
+        start = 0
+        while start < len(paragraph):
+            estimate = bisect.bisect_right(offsets, offsets[start] + max_width) - 1
+            end = _fit_line_end(paragraph, start, estimate, font, max_width)
+            lines.append(paragraph[start:end])
+            start = end
 
     return lines
 
 
+@metrics.timed_render
+def _composite_layer(img: Image.Image, layer: Image.Image, x: int, y: int) -> None:
+    """把預先繪製好的圖層合成到 img 的 (x, y)，超出圖片的部分裁掉（與 _composite_region 相同）。"""
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(img.width, x + layer.width), min(img.height, y + layer.height)
+    if right <= left or bottom <= top:
+        return
+
+    with timing.span("composite"):
+        img.alpha_composite(layer, (left, top), (left - x, top - y, right - x, bottom - y))
+
+
+BRAND_TEXT = "URBAN"
+
+
+@lru_cache(maxsize=config.FONT_CACHE_SIZE)
+def _brand_layer(font_size: int) -> tuple[Image.Image, int, int, int]:
+    """
+    右下角品牌標記的小圖層，回傳 (圖層, 圖層相對文字原點的 x, y 偏移, 文字寬度)。
+    每次排版都畫同樣的字，依字體大小快取 — 回傳的 Image 為共用物件，呼叫端不可修改。
+    """
+    brand_font = _load_font(None, font_size)
+    left, top, right, bottom = brand_font.getbbox(BRAND_TEXT)
+    layer = Image.new("RGBA", (right - left + 2, bottom - top + 2), (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text((1 - left, 1 - top), BRAND_TEXT, font=brand_font, fill=(215, 175, 85, 150))
+    return layer, left - 1, top - 1, right - left
+
+
 def overlay_text_on_image(
     image_bytes: bytes,
     text: str,
     font_key: str | None = None,
     font_size: int | None = None,
     overlay_opacity: int | None = None,
+    max_dimension: int | None = None,
 ) -> bytes:
     """
     在圖片上疊加高級感排版設計。
@@ -103,10 +317,16 @@ def overlay_text_on_image(
     - 文字帶陰影和描邊效果
     - 品牌浮水印
     - 右上角幾何裝飾
+
+    超過 max_dimension（預設 config.MAX_OUTPUT_DIMENSION）的大圖會在解碼時縮小，
+    之後所有步驟都在目標尺寸上進行。
     """
     overlay_opacity = overlay_opacity or config.OVERLAY_OPACITY
+    if max_dimension is None:
+        max_dimension = config.MAX_OUTPUT_DIMENSION
 
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
+    with timing.span("decode"):
+        img = _open_at_target_size(image_bytes, max_dimension)
     img_width, img_height = img.size
 
     # === 動態計算字體大小 ===
@@ -117,37 +337,26 @@ def overlay_text_on_image(
                 img_width, img_height, font_size, text[:20])
 
     # === 步驟 1: 底部輕微模糊 ===
-    blur_mask = Image.new("L", img.size, 0)
-    blur_draw = ImageDraw.Draw(blur_mask)
-    blur_start = int(img_height * 0.50)
-    blur_radius = max(3, img_width // 500)
-    for y in range(blur_start, img_height):
-        alpha = int(((y - blur_start) / (img_height - blur_start)) * 80)
-        blur_draw.line([(0, y), (img_width, y)], fill=alpha)
-
-    blurred = img.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-    img = Image.composite(blurred, img, blur_mask)
+    with timing.span("blur"):
+        _blur_bottom(img, max(3, img_width // 500))
 
     # === 步驟 2: 漸層遮罩（從透明到深色）===
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-
-    gradient_start = int(img_height * 0.30)
-    for y in range(gradient_start, img_height):
-        progress = (y - gradient_start) / (img_height - gradient_start)
-        eased = progress * progress * progress
-        alpha = int(eased * 220)
-        draw.line([(0, y), (img_width, y)], fill=(8, 10, 25, alpha))
+    # 只合成漸層實際覆蓋的下方區域，上方 30% 完全透明不必處理
+    with timing.span("gradient"):
+        gradient_start = int(img_height * 0.30)
+        overlay = Image.new("RGBA", (img_width, img_height - gradient_start), (8, 10, 25, 0))
+        overlay.putalpha(_gradient_mask(img_width, img_height))
 
-    img = Image.alpha_composite(img, overlay)
+        img.alpha_composite(overlay, (0, gradient_start))
 
     # === 步驟 3: 載入字型並排版文字 ===
-    main_font = _load_font(font_key, font_size)
+    with timing.span("layout"):
+        main_font = _load_font(font_key, font_size)
 
-    margin_left = int(img_width * 0.08)
-    margin_right = int(img_width * 0.08)
-    text_max_width = img_width - margin_left - margin_right
-    wrapped_lines = _wrap_text(text, main_font, text_max_width)
+        margin_left = int(img_width * 0.08)
+        margin_right = int(img_width * 0.08)
+        text_max_width = img_width - margin_left - margin_right
+        wrapped_lines = _wrap_text(text, main_font, text_max_width)
 
     line_height = int(font_size * 1.5)
     total_text_height = line_height * len(wrapped_lines)
@@ -156,114 +365,121 @@ def overlay_text_on_image(
     text_bottom_margin = int(img_height * 0.07)
     y_start = img_height - text_bottom_margin - total_text_height
 
-    # === 步驟 4: 左側金色粗裝飾線 ===
-    accent_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    accent_draw = ImageDraw.Draw(accent_layer)
+    # 以下每個裝飾元素只在自己的範圍內建立小圖層並就地合成，
+    # 合成順序與整張圖層版本相同，透明像素的合成結果不變。
 
+    # === 步驟 4: 左側金色粗裝飾線 ===
     bar_width = max(5, img_width // 200)  # 動態粗細
     line_x = margin_left - int(img_width * 0.035)
     gold_color = (215, 175, 85, 220)
+    block_size = bar_width * 3
 
-    # 主豎線
-    accent_draw.rectangle(
-        [(line_x, y_start), (line_x + bar_width, y_start + total_text_height)],
-        fill=gold_color,
-    )
+    def paint_accent(draw: ImageDraw.ImageDraw, dx: int, dy: int) -> None:
+        # 主豎線
+        draw.rectangle(
+            [(line_x - dx, y_start - dy),
+             (line_x + bar_width - dx, y_start + total_text_height - dy)],
+            fill=gold_color,
+        )
 
-    # 頂部金色小方塊
-    block_size = bar_width * 3
-    accent_draw.rectangle(
-        [(line_x - bar_width, y_start - block_size - bar_width),
-         (line_x + block_size, y_start - bar_width)],
-        fill=gold_color,
-    )
+        # 頂部金色小方塊
+        draw.rectangle(
+            [(line_x - bar_width - dx, y_start - block_size - bar_width - dy),
+             (line_x + block_size - dx, y_start - bar_width - dy)],
+            fill=gold_color,
+        )
 
-    img = Image.alpha_composite(img, accent_layer)
+    _composite_region(
+        img,
+        (line_x - bar_width, y_start - block_size - bar_width,
+         line_x + max(bar_width, block_size) + 1, y_start + total_text_height + 1),
+        paint_accent,
+    )
 
     # === 步驟 5: 繪製文字（描邊 + 陰影 + 主文字）===
-    text_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    text_draw = ImageDraw.Draw(text_layer)
-
     shadow_offset = max(3, font_size // 20)
     stroke_width = max(2, font_size // 30)
 
+    drawn_lines = []
     y_cursor = y_start
     for line in wrapped_lines:
         if y_cursor + line_height > img_height - 20:
             break
-
-        # 文字陰影（偏移更大）
-        text_draw.text(
-            (margin_left + shadow_offset, y_cursor + shadow_offset),
-            line,
-            font=main_font,
-            fill=(0, 0, 0, 100),
-        )
-
-        # 文字描邊（增加可讀性）
-        text_draw.text(
-            (margin_left, y_cursor),
-            line,
-            font=main_font,
-            fill=(255, 255, 255, 255),
-            stroke_width=stroke_width,
-            stroke_fill=(0, 0, 0, 160),
-        )
-
+        drawn_lines.append((line, y_cursor))
         y_cursor += line_height
 
-    img = Image.alpha_composite(img, text_layer)
+    def paint_text(draw: ImageDraw.ImageDraw, dx: int, dy: int) -> None:
+        for line, line_y in drawn_lines:
+            # 文字陰影（偏移更大）
+            draw.text(
+                (margin_left + shadow_offset - dx, line_y + shadow_offset - dy),
+                line,
+                font=main_font,
+                fill=(0, 0, 0, 100),
+            )
+
+            # 文字描邊（增加可讀性）
+            draw.text(
+                (margin_left - dx, line_y - dy),
+                line,
+                font=main_font,
+                fill=(255, 255, 255, 255),
+                stroke_width=stroke_width,
+                stroke_fill=(0, 0, 0, 160),
+            )
+
+    if drawn_lines:
+        text_boxes = []
+        for line, line_y in drawn_lines:
+            left, top, right, bottom = main_font.getbbox(line, stroke_width=stroke_width)
+            text_boxes.append((margin_left + left, line_y + top,
+                               margin_left + right + shadow_offset, line_y + bottom + shadow_offset))
+        _composite_region(
+            img,
+            (min(b[0] for b in text_boxes) - 1, min(b[1] for b in text_boxes) - 1,
+             max(b[2] for b in text_boxes) + 1, max(b[3] for b in text_boxes) + 1),
+            paint_text,
+        )
 
     # === 步驟 6: 右下角品牌標記 ===
-    brand_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    brand_draw = ImageDraw.Draw(brand_layer)
-
-    brand_font_size = max(font_size // 2, 28)
-    brand_font = _load_font(None, brand_font_size)
-    brand_text = "URBAN"
-    brand_bbox = brand_font.getbbox(brand_text)
-    brand_w = brand_bbox[2] - brand_bbox[0]
-
+    brand_layer, offset_x, offset_y, brand_w = _brand_layer(max(font_size // 2, 28))
     brand_x = img_width - margin_right - brand_w
     brand_y = img_height - int(img_height * 0.035)
-
-    brand_draw.text(
-        (brand_x, brand_y),
-        brand_text,
-        font=brand_font,
-        fill=(215, 175, 85, 150),
-    )
-
-    img = Image.alpha_composite(img, brand_layer)
+    _composite_layer(img, brand_layer, brand_x + offset_x, brand_y + offset_y)
 
     # === 步驟 7: 右上角幾何裝飾線 ===
-    deco_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    deco_draw = ImageDraw.Draw(deco_layer)
-
     corner_margin = int(img_width * 0.05)
     line_len = int(img_width * 0.12)
     deco_line_width = max(2, img_width // 500)
+    corner_x = img_width - corner_margin
+
+    def paint_deco(draw: ImageDraw.ImageDraw, dx: int, dy: int) -> None:
+        draw.line(
+            [(corner_x - dx, corner_margin - dy),
+             (corner_x - dx, corner_margin + line_len - dy)],
+            fill=(215, 175, 85, 100),
+            width=deco_line_width,
+        )
+        draw.line(
+            [(corner_x - dx, corner_margin - dy),
+             (corner_x - line_len - dx, corner_margin - dy)],
+            fill=(215, 175, 85, 100),
+            width=deco_line_width,
+        )
 
-    deco_draw.line(
-        [(img_width - corner_margin, corner_margin),
-         (img_width - corner_margin, corner_margin + line_len)],
-        fill=(215, 175, 85, 100),
-        width=deco_line_width,
-    )
-    deco_draw.line(
-        [(img_width - corner_margin, corner_margin),
-         (img_width - corner_margin - line_len, corner_margin)],
-        fill=(215, 175, 85, 100),
-        width=deco_line_width,
+    _composite_region(
+        img,
+        (corner_x - line_len - deco_line_width, corner_margin - deco_line_width,
+         corner_x + deco_line_width + 1, corner_margin + line_len + deco_line_width + 1),
+        paint_deco,
     )
 
-    img = Image.alpha_composite(img, deco_layer)
-
     # === 輸出 ===
-    result_rgb = img.convert("RGB")
-    output = io.BytesIO()
-    result_rgb.save(output, format="JPEG", quality=95)
-    output.seek(0)
+    with timing.span("encode"):
+        result_rgb = img.convert("RGB")
+        output = io.BytesIO()
+        result_rgb.save(output, format="JPEG", quality=95)
+        output.seek(0)
 
     font_name = config.AVAILABLE_FONTS.get(font_key, {}).get("name", "系統預設")
     logger.info("排版合成完成 - 尺寸: %dx%d, 字型: %s, 字體大小: %dpx, 行數: %d",
@@ -0,0 +1,253 @@
+"""
+URBAN 文案機器人 - 非同步任務 (Job) 管理
+慢速圖片端點可改為「送出即回傳 job id」，由有上限的背景執行緒池執行 ai_service 呼叫，
+客戶端再輪詢（或 long-poll）結果。結果在 TTL 後過期。
+
+任務儲存可替換：
+- memory: 單一 process 內的 dict（預設；多個 gunicorn worker 之間不共享，只適合單一 worker）
+- file:   每個任務一個 JSON 檔，適合多 worker 共用本機磁碟
+- sqlite: 單一 SQLite 檔案，適合多 worker 共用本機磁碟
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+
+class JobQueueFull(Exception):
+    """背景任務佇列已滿。"""
+
+
+# ============================================================
+# 任務儲存 (Job Store)
+# ============================================================
+
+class MemoryJobStore:
+    """單一 process 內的任務儲存。"""
+
+    def __init__(self):
+        self._jobs: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: dict) -> None:
+        with self._lock:
+            self._jobs[job["job_id"]] = dict(job)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def purge_expired(self, now: float) -> int:
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job["expires_at"] <= now]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+
+class FileJobStore:
+    """每個任務存成一個 JSON 檔（先寫暫存檔再 os.replace，讀取端不會看到寫一半的檔案）。"""
+
+    PURGE_EVERY = 100  # 清除需掃描整個目錄，每 100 次呼叫才實際清一次（過期任務讀取時已視為不存在）
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._purge_calls = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def save(self, job: dict) -> None:
+        path = self._path(job["job_id"])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get(self, job_id: str) -> dict | None:
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def purge_expired(self, now: float) -> int:
+        with self._lock:
+            self._purge_calls += 1
+            if self._purge_calls % self.PURGE_EVERY != 0:
+                return 0
+
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            job = self.get(name[:-len(".json")])
+            if job and job["expires_at"] <= now:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class SQLiteJobStore:
+    """SQLite 任務儲存；每個執行緒各自一條連線。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, job: dict) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, data, expires_at) VALUES (?, ?, ?)",
+                (job["job_id"], json.dumps(job, ensure_ascii=False), job["expires_at"]),
+            )
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._connect().execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def purge_expired(self, now: float) -> int:
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,)).rowcount
+
+
+def create_store(kind: str | None = None, path: str | None = None):
+    """依設定建立任務儲存。"""
+    kind = (kind or config.JOB_STORE).lower()
+    path = path or config.JOB_STORE_PATH
+    if kind == "memory":
+        return MemoryJobStore()
+    if kind == "file":
+        return FileJobStore(path or "/tmp/urban_jobs")
+    if kind == "sqlite":
+        return SQLiteJobStore(path or "/tmp/urban_jobs.sqlite3")
+    raise ValueError(f"未知的 JOB_STORE: {kind}")
+
+
+# ============================================================
+# 任務管理 (Job Manager)
+# ============================================================
+
+class JobManager:
+    """
+    以有上限的執行緒池執行背景任務。
+    排隊 + 執行中的任務數達到 queue_limit 時，submit 直接拋出 JobQueueFull。
+    """
+
+    def __init__(self, store, max_workers: int | None = None,
+                 queue_limit: int | None = None, ttl: int | None = None):
+        self.store = store
+        self.max_workers = max_workers or config.JOB_WORKERS
+        self.queue_limit = queue_limit or config.JOB_QUEUE_LIMIT
+        self.ttl = ttl or config.JOB_TTL_SECONDS
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn, *args) -> dict:
+        """送出任務，立即回傳任務紀錄（status=queued）。fn 的回傳值需可 JSON 序列化。"""
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                raise JobQueueFull(f"背景任務已滿（{self.queue_limit}），請稍後再試")
+            self._pending += 1
+
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": now + self.ttl,
+        }
+        self.store.save(job)
+        self._executor.submit(self._run, job, fn, args)
+        logger.info("任務已送出: %s (%s)", job["job_id"], kind)
+        return job
+
+    def _run(self, job: dict, fn, args) -> None:
+        try:
+            self._update(job, status=RUNNING)
+            result = fn(*args)
+            self._update(job, status=SUCCEEDED, result=result)
+            logger.info("任務完成: %s (%s)", job["job_id"], job["kind"])
+        except Exception as e:
+            logger.error("任務失敗: %s (%s): %s", job["job_id"], job["kind"], e, exc_info=True)
+            self._update(job, status=FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self.store.purge_expired(time.time())
+
+    def _update(self, job: dict, **fields) -> None:
+        now = time.time()
+        job.update(fields, updated_at=now)
+        if job["status"] in FINISHED_STATES:
+            # 結果從完成時起保留 ttl 秒
+            job["expires_at"] = now + self.ttl
+        self.store.save(job)
+
+    def get(self, job_id: str, wait: float = 0) -> dict | None:
+        """
+        查詢任務；wait > 0 時 long-poll，直到任務完成或等待逾時。
+        已過期的任務視為不存在。
+        """
+        deadline = time.monotonic() + min(wait, config.JOB_MAX_WAIT_SECONDS)
+        while True:
+            job = self.store.get(job_id)
+            if job is None or job["expires_at"] <= time.time():
+                return None
+            if job["status"] in FINISHED_STATES or time.monotonic() >= deadline:
+                return job
+            time.sleep(config.JOB_POLL_INTERVAL)
+
+
+def public_view(job: dict) -> dict:
+    """回傳給客戶端的任務內容（不含內部欄位）。"""
+    view = {
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "expires_at": job["expires_at"],
+    }
+    if "result" in job:
+        view["result"] = job["result"]
+    if "error" in job:
+        view["error"] = job["error"]
+    return view
@@ -0,0 +1,239 @@
+"""
+URBAN 文案機器人 - 模型輸出的 JSON 解析（可串流）
+模型回傳的 JSON 常帶 markdown code block、前後說明文字，或因 max_output_tokens 被截斷。
+JsonExtractor 逐塊餵入文字、每塊只掃描一次（以 regex 跳到下一個結構字元），
+頂層欄位與陣列（options / sections）中的元素一完成就解碼取出，不重新解析已解碼的部分；
+整份 JSON 不完整時，仍能以已完成的欄位與元素組成結果。
+"""
+
+import json
+import re
+
+# 字串內允許未跳脫的換行等控制字元（模型常直接輸出多行文案）
+_DECODER = json.JSONDecoder(strict=False)
+_STRUCTURAL = re.compile(r'[{}\[\]:,"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class JsonExtractor:
+    """
+    追蹤第一個 { 開始的頂層物件：
+    - feed() 回傳這次新完成的陣列元素 [(key, 物件), ...]，例如 ("options", {...})
+    - result() 回傳目前能取得的完整結果
+
+    每塊文字只掃描一次：頂層陣列的每個元素在結束時解碼一次，陣列欄位直接由這些元素組成
+    （不重新解碼整個陣列），其他頂層欄位在值結束時解碼一次；只保留尚未結束的元素 / 欄位所在的文字塊。
+    """
+
+    def __init__(self):
+        self._chunks: list[str] = []     # 餵入的所有文字塊（讀取 text 時才合併）
+        self._pending: list[str] = []    # 仍可能需要解碼的文字塊
+        self._pending_start = 0          # _pending[0] 在整份文字中的位置
+        self._length = 0
+        self._skip = 0                   # 跳脫字元剛好在上一塊結尾時，這一塊開頭要略過的字元數
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        self._last_string = None
+        self._key = None
+        self._value_start = None
+        self._array_key = None
+        self._array_commas = 0
+        self._item_start = None
+        self._closed = False
+        self._lossy = False              # 有欄位或元素無法解碼
+        self._fields = {}
+        self._items: dict[str, list] = {}
+
+    @property
+    def text(self) -> str:
+        """目前為止餵入的完整文字。"""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk: str) -> list[tuple[str, dict]]:
+        self._chunks.append(chunk)
+        base = self._length
+        self._length += len(chunk)
+        completed = []
+        if self._closed or not chunk:
+            return completed
+
+        self._pending.append(chunk)
+        pos, self._skip = self._skip, 0
+        while not self._closed:
+            if not self._started:
+                # 頂層物件開始前的前言 / code block 標記只找 {
+                pos = chunk.find("{", pos)
+                if pos == -1:
+                    break
+                self._started = True
+                self._depth = 1
+                pos += 1
+                continue
+
+            if self._in_string:
+                match = _STRING_SPECIAL.search(chunk, pos)
+                if match is None:
+                    break
+                pos = match.start()
+                if chunk[pos] == "\\":
+                    if pos + 1 == len(chunk):
+                        self._skip = 1  # 跳脫字元剛好在 chunk 結尾，被跳脫的字元在下一塊
+                        break
+                    pos += 2
+                    continue
+                self._in_string = False
+                if self._depth == 1:
+                    self._last_string = self._string(self._string_start, base + pos)
+                pos += 1
+                continue
+
+            match = _STRUCTURAL.search(chunk, pos)
+            if match is None:
+                break
+            pos = match.start()
+            self._structural(chunk[pos], base + pos, completed)
+            pos += 1
+
+        self._release()
+        return completed
+
+    def _structural(self, char: str, at: int, completed: list) -> None:
+        """at 為字元在整份文字中的位置。"""
+        if char == '"':
+            self._in_string = True
+            self._string_start = at + 1
+        elif char in "{[":
+            if self._depth == 1 and char == "[" and self._key is not None:
+                # 頂層陣列：由元素組成，不在欄位結束時重新解碼
+                self._array_key = self._key
+                self._items[self._key] = []
+                self._array_commas = 0
+                self._value_start = None
+                self._item_start = at + 1
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 2 and char == "}" and self._item_start is not None:
+                self._end_item(at + 1, completed)  # 陣列中的物件一完成就取出
+            elif self._depth == 1 and char == "]" and self._array_key is not None:
+                self._end_item(at, completed)
+                self._fields[self._array_key] = self._items[self._array_key]
+                self._array_key = None
+                self._key = None
+            elif self._depth == 0:
+                self._end_field(at)
+                self._closed = True
+        elif self._depth == 2 and char == "," and self._array_key is not None:
+            self._array_commas += 1
+            self._end_item(at, completed)
+            self._item_start = at + 1
+        elif self._depth == 1:
+            if char == ":":
+                self._key = self._last_string
+                self._value_start = at + 1
+            elif char == ",":
+                self._end_field(at)
+
+    def _end_item(self, end: int, completed: list) -> None:
+        """陣列元素結束（物件的 }，或其他值之後的 , / ]）：解碼一次並記下。"""
+        if self._item_start is None:
+            return
+        raw = self._slice(self._item_start, end)
+        self._item_start = None
+        item = _decode_at(raw, 0)
+        if item is None:
+            # 空陣列的 [] 不算；多餘的逗號或無法解碼的元素代表結果不完整
+            self._lossy = self._lossy or bool(raw.strip()) or self._array_commas > 0
+            return
+        self._items[self._array_key].append(item)
+        if isinstance(item, dict):
+            completed.append((self._array_key, item))
+
+    def _end_field(self, end: int) -> None:
+        """頂層欄位的值結束（遇到 , 或 }）：解碼一次並記下。"""
+        if self._key is not None and self._value_start is not None:
+            value = _decode_at(self._slice(self._value_start, end), 0)
+            if value is not None:
+                self._fields[self._key] = value
+            else:
+                self._lossy = True
+        self._key = None
+        self._value_start = None
+
+    def _slice(self, start: int, end: int) -> str:
+        """整份文字中 [start, end) 的部分（只會落在 _pending 保留的文字塊內）。"""
+        last = self._pending[-1]
+        last_start = self._length - len(last)
+        if start >= last_start:
+            return last[start - last_start:end - last_start]
+        parts, offset = [], self._pending_start
+        for chunk in self._pending:
+            if offset + len(chunk) > start and offset < end:
+                parts.append(chunk[max(0, start - offset):end - offset])
+            offset += len(chunk)
+        return "".join(parts)
+
+    def _string(self, start: int, end: int) -> str:
+        raw = self._slice(start, end)
+        if "\\" not in raw:
+            return raw
+        try:
+            return _DECODER.decode('"' + raw + '"')
+        except json.JSONDecodeError:
+            return raw
+
+    def _release(self) -> None:
+        """丟掉之後不會再解碼到的文字塊。"""
+        needed = [start for start in (self._item_start, self._value_start,
+                                      self._string_start if self._in_string else None) if start is not None]
+        keep_from = min(needed) if needed else self._length
+        while self._pending and self._pending_start + len(self._pending[0]) <= keep_from:
+            self._pending_start += len(self._pending.pop(0))
+
+    def result(self) -> dict | None:
+        """
+        整份 JSON 完整且每個欄位 / 元素都能解碼時直接回傳；截斷或格式不符時，
+        以已完成的頂層欄位與陣列元素組成結果並標記 "partial": True；
+        沒有取回任何陣列中的物件時回傳 None（交給呼叫端以原始文字處理）。
+        """
+        if self._closed and not self._lossy:
+            return dict(self._fields)
+        if not any(isinstance(item, dict) for items in self._items.values() for item in items):
+            return None
+        recovered = dict(self._fields)
+        for key, items in self._items.items():
+            if not isinstance(recovered.get(key), list):
+                recovered[key] = items
+        recovered["partial"] = True
+        return recovered
+
+
+def _decode_at(text: str, pos: int):
+    """從 pos 開始（略過空白）解碼一個 JSON 值，不複製字串；失敗時回傳 None。"""
+    while pos < len(text) and text[pos] in " \t\r\n":
+        pos += 1
+    try:
+        value, _ = _DECODER.raw_decode(text, pos)
+    except json.JSONDecodeError:
+        return None
+    return value
+
+
+def parse(text: str) -> dict | None:
+    """
+    解析完整的模型輸出：先從第一個 { 直接解碼（格式正確時只掃描一次）；
+    失敗時才以 JsonExtractor 取回完整的欄位與陣列元素。
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    value = _decode_at(text, start)
+    if isinstance(value, dict):
+        return value
+    extractor = JsonExtractor()
+    extractor.feed(text)
+    return extractor.result()
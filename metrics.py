@@ -0,0 +1,140 @@
+"""
+URBAN 文案機器人 - Prometheus 指標 (/metrics)
+- HTTP：各路由的處理時間、處理中請求數、請求 / 回應大小
+- Gemini：每次嘗試的耗時與結果（依 operation / model）、退避重試與換模型次數、token 用量
+- image_utils：排版合成耗時；/api/v1/design 使用的排版引擎
+
+多個 gunicorn worker：設定 PROMETHEUS_MULTIPROC_DIR（空目錄）後，各 worker 把數值寫入該目錄的
+mmap 檔，/metrics 彙總所有 worker；gunicorn.conf.py 在啟動時清空目錄、worker 結束時清掉它的 gauge。
+記錄一筆只是加鎖後更新數值（multiprocess 模式為寫入 mmap），可以常駐在熱路徑上。
+"""
+
+import functools
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+_RENDER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "urban_http_request_duration_seconds", "HTTP 請求處理時間（串流回應為送出標頭前的時間）",
+    ["route", "method", "status"], buckets=_LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "urban_http_requests_in_flight", "處理中的 HTTP 請求數", ["route"], multiprocess_mode="livesum",
+)
+HTTP_REQUEST_BYTES = Histogram(
+    "urban_http_request_size_bytes", "HTTP 請求 body 大小", ["route"], buckets=_SIZE_BUCKETS,
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    "urban_http_response_size_bytes", "HTTP 回應 body 大小（串流回應不計）", ["route"], buckets=_SIZE_BUCKETS,
+)
+
+GEMINI_ATTEMPT_SECONDS = Histogram(
+    "urban_gemini_attempt_duration_seconds", "每次 Gemini 嘗試的耗時，outcome 為 ok / retry / next_model / fatal",
+    ["operation", "model", "outcome"], buckets=_LATENCY_BUCKETS,
+)
+GEMINI_RETRIES = Counter(
+    "urban_gemini_retries", "暫時性錯誤後退避重試同一個模型的次數", ["operation", "model"],
+)
+GEMINI_FALLBACKS = Counter(
+    "urban_gemini_fallbacks", "放棄模型、換下一個模型的次數（reason: missing / circuit_open / exhausted / overloaded / deadline）",
+    ["operation", "model", "reason"],
+)
+GEMINI_TOKENS = Counter(
+    "urban_gemini_tokens", "Gemini 回應 usage_metadata 回報的 token 數（kind: prompt / output / cached）",
+    ["operation", "model", "kind"],
+)
+
+IMAGE_RENDER_SECONDS = Histogram(
+    "urban_image_render_duration_seconds", "image_utils 排版合成耗時", ["function"], buckets=_RENDER_BUCKETS,
+)
+DESIGN_RENDERS = Counter(
+    "urban_design_renders", "/api/v1/design 使用的排版引擎（engine: ai / local；reason 見 api_common.design_engine）",
+    ["engine", "reason"],
+)
+
+
+# ============================================================
+# HTTP
+# ============================================================
+
+def route_of(url_rule) -> str:
+    """以路由樣板（例如 /api/v1/jobs/<job_id>）為 label，避免 label 數量無限增加。"""
+    return url_rule.rule if url_rule is not None else "unmatched"
+
+
+def request_started(route: str, content_length: int | None) -> float:
+    HTTP_REQUESTS_IN_FLIGHT.labels(route).inc()
+    if content_length is not None:
+        HTTP_REQUEST_BYTES.labels(route).observe(content_length)
+    return time.perf_counter()
+
+
+def request_finished(route: str, method: str, status: int, started: float, content_length: int | None) -> None:
+    HTTP_REQUEST_SECONDS.labels(route, method, str(status)).observe(time.perf_counter() - started)
+    if content_length is not None:
+        HTTP_RESPONSE_BYTES.labels(route).observe(content_length)
+
+
+def request_closed(route: str) -> None:
+    HTTP_REQUESTS_IN_FLIGHT.labels(route).dec()
+
+
+# ============================================================
+# Gemini
+# ============================================================
+
+def record_usage(operation: str, model: str, response) -> None:
+    """記錄回應 usage_metadata 中的 token 數（沒有回報時略過）。"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, count in (("prompt", usage.prompt_token_count), ("output", usage.candidates_token_count),
+                        ("cached", usage.cached_content_token_count)):
+        if count:
+            GEMINI_TOKENS.labels(operation, model, kind).inc(count)
+
+
+# ============================================================
+# 圖片處理
+# ============================================================
+
+def timed_render(fn):
+    """記錄 image_utils 函式的耗時，label 為函式名稱。"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with IMAGE_RENDER_SECONDS.labels(fn.__name__).time():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def record_design(engine: str, reason: str) -> None:
+    DESIGN_RENDERS.labels(engine, reason).inc()
+
+
+# ============================================================
+# /metrics
+# ============================================================
+
+def render() -> bytes:
+    """Prometheus 文字格式；multiprocess 模式下彙總所有 worker 的數值。"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
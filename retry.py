@@ -0,0 +1,345 @@
+"""
+URBAN 文案機器人 - Gemini 呼叫重試
+所有 Gemini 呼叫（文字與圖片、sync 與 async）共用的重試邏輯：
+- 以 SDK 的結構化例外分類錯誤（HTTP 狀態碼 / 連線錯誤），不再比對錯誤字串
+- 指數退避 + full jitter，避免多個 worker 同時重試
+- async 版本以 asyncio.sleep 等待，不佔用執行緒
+- 每次嘗試記錄耗時與結果，彙總於 stats 供 /api/v1/stats 查看，並回報給 routing 的模型健康狀態
+  （模型斷路後不再對它退避重試，直接換下一個模型）
+- 請求的時間預算（deadline）以 contextvar 傳遞：每次嘗試以剩餘時間為逾時，
+  剩餘時間不夠退避時直接換下一個模型（不等待），不足以再嘗試一次時立即停止
+- 每次嘗試先向 admission 取得該模型的呼叫名額；模型忙碌時換下一個模型，都忙碌時拋出 Overloaded
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import random
+import threading
+import time
+
+import httpx
+import requests
+from google.genai import errors
+
+import admission
+import config
+import metrics
+import routing
+import timing
+
+logger = logging.getLogger(__name__)
+
+# 錯誤分類
+RETRY = "retry"            # 暫時性錯誤：退避後重試同一模型
+NEXT_MODEL = "next_model"  # 模型不存在：直接換下一個模型
+FATAL = "fatal"            # 其他錯誤（參數錯誤、權限等）：直接拋出
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class EmptyResponse(Exception):
+    """模型有回應但缺少需要的內容（例如圖片模型沒回傳圖片），視為可重試。"""
+
+
+class DeadlineExceeded(Exception):
+    """請求的時間預算已用完（或不足以再嘗試一次）。"""
+
+
+def classify(error: Exception) -> str:
+    """依例外類型判斷處理方式（RETRY / NEXT_MODEL / FATAL）。"""
+    if isinstance(error, EmptyResponse):
+        return RETRY
+    if isinstance(error, errors.APIError):
+        if error.code == 404:
+            return NEXT_MODEL
+        if error.code in RETRYABLE_STATUS_CODES:
+            return RETRY
+        return FATAL
+    # 連線中斷 / 逾時：sync client 走 requests，async client 走 httpx
+    if isinstance(error, (httpx.TransportError, requests.ConnectionError, requests.Timeout,
+                          asyncio.TimeoutError)):
+        return RETRY
+    return FATAL
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 attempt 次（從 0 起算）失敗後的等待秒數：[0, min(上限, 基準 * 2^attempt)] 之間隨機。"""
+    return random.uniform(0, min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * 2 ** attempt))
+
+
+# ============================================================
+# 請求時間預算 (deadline)
+# ============================================================
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("gemini_deadline", default=None)
+
+
+def set_deadline(seconds: float | None) -> contextvars.Token:
+    """
+    設定目前請求的時間預算（秒，None = 不限）；外層已有較早的 deadline 時保留較早者。
+    回傳 token，請求結束時交給 reset_deadline 還原。
+    """
+    deadline_at = _deadline.get()
+    if seconds is not None:
+        candidate = time.monotonic() + seconds
+        deadline_at = candidate if deadline_at is None else min(deadline_at, candidate)
+    return _deadline.set(deadline_at)
+
+
+def reset_deadline(token: contextvars.Token) -> None:
+    _deadline.reset(token)
+
+
+def current_deadline() -> float | None:
+    """目前的 deadline（time.monotonic() 時刻）；交給 restore_deadline 在另一個 context 沿用。"""
+    return _deadline.get()
+
+
+def restore_deadline(deadline_at: float | None) -> contextvars.Token:
+    """沿用 current_deadline 取得的 deadline，回傳 token 供 reset_deadline 還原。"""
+    return _deadline.set(deadline_at)
+
+
+@contextlib.contextmanager
+def deadline(seconds: float | None):
+    """在此範圍內的 Gemini 呼叫共用 seconds 秒的時間預算。"""
+    token = set_deadline(seconds)
+    try:
+        yield
+    finally:
+        reset_deadline(token)
+
+
+def remaining() -> float | None:
+    """剩餘的時間預算（秒）；未設定 deadline 時回傳 None。"""
+    deadline_at = _deadline.get()
+    return None if deadline_at is None else deadline_at - time.monotonic()
+
+
+def _attempt_timeout(operation: str, last_error: Exception | None) -> float | None:
+    """這次嘗試可用的逾時（秒）；預算不足以再嘗試一次時拋出 DeadlineExceeded。"""
+    left = remaining()
+    if left is None:
+        return None
+    if left < config.RETRY_MIN_ATTEMPT_SECONDS:
+        logger.warning("%s: 時間預算剩 %.1fs，停止重試", operation, max(left, 0.0))
+        raise DeadlineExceeded("處理時間超過上限，請稍後再試") from last_error
+    return left
+
+
+# ============================================================
+# 每次嘗試的統計
+# ============================================================
+
+class CallStats:
+    """依 (operation, model) 彙總每次嘗試的次數、結果與耗時。"""
+
+    def __init__(self):
+        self._data: dict[str, dict[str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, model: str, outcome: str, elapsed: float, backoff: float = 0.0) -> None:
+        with self._lock:
+            counters = self._data.setdefault(operation, {}).setdefault(model, {
+                "attempts": 0, "ok": 0, RETRY: 0, NEXT_MODEL: 0, FATAL: 0,
+                "attempt_seconds": 0.0, "max_attempt_seconds": 0.0, "backoff_seconds": 0.0,
+            })
+            counters["attempts"] += 1
+            counters[outcome] += 1
+            counters["attempt_seconds"] += elapsed
+            counters["max_attempt_seconds"] = max(counters["max_attempt_seconds"], elapsed)
+            counters["backoff_seconds"] += backoff
+        metrics.GEMINI_ATTEMPT_SECONDS.labels(operation, model, outcome).observe(elapsed)
+        timing.record("gemini", elapsed, f"{operation} {model} {outcome}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                operation: {
+                    model: {key: round(value, 3) if isinstance(value, float) else value
+                            for key, value in counters.items()}
+                    for model, counters in models.items()
+                }
+                for operation, models in self._data.items()
+            }
+
+
+stats = CallStats()
+
+
+# ============================================================
+# 重試流程
+# ============================================================
+
+def _fallback(operation: str, model: str, reason: str, has_fallback: bool) -> None:
+    if has_fallback:
+        metrics.GEMINI_FALLBACKS.labels(operation, model, reason).inc()
+
+
+def _after_failure(operation: str, model: str, attempt: int, max_attempts: int,
+                   error: Exception, elapsed: float, has_fallback: bool) -> float | None:
+    """
+    記錄失敗的嘗試並決定下一步：回傳等待秒數（重試同一模型），
+    回傳 None（換下一個模型），或直接拋出原本的例外。
+    """
+    outcome = classify(error)
+    if outcome == FATAL:
+        stats.record(operation, model, FATAL, elapsed)
+        logger.warning("%s: 模型 %s 呼叫失敗（不重試，%.2fs）: %s", operation, model, elapsed, error)
+        raise error
+
+    if outcome == NEXT_MODEL:
+        routing.health.mark_missing(model)
+        stats.record(operation, model, NEXT_MODEL, elapsed)
+        _fallback(operation, model, "missing", has_fallback)
+        logger.warning("%s: 模型 %s 不存在，跳到下一個", operation, model)
+        return None
+
+    routing.health.record_failure(model)
+    if has_fallback and routing.health.is_open(model):
+        stats.record(operation, model, RETRY, elapsed)
+        _fallback(operation, model, "circuit_open", has_fallback)
+        logger.warning("%s: 模型 %s 已斷路，直接換下一個模型: %s", operation, model, error)
+        return None
+
+    if attempt + 1 >= max_attempts:
+        stats.record(operation, model, RETRY, elapsed)
+        _fallback(operation, model, "exhausted", has_fallback)
+        logger.warning("%s: 模型 %s 重試 %d 次全部失敗: %s", operation, model, max_attempts, error)
+        return None
+
+    delay = backoff_delay(attempt)
+    left = remaining()
+    if left is not None and left - delay < config.RETRY_MIN_ATTEMPT_SECONDS:
+        stats.record(operation, model, RETRY, elapsed)
+        if has_fallback and left >= config.RETRY_MIN_ATTEMPT_SECONDS:
+            # 等完退避就沒有時間再試，但不等待的話還夠嘗試一次：直接換下一個模型
+            _fallback(operation, model, "deadline", has_fallback)
+            logger.warning("%s: 模型 %s 暫時性錯誤且剩餘時間（%.1fs）不夠退避，直接換下一個模型: %s",
+                           operation, model, left, error)
+            return None
+
+        # 等完退避就沒有時間再試，也沒有其他模型，直接結束
+        logger.warning("%s: 模型 %s 暫時性錯誤且時間預算不足（剩 %.1fs），停止重試: %s",
+                       operation, model, max(left, 0.0), error)
+        raise DeadlineExceeded("處理時間超過上限，請稍後再試") from error
+
+    stats.record(operation, model, RETRY, elapsed, delay)
+    metrics.GEMINI_RETRIES.labels(operation, model).inc()
+    logger.warning("%s: 模型 %s 暫時性錯誤（嘗試 %d/%d，%.2fs），等待 %.1fs 後重試: %s",
+                   operation, model, attempt + 1, max_attempts, elapsed, delay, error)
+    return delay
+
+
+def _queue_wait(left: float | None) -> float:
+    """等待呼叫名額的上限：ADMISSION_MAX_WAIT 與剩餘時間預算的較小者。"""
+    return config.ADMISSION_MAX_WAIT if left is None else min(config.ADMISSION_MAX_WAIT, left)
+
+
+def _shed(operation: str, model: str, error: admission.Overloaded, has_fallback: bool) -> None:
+    """模型忙碌（名額與佇列已滿）：有備用模型就換下一個，否則直接拋出。"""
+    if not has_fallback:
+        raise error
+    _fallback(operation, model, "overloaded", has_fallback)
+    logger.warning("%s: 模型 %s 忙碌中，換下一個模型", operation, model)
+
+
+def _exhausted(operation: str, exhausted_message: str | None, last_error: Exception | None):
+    """
+    所有模型都失敗：有指定訊息時拋出 ValueError，否則拋出最後一次的錯誤；
+    最後是因為模型忙碌而放棄時拋出 Overloaded（API 回傳 503 + Retry-After）。
+    """
+    logger.error("%s: 所有模型都失敗", operation)
+    if last_error is not None and (exhausted_message is None or isinstance(last_error, admission.Overloaded)):
+        raise last_error
+    raise ValueError(exhausted_message or "AI 服務暫時不可用，請稍後再試") from last_error
+
+
+def call(operation: str, models: list[str], attempt_fn, *,
+         max_attempts: int | None = None, exhausted_message: str | None = None):
+    """
+    依序對 models 呼叫 attempt_fn(model, timeout)，每個模型最多 max_attempts 次
+    （多個模型時，呼叫端通常先以 routing.health.order 排序）。
+    timeout 為這次嘗試可用的秒數（剩餘時間預算，未設定 deadline 時為 None），
+    attempt_fn 應以它作為 HTTP 逾時。attempt_fn 可拋出 EmptyResponse 要求重試；
+    成功時回傳 attempt_fn 的結果，時間預算用完時拋出 DeadlineExceeded。
+    每次嘗試期間佔用該模型的 admission 名額（退避等待時不佔用）。
+    """
+    max_attempts = max_attempts or config.RETRY_MAX_ATTEMPTS
+    last_error = None
+    for index, model in enumerate(models):
+        has_fallback = index + 1 < len(models)
+        for attempt in range(max_attempts):
+            left = _attempt_timeout(operation, last_error)
+            elapsed = 0.0  # 還沒呼叫模型就失敗（例如取得名額時出錯）時不沿用上一次嘗試的耗時
+            try:
+                with admission.slot(model, _queue_wait(left)):
+                    timeout = _attempt_timeout(operation, last_error)
+                    started = time.monotonic()
+                    try:
+                        result = attempt_fn(model, timeout)
+                    finally:
+                        elapsed = time.monotonic() - started
+            except DeadlineExceeded:
+                raise
+            except admission.Overloaded as e:
+                last_error = e
+                _shed(operation, model, e, has_fallback)
+                break
+            except Exception as e:
+                last_error = e
+                delay = _after_failure(operation, model, attempt, max_attempts, e, elapsed, has_fallback)
+                if delay is None:
+                    break
+                time.sleep(delay)
+                continue
+            routing.health.record_success(model, elapsed)
+            stats.record(operation, model, "ok", elapsed)
+            logger.info("%s: 模型 %s 完成（嘗試 %d，%.2fs）", operation, model, attempt + 1, elapsed)
+            return result
+
+    _exhausted(operation, exhausted_message, last_error)
+
+
+async def call_async(operation: str, models: list[str], attempt_fn, *,
+                     max_attempts: int | None = None, exhausted_message: str | None = None):
+    """
+    call 的 async 版本：attempt_fn(model, timeout) 回傳 awaitable，等待期間讓出 event loop。
+    超過 timeout 的嘗試會被取消。
+    """
+    max_attempts = max_attempts or config.RETRY_MAX_ATTEMPTS
+    last_error = None
+    for index, model in enumerate(models):
+        has_fallback = index + 1 < len(models)
+        for attempt in range(max_attempts):
+            left = _attempt_timeout(operation, last_error)
+            elapsed = 0.0  # 還沒呼叫模型就失敗（例如取得名額時出錯）時不沿用上一次嘗試的耗時
+            try:
+                async with admission.slot_async(model, _queue_wait(left)):
+                    timeout = _attempt_timeout(operation, last_error)
+                    started = time.monotonic()
+                    try:
+                        result = await asyncio.wait_for(attempt_fn(model, timeout), timeout)
+                    finally:
+                        elapsed = time.monotonic() - started
+            except DeadlineExceeded:
+                raise
+            except admission.Overloaded as e:
+                last_error = e
+                _shed(operation, model, e, has_fallback)
+                break
+            except Exception as e:
+                last_error = e
+                delay = _after_failure(operation, model, attempt, max_attempts, e, elapsed, has_fallback)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                continue
+            routing.health.record_success(model, elapsed)
+            stats.record(operation, model, "ok", elapsed)
+            logger.info("%s: 模型 %s 完成（嘗試 %d，%.2fs）", operation, model, attempt + 1, elapsed)
+            return result
+
+    _exhausted(operation, exhausted_message, last_error)
@@ -0,0 +1,184 @@
+"""
+URBAN 文案機器人 - 模型健康狀態與自適應路由
+每個 worker 內所有執行緒共用一份模型健康狀態：
+- 成功延遲的 EWMA（與最近的延遲樣本，供 hedging 計算百分位數）、錯誤率的 EWMA、連續失敗次數
+- 斷路器 (circuit breaker)：closed → open（暫停使用）→ half_open（冷卻後以少量流量試探）
+路由時優先使用目前最快的健康模型（少量流量隨機探索其他健康模型，讓延遲樣本保持新鮮），
+斷路中的模型排在最後作為最後手段。
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ModelHealth:
+    """單一模型的健康狀態（由 HealthTracker 的 lock 保護）。"""
+
+    def __init__(self):
+        self.latency_ewma: float | None = None
+        self.recent_latencies: deque[float] = deque(maxlen=config.ROUTING_LATENCY_SAMPLES)
+        self.error_rate = 0.0
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_started_at: float | None = None
+
+    def view(self) -> dict:
+        return {
+            "state": self.state,
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "samples": self.samples,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class HealthTracker:
+    """各模型的健康狀態與路由順序。"""
+
+    def __init__(self, alpha: float | None = None, failure_threshold: int | None = None,
+                 error_rate_threshold: float | None = None, min_samples: int | None = None,
+                 cooldown: float | None = None, probe_share: float | None = None,
+                 explore_share: float | None = None, clock=time.monotonic):
+        self.alpha = alpha or config.ROUTING_EWMA_ALPHA
+        self.failure_threshold = failure_threshold or config.CIRCUIT_FAILURE_THRESHOLD
+        self.error_rate_threshold = error_rate_threshold or config.CIRCUIT_ERROR_RATE
+        self.min_samples = min_samples or config.CIRCUIT_MIN_SAMPLES
+        self.cooldown = cooldown or config.CIRCUIT_COOLDOWN_SECONDS
+        self.probe_share = config.CIRCUIT_PROBE_SHARE if probe_share is None else probe_share
+        self.explore_share = config.ROUTING_EXPLORE_SHARE if explore_share is None else explore_share
+        self._clock = clock
+        self._models: dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def _health(self, model: str) -> ModelHealth:
+        health = self._models.get(model)
+        if health is None:
+            health = self._models[model] = ModelHealth()
+        return health
+
+    def _refresh(self, model: str, health: ModelHealth, now: float) -> None:
+        """冷卻時間已過的 open 模型轉為 half_open。"""
+        if health.state == OPEN and now - health.opened_at >= self.cooldown:
+            health.state = HALF_OPEN
+            health.probe_started_at = None
+            logger.info("模型 %s 冷卻結束，開始試探", model)
+
+    def record_success(self, model: str, latency: float) -> None:
+        with self._lock:
+            health = self._health(model)
+            health.samples += 1
+            health.recent_latencies.append(latency)
+            health.latency_ewma = latency if health.latency_ewma is None else (
+                self.alpha * latency + (1 - self.alpha) * health.latency_ewma
+            )
+            health.error_rate *= 1 - self.alpha
+            health.consecutive_failures = 0
+            health.probe_started_at = None
+            if health.state != CLOSED:
+                logger.info("模型 %s 恢復正常", model)
+                health.state = CLOSED
+
+    def record_failure(self, model: str) -> None:
+        """記錄暫時性錯誤（過載、逾時、沒回傳內容）；客戶端參數錯誤不應計入。"""
+        with self._lock:
+            now = self._clock()
+            health = self._health(model)
+            health.samples += 1
+            health.error_rate = self.alpha + (1 - self.alpha) * health.error_rate
+            health.consecutive_failures += 1
+            health.probe_started_at = None
+            tripped = (
+                health.state == HALF_OPEN
+                or health.consecutive_failures >= self.failure_threshold
+                or (health.samples >= self.min_samples and health.error_rate >= self.error_rate_threshold)
+            )
+            if tripped and health.state != OPEN:
+                logger.warning("模型 %s 斷路（連續失敗 %d 次，錯誤率 %.2f），暫停 %.0fs",
+                               model, health.consecutive_failures, health.error_rate, self.cooldown)
+            if tripped:
+                health.state = OPEN
+                health.opened_at = now
+
+    def mark_missing(self, model: str) -> None:
+        """模型不存在 (404)：直接斷路，冷卻後再試探。"""
+        with self._lock:
+            health = self._health(model)
+            health.state = OPEN
+            health.opened_at = self._clock()
+            health.probe_started_at = None
+
+    def latency_percentile(self, model: str, percentile: float, min_samples: int) -> float | None:
+        """最近成功延遲的百分位數（percentile 為 0~1）；樣本不足 min_samples 時回傳 None。"""
+        with self._lock:
+            samples = sorted(self._health(model).recent_latencies)
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(percentile * len(samples)))]
+
+    def is_open(self, model: str) -> bool:
+        with self._lock:
+            health = self._health(model)
+            self._refresh(model, health, self._clock())
+            return health.state == OPEN
+
+    def order(self, models: list[str]) -> list[str]:
+        """
+        回傳這次請求的模型嘗試順序：
+        有延遲樣本的健康模型彼此依延遲 EWMA 由快到慢排列（同分維持設定順序），尚無樣本的模型留在設定順序的位置
+        （worker 剛啟動時仍由設定的主要模型先試）；
+        以 explore_share 的機率改由另一個健康模型先試，讓較慢或尚無樣本的模型也能取得新樣本；
+        half_open 模型以 probe_share 的機率排到最前面試探（同時只有一個試探），否則排在健康模型之後；
+        open 模型排在最後，所有模型都斷路時仍有模型可試。
+        """
+        with self._lock:
+            now = self._clock()
+            closed, half_open, opened = [], [], []
+            for index, model in enumerate(models):
+                health = self._health(model)
+                self._refresh(model, health, now)
+                if health.state == CLOSED:
+                    closed.append((health.latency_ewma, index, model))
+                elif health.state == HALF_OPEN:
+                    half_open.append(model)
+                else:
+                    opened.append((health.opened_at, model))
+
+            # 有樣本的模型依延遲重新分配到它們原本佔的位置，沒有樣本的模型位置不變
+            by_latency = iter(sorted(entry for entry in closed if entry[0] is not None))
+            ordered = [model if latency is None else next(by_latency)[2] for latency, _, model in closed]
+            if len(ordered) > 1 and random.random() < self.explore_share:
+                ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+            for model in half_open:
+                health = self._models[model]
+                probe_idle = health.probe_started_at is None or now - health.probe_started_at >= self.cooldown
+                if probe_idle and random.random() < self.probe_share:
+                    health.probe_started_at = now
+                    ordered.insert(0, model)
+                else:
+                    ordered.append(model)
+            # 最早斷路的模型最接近恢復，排在前面
+            ordered.extend(model for _, model in sorted(opened))
+            return ordered
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = self._clock()
+            for model, health in self._models.items():
+                self._refresh(model, health, now)
+            return {model: health.view() for model, health in self._models.items()}
+
+
+health = HealthTracker()
@@ -0,0 +1,127 @@
+"""
+URBAN 文案機器人 - 請求階段計時 (Server-Timing)
+請求開始時以 contextvar 建立 Trace，各階段以 span() 計時（例如 parse、b64decode、
+short_caption、design_ai；每次 Gemini 嘗試由 retry 記錄為 gemini），
+回應時加上 Server-Timing 標頭，並可選擇每個請求輸出一行 JSON log。
+未啟用時 span() 只多一次 contextvar 讀取，回傳共用的空 context manager。
+batch 的執行緒與 hedge 的 event loop 都複製 context，記錄到同一個 Trace。
+"""
+
+import contextvars
+import json
+import logging
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """單一請求的各階段耗時。"""
+
+    __slots__ = ("started", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: list[tuple[str, float, str | None]] = []
+
+
+_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("request_trace", default=None)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "desc", "started")
+
+    def __init__(self, trace: Trace, name: str, desc: str | None):
+        self.trace = trace
+        self.name = name
+        self.desc = desc
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.spans.append((self.name, time.perf_counter() - self.started, self.desc))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enabled() -> bool:
+    return config.SERVER_TIMING_ENABLED or config.SERVER_TIMING_LOG
+
+
+def start() -> contextvars.Token | None:
+    """請求開始：未啟用時回傳 None。"""
+    return _trace.set(Trace()) if enabled() else None
+
+
+def attach(trace: Trace | None) -> contextvars.Token | None:
+    """在另一個 context 沿用同一個 trace（例如請求結束後才開始送出的串流）；trace 為 None 時回傳 None。"""
+    return _trace.set(trace) if trace is not None else None
+
+
+def reset(token: contextvars.Token) -> None:
+    _trace.reset(token)
+
+
+def current() -> Trace | None:
+    return _trace.get()
+
+
+def span(name: str, desc: str | None = None):
+    """計時一個階段：with timing.span("b64decode"): ..."""
+    trace = _trace.get()
+    return _NO_SPAN if trace is None else _Span(trace, name, desc)
+
+
+def record(name: str, seconds: float, desc: str | None = None) -> None:
+    """記錄已量好的耗時（例如 retry 每次嘗試的 elapsed）。"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append((name, seconds, desc))
+
+
+def _quote(desc: str) -> str:
+    return '"' + desc.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def server_timing(trace: Trace, total: float) -> str:
+    """Server-Timing 標頭值，例如 parse;dur=3.1, gemini;dur=8123.4;desc="design_with_ai ...", total;dur=8200.0"""
+    entries = [
+        f"{name};dur={seconds * 1000:.1f}" + (f";desc={_quote(desc)}" if desc else "")
+        for name, seconds, desc in trace.spans
+    ]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def finish(trace: Trace, headers, method: str, path: str, status: int) -> None:
+    """回應前呼叫：加上 Server-Timing 標頭，SERVER_TIMING_LOG 時輸出一行 JSON log。"""
+    total = time.perf_counter() - trace.started
+    if config.SERVER_TIMING_ENABLED:
+        headers["Server-Timing"] = server_timing(trace, total)
+    if config.SERVER_TIMING_LOG:
+        logger.info(json.dumps({
+            "method": method,
+            "path": path,
+            "status": status,
+            "total_ms": round(total * 1000, 1),
+            "spans": [
+                {"name": name, "ms": round(seconds * 1000, 1), **({"desc": desc} if desc else {})}
+                for name, seconds, desc in trace.spans
+            ],
+        }, ensure_ascii=False))